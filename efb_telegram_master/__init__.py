@@ -4,6 +4,8 @@ import html
 import logging
 import mimetypes
 import os
+import threading
+import time
 from gettext import NullTranslations, translation
 from typing import Optional
 from xmlrpc.server import SimpleXMLRPCServer
@@ -25,11 +27,15 @@ from . import utils as etm_utils
 from .bot_manager import TelegramBotManager
 from .chat_binding import ChatBindingManager, ETMChat
 from .commands import CommandsManager
-from .db import DatabaseManager
+from .db import BaseDatabaseManager, DatabaseManager
 from .global_command_handler import GlobalCommandHandler
 from .master_message import MasterMessageProcessor
+from .memory_db import MemoryDatabaseManager
+from .message_lookup import MessageLookupManager
+from .message_search import MessageSearchManager
 from .rpc_utils import RPCUtilities
 from .slave_message import SlaveMessageProcessor
+from .snapshot import SnapshotManager
 from .utils import ExperimentalFlagsManager
 from .voice_recognition import VoiceRecognitionManager
 
@@ -82,6 +88,8 @@ class TelegramChannel(EFBChannel):
 
     # Constants
     config = None
+    # Minimum seconds between two progress updates of /backup
+    backup_progress_interval = 5
 
     # Slave-only channels
     get_chat = None
@@ -127,13 +135,22 @@ class TelegramChannel(EFBChannel):
 
         # Initialize managers
         self.flag: ExperimentalFlagsManager = ExperimentalFlagsManager(self)
-        self.db: DatabaseManager = DatabaseManager(self)
+        self.db: BaseDatabaseManager
+        if self.config.get('storage', 'sqlite') == 'memory':
+            self.db = MemoryDatabaseManager(self)
+        else:
+            self.db = DatabaseManager(self)
         self.bot_manager: TelegramBotManager = TelegramBotManager(self)
         # self.voice_recognition: VoiceRecognitionManager = VoiceRecognitionManager(self)
         self.chat_binding: ChatBindingManager = ChatBindingManager(self)
         self.commands: CommandsManager = CommandsManager(self)
+        self.message_search: MessageSearchManager = MessageSearchManager(self)
         self.master_messages: MasterMessageProcessor = MasterMessageProcessor(self)
         self.slave_messages: SlaveMessageProcessor = SlaveMessageProcessor(self)
+        self.message_lookup: MessageLookupManager = MessageLookupManager(self)
+        self.snapshot: SnapshotManager = SnapshotManager(self)
+        if self.flag('warm_start'):
+            self.snapshot.load()
 
         if not self.flag('auto_locale'):
             self.translator = translation("efb_telegram_master",
@@ -147,6 +164,8 @@ class TelegramChannel(EFBChannel):
             telegram.ext.CommandHandler("help", self.help))
         self.bot_manager.dispatcher.add_handler(
             GlobalCommandHandler("info", self.info))
+        self.bot_manager.dispatcher.add_handler(
+            telegram.ext.CommandHandler("backup", self.backup))
         self.bot_manager.dispatcher.add_handler(
             telegram.ext.CallbackQueryHandler(self.bot_manager.session_expired))
 
@@ -190,6 +209,20 @@ class TelegramChannel(EFBChannel):
                     raise ValueError(self._('Admin ID is expected to be an int, but {data} is found.')
                                      .format(data=data['admins'][i]))
 
+            if data.get('storage', 'sqlite') not in ('sqlite', 'memory'):
+                raise ValueError(self._('Storage engine must be either "sqlite" or "memory".'))
+
+            if not isinstance(data.get('mirrors', []), (list, type(None))):
+                raise ValueError(self._("Mirrors must be a list of destinations."))
+            for i in data.get('mirrors') or ():
+                if not isinstance(i, dict) or not isinstance(i.get('chat_id', None), int):
+                    raise ValueError(self._('Mirror destination is expected to have an int chat_id, '
+                                            'but {data} is found.').format(data=i))
+                for key in ('chats', 'exclude_chats', 'types'):
+                    if not isinstance(i.get(key, []), list):
+                        raise ValueError(self._('{key} of mirror destination {chat_id} must be a list.')
+                                         .format(key=key, chat_id=i['chat_id']))
+
             self.config = data.copy()
 
     def info(self, bot, update):
@@ -286,12 +319,12 @@ class TelegramChannel(EFBChannel):
                      update.effective_message.forward_from_chat.type == telegram.Chat.CHANNEL):
                 self.chat_binding.link_chat(update, args)
             else:
-                self.bot_manager.send_message(update.effective_chat.id,
-                                              self._('You cannot link remote chats to here. Please try again.'))
+                self.bot_manager.send_message_async(update.effective_chat.id,
+                                                    self._('You cannot link remote chats to here. Please try again.'))
         else:
             txt = self._("This is EFB Telegram Master Channel.\n\n"
                          "To learn more, please visit https://github.com/blueset/efb-telegram-master .")
-            self.bot_manager.send_message(update.effective_chat.id, txt)
+            self.bot_manager.send_message_async(update.effective_chat.id, txt)
 
     def help(self, bot, update):
         txt = self._("EFB Telegram Master Channel\n"
@@ -305,8 +338,16 @@ class TelegramChannel(EFBChannel):
                      "    List all additional features from slave channels.\n"
                      "/unlink_all\n"
                      "    Unlink all remote chats in this chat.\n"
+                     "/link_bulk\n"
+                     "    Link, unlink or mute remote chats listed in a file.\n"
+                     "    Sent in reply to the file.\n"
                      "/info\n"
                      "    Show information of the current Telegram chat.\n"
+                     "/search\n"
+                     "    Search for delivered messages.\n"
+                     "    Followed by keywords to search for.\n"
+                     "/backup\n"
+                     "    Back up the database without stopping the bot.\n"
                      "/update_info\n"
                      "    Update name and profile picture a linked Telegram group.\n"
                      "    Only works in singly linked group where the bot is an admin.\n"
@@ -314,6 +355,42 @@ class TelegramChannel(EFBChannel):
                      "    Print this command list.")
         bot.send_message(update.message.from_user.id, txt)
 
+    def backup(self, bot, update):
+        """
+        Back up the database in background, and report progress in a message.
+        Triggered by `/backup`.
+
+        Args:
+            bot: Telegram Bot instance
+            update: Message update
+        """
+        chat_id = update.effective_chat.id
+        message_id = self.bot_manager.send_message(chat_id, self._("Backing up the database...")).message_id
+        threading.Thread(target=self._backup_worker, args=(chat_id, message_id),
+                         name="ETM database backup").start()
+
+    def _backup_worker(self, chat_id: int, message_id: int):
+        last_update = time.time()
+
+        def progress(copied: int, total: int):
+            nonlocal last_update
+            if not total or time.time() - last_update < self.backup_progress_interval:
+                return
+            last_update = time.time()
+            self.bot_manager.edit_message_text_async(
+                chat_id=chat_id, message_id=message_id,
+                text=self._("Backing up the database... {percentage:.0%}").format(percentage=copied / total))
+
+        try:
+            result = self.db.backup(progress=progress)
+            text = self._("Database is backed up to {path} in {seconds:.1f} seconds.").format(**result)
+        except NotImplementedError as e:
+            text = self._("Backup is not available: {reason}").format(reason=e)
+        except Exception as e:
+            self.logger.exception("Failed to back up the database: %s", e)
+            text = self._("Failed to back up the database: {error}").format(error=e)
+        self.bot_manager.edit_message_text_async(chat_id=chat_id, message_id=message_id, text=text)
+
     def poll(self):
         """
         Message polling process.
@@ -330,7 +407,7 @@ class TelegramChannel(EFBChannel):
             msg = self._('Conflicted polling detected. If this error persists, '
                          'please ensure you are running only one instance of this Telegram bot.')
             self.logger.critical(msg)
-            self.bot_manager.send_message(self.config['admins'][0], msg)
+            self.bot_manager.send_message_async(self.config['admins'][0], msg)
             return
         if "Invalid server response" in str(error) and not update:
             self.logger.error("Boom! Telegram API is no good. (Invalid server response.)")
@@ -344,11 +421,11 @@ class TelegramChannel(EFBChannel):
                 self.logger.error("Chill bro, don't click that fast.")
             else:
                 self.logger.error("Message request is invalid.\n%s\n%s", str(update), str(error))
-                self.bot_manager.send_message(self.config['admins'][0],
-                                              self._("Message request is invalid.\n{error}\n"
-                                                     "<code>{update}</code>").format(
-                                                  error=html.escape(str(error)), update=html.escape(str(update))),
-                                              parse_mode="HTML")
+                self.bot_manager.send_message_async(self.config['admins'][0],
+                                                    self._("Message request is invalid.\n{error}\n"
+                                                           "<code>{update}</code>").format(
+                                                        error=html.escape(str(error)), update=html.escape(str(update))),
+                                                    parse_mode="HTML")
         except (telegram.error.TimedOut, telegram.error.NetworkError):
             self.timeout_count += 1
             self.logger.error("Poor internet connection detected.\n"
@@ -363,27 +440,28 @@ class TelegramChannel(EFBChannel):
 
             timeout_interval = self.flag('network_error_prompt_interval')
             if timeout_interval > 0 and self.timeout_count % timeout_interval == 0:
-                self.bot_manager.send_message(self.config['admins'][0],
-                                              self.ngettext("<b>EFB Telegram Master channel</b>\n"
-                                                            "You may have a poor internet connection on your server. "
-                                                            "Currently {count} network error is detected.\n"
-                                                            "For more details, please refer to the log.",
-                                                            "<b>EFB Telegram Master channel</b>\n"
-                                                            "You may have a poor internet connection on your server. "
-                                                            "Currently {count} network errors are detected.\n"
-                                                            "For more details, please refer to the log.",
-                                                            self.timeout_count).format(
-                                                  count=self.timeout_count),
-                                              parse_mode="HTML")
+                self.bot_manager.send_message_async(self.config['admins'][0],
+                                                    self.ngettext("<b>EFB Telegram Master channel</b>\n"
+                                                                  "You may have a poor internet connection "
+                                                                  "on your server. "
+                                                                  "Currently {count} network error is detected.\n"
+                                                                  "For more details, please refer to the log.",
+                                                                  "<b>EFB Telegram Master channel</b>\n"
+                                                                  "You may have a poor internet connection "
+                                                                  "on your server. "
+                                                                  "Currently {count} network errors are detected.\n"
+                                                                  "For more details, please refer to the log.",
+                                                                  self.timeout_count).format(
+                                                        count=self.timeout_count),
+                                                    parse_mode="HTML")
         except telegram.error.ChatMigrated as e:
             new_id = e.new_chat_id
             old_id = update.message.chat_id
-            count = 0
-            for i in self.db.get_chat_assoc(master_uid=etm_utils.chat_id_to_str(self.channel_id, old_id)):
-                self.logger.debug('Migrating slave chat %s from Telegram chat %s to %s.', i, old_id, new_id)
-                self.db.remove_chat_assoc(slave_uid=i)
-                self.db.add_chat_assoc(master_uid=etm_utils.chat_id_to_str(self.channel_id, new_id), slave_uid=i)
-                count += 1
+            slave_uids = self.db.get_chat_assoc(master_uid=etm_utils.chat_id_to_str(self.channel_id, old_id))
+            self.logger.debug('Migrating slave chats %s from Telegram chat %s to %s.', slave_uids, old_id, new_id)
+            count = self.db.update_chat_assoc(
+                {"action": "link", "slave_uid": i, "multiple_slave": True,
+                 "master_uid": etm_utils.chat_id_to_str(self.channel_id, new_id)} for i in slave_uids)
             bot.send_message(new_id, self.ngettext("Chat migration detected.\n"
                                                    "All {count} remote chat are now linked to this new group.",
                                                    "Chat migration detected.\n"
@@ -411,11 +489,14 @@ class TelegramChannel(EFBChannel):
         return self.slave_messages.send_status(status)
 
     def get_message_by_id(self, msg_id: str) -> Optional['EFBMsg']:
-        # TODO: implement this method
-        pass
+        return self.message_lookup.get_message_by_id(msg_id)
 
     def stop_polling(self):
         self.logger.debug("Gracefully stopping %s (%s).", self.channel_name, self.channel_id)
         self.rpc_utilities.shutdown()
+        self.slave_messages.mirrors.stop()
         self.bot_manager.graceful_stop()
+        self.db.graceful_stop()
+        if self.flag('warm_start'):
+            self.snapshot.save()
         self.logger.debug("%s (%s) gracefully stopped.", self.channel_name, self.channel_id)
@@ -0,0 +1,30 @@
+# coding=utf-8
+
+from typing import TYPE_CHECKING
+
+from telegram import Update
+from telegram.ext.handler import Handler
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+
+
+class ActivityHandler(Handler):
+    """
+    Handler class that records the time of every update processed by
+    the dispatcher, so that background database maintenance can tell
+    when the bot is idle. It never handles any update.
+
+    Args:
+        channel (TelegramChannel): The ETM channel object.
+    """
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel = channel
+
+    def check_update(self, update: Update):
+        self.channel.db.mark_activity()
+        return False
+
+    def handle_update(self, update, dispatcher):
+        pass
@@ -3,15 +3,20 @@ import collections
 import io
 import logging
 import os
+from concurrent.futures import Future
 
 import telegram
 import telegram.ext
 import telegram.error
 import telegram.constants
-from retrying import retry
 
-from typing import Optional, List, TYPE_CHECKING, Callable
+from typing import Any, IO, Optional, List, TYPE_CHECKING, Callable
 from .whitelisthandler import WhitelistHandler
+from .activity_handler import ActivityHandler
+from .chat_action import ChatActionManager
+from .rate_limiter import OutboundScheduler, Priority
+from .retry_policy import RetryEngine
+from .update_tracker import UpdateTracker, UpdateDedupHandler, UpdateCheckpointHandler
 from .locale_handler import LocaleHandler
 from .locale_mixin import LocaleMixin
 
@@ -31,26 +36,9 @@ class TelegramBotManager(LocaleMixin):
         dispatcher (telegram.ext.Dispatcher): Dispatcher of the updater
     """
 
-    webhook = False
-
-    class Decorators:
-        logger = logging.getLogger(__name__)
-
-        enabled = False
+    logger = logging.getLogger(__name__)
 
-        @classmethod
-        def exception_filter(cls, exception):
-            cls.logger.error("Exception: %s while sending request to Telegram server.")
-            return isinstance(exception, telegram.error.TimedOut)
-
-        @classmethod
-        def retry_on_timeout(cls, fn):
-            """Infinitely retry for timed-out exceptions."""
-            if not cls.enabled:
-                return fn
-            cls.logger.debug("Trying to call %s with infinite retry.", fn)
-            return retry(wait_exponential_multiplier=1e3, wait_exponential_max=180e3,
-                         retry_on_exception=cls.exception_filter)(fn)
+    webhook = False
 
     def __init__(self, channel: 'TelegramChannel'):
         self.channel: 'TelegramChannel' = channel
@@ -72,14 +60,111 @@ class TelegramBotManager(LocaleMixin):
                     set_webhook['certificate'] = open(set_webhook['certificate'], 'rb')
                 self.updater.bot.set_webhook(**set_webhook)
 
+        # Retries of failed requests, and scheduler of outbound requests
+        # within rate limits of Telegram
+        self.retry: RetryEngine = RetryEngine(channel.flag('retry_on_error'))
+        self.scheduler: Optional[OutboundScheduler] = None
+        if channel.flag('send_rate_limit'):
+            self.scheduler = OutboundScheduler(self.retry)
+        self.chat_actions: ChatActionManager = ChatActionManager(self)
+
         self.me: telegram.User = self.updater.bot.get_me()
         self.admins: List[int] = config['admins']
         self.dispatcher: telegram.ext.Dispatcher = self.updater.dispatcher
+        # Drop updates processed before, and record those processed,
+        # in groups before and after all other handlers.
+        self.update_tracker: UpdateTracker = UpdateTracker(channel)
+        self.dispatcher.add_handler(UpdateDedupHandler(self.update_tracker), group=-1)
+        self.dispatcher.add_handler(UpdateCheckpointHandler(self.update_tracker), group=1)
         self.dispatcher.add_handler(WhitelistHandler(self.admins))
+        self.dispatcher.add_handler(ActivityHandler(channel))
         self.dispatcher.add_handler(LocaleHandler(channel))
-        self.Decorators.enabled = channel.flag('retry_on_error')
 
-    @Decorators.retry_on_timeout
+    def submit(self, method: str, *args, priority: int = Priority.NORMAL, **kwargs) -> Future:
+        """
+        Schedule a call of a method of the bot, within rate limits of
+        Telegram when ``send_rate_limit`` is enabled. Failed calls are
+        retried as decided by :attr:`retry`.
+
+        Args:
+            method (str): Name of the method of ``telegram.Bot``
+            priority (int): Priority of the request, see :class:`.rate_limiter.Priority`.
+                Default: ``Priority.NORMAL``
+
+        Takes the same parameters as the method of ``telegram.Bot`` besides.
+
+        Returns:
+            concurrent.futures.Future: Future of the result of the method.
+        """
+        fn = getattr(self.updater.bot, method)
+        chat_id = args[0] if args else kwargs.get('chat_id')
+        if self.scheduler is None:
+            future = Future()
+            try:
+                future.set_result(self.retry.call(method, fn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            # Chat actions are shown while other requests to the chat are sent
+            future = self.scheduler.submit(fn, *args, chat_id=chat_id, priority=priority,
+                                           ordered=method != "send_chat_action", **kwargs)
+        if method != "send_chat_action" and chat_id is not None:
+            # Chat action is over once a request to the chat is completed
+            future.add_done_callback(lambda _: self.chat_actions.clear(chat_id))
+        return future
+
+    def _call(self, priority: int, method: str, *args, **kwargs) -> Future:
+        """Call a method of the bot through the scheduler, and return the future of the result."""
+        return self.submit(method, *args, priority=priority, **kwargs)
+
+    @staticmethod
+    def _chain(future: Future, on_result: Optional[Callable] = None,
+               on_error: Optional[Callable[[Exception], Any]] = None) -> Future:
+        """
+        Future of the result of ``future`` passed to ``on_result``, or of
+        its error passed to ``on_error``, without waiting for it. Both
+        return the new result, or a future of it, or raise an error.
+        """
+        chained = Future()
+
+        def done(f: Future, on_result: Optional[Callable], on_error: Optional[Callable]):
+            try:
+                try:
+                    value = f.result()
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    value = on_error(e)
+                else:
+                    if on_result is not None:
+                        value = on_result(value)
+            except Exception as e:
+                chained.set_exception(e)
+                return
+            if isinstance(value, Future):
+                value.add_done_callback(lambda i: done(i, None, None))
+            else:
+                chained.set_result(value)
+
+        future.add_done_callback(lambda i: done(i, on_result, on_error))
+        return chained
+
+    def _log_failure(self, method: str, future: Future) -> Future:
+        """Log the error of a request whose result is not waited for."""
+        def done(f: Future):
+            if not f.cancelled() and f.exception() is not None:
+                self.logger.error("Failed to %s: %r", method, f.exception())
+
+        future.add_done_callback(done)
+        return future
+
+    def _send_full_text(self, chat_id, full_message: IO, filename: str, msg: telegram.Message,
+                        caption: str) -> telegram.Message:
+        """Send the full text of a truncated message as an attachment replying to it, without waiting."""
+        self._log_failure("send_document", self._call(Priority.NORMAL, "send_document", chat_id, full_message,
+                                                      filename, reply_to_message_id=msg.message_id, caption=caption))
+        return msg
+
     def send_message(self, *args, prefix: Optional[str] = '', suffix: Optional[str] = '', **kwargs):
         """
         Send text message.
@@ -94,6 +179,19 @@ class TelegramBotManager(LocaleMixin):
         Returns:
             telegram.Message
         """
+        return self._send_message(*args, prefix=prefix, suffix=suffix, **kwargs).result()
+
+    def send_message_async(self, *args, **kwargs) -> Future:
+        """
+        Send text message without waiting for it to be sent, and log
+        the error if it fails. Takes exactly same parameters as :meth:`send_message`.
+
+        Returns:
+            concurrent.futures.Future: Future of the ``telegram.Message`` sent.
+        """
+        return self._log_failure("send_message", self._send_message(*args, **kwargs))
+
+    def _send_message(self, *args, prefix: Optional[str] = '', suffix: Optional[str] = '', **kwargs) -> Future:
         prefix = (prefix and (prefix + "\n")) or prefix
         suffix = (suffix and ("\n" + suffix)) or suffix
         text = (args[1:] and args[1]) or kwargs.pop('text', '')
@@ -101,26 +199,24 @@ class TelegramBotManager(LocaleMixin):
         if len(prefix + text + suffix) >= telegram.constants.MAX_MESSAGE_LENGTH:
             full_message = io.StringIO(prefix + text + suffix)
             truncated = prefix + text[:100] + "\n...\n" + text[-100:] + suffix
-            msg = self._bot_send_message_fallback(args[0], text=truncated, **kwargs)
-            filename = "%s_%s" % (args[0], msg.message_id)
             if not kwargs.get('parse_mode'):
-                filename += ".txt"
+                ext = ".txt"
             elif kwargs.get('parse_mode', '').lower() == 'markdown':
-                filename += ".md"
+                ext = ".md"
             elif kwargs.get('parse_mode', '').lower() == 'html':
-                filename += ".html"
+                ext = ".html"
             else:
-                filename += ".txt"
-            self.updater.bot.send_document(args[0], full_message, filename,
-                                           reply_to_message_id=msg.message_id,
-                                           caption=self._("Message is truncated due to its length. "
-                                                          "Full message is sent as attachment."))
-            return msg
+                ext = ".txt"
+            caption = self._("Message is truncated due to its length. "
+                             "Full message is sent as attachment.")
+            return self._chain(self._bot_send_message_fallback(args[0], text=truncated, **kwargs),
+                               lambda msg: self._send_full_text(args[0], full_message,
+                                                                "%s_%s%s" % (args[0], msg.message_id, ext),
+                                                                msg, caption))
         else:
             kwargs['text'] = prefix + text + suffix
             return self._bot_send_message_fallback(*args, **kwargs)
 
-    @Decorators.retry_on_timeout
     def edit_message_text(self, *args, prefix='', suffix='', **kwargs):
         """
         Edit text message.
@@ -134,67 +230,81 @@ class TelegramBotManager(LocaleMixin):
         Returns:
             telegram.Message
         """
+        return self._edit_message_text(*args, prefix=prefix, suffix=suffix, **kwargs).result()
+
+    def edit_message_text_async(self, *args, **kwargs) -> Future:
+        """
+        Edit text message without waiting for it to be edited, and log
+        the error if it fails. Takes exactly same parameters as :meth:`edit_message_text`.
+
+        Returns:
+            concurrent.futures.Future: Future of the ``telegram.Message`` edited.
+        """
+        return self._log_failure("edit_message_text", self._edit_message_text(*args, **kwargs))
+
+    def _edit_message_text(self, *args, prefix='', suffix='', **kwargs) -> Future:
         prefix = (prefix and (prefix + "\n")) or prefix
         suffix = (suffix and ("\n" + suffix)) or suffix
         text = kwargs.pop('text', '')
         if len(prefix + text + suffix) >= telegram.constants.MAX_MESSAGE_LENGTH:
             full_message = io.BytesIO((prefix + text + suffix).encode())
             truncated = prefix + text[:100] + "\n...\n" + text[-100:] + suffix
-            msg = self._bot_edit_message_text_fallback(truncated, **kwargs)
-            filename = "%s_%s" % (kwargs['chat_id'], msg.message_id)
             if kwargs.get('parse_mode', '').lower() == 'markdown':
-                filename += ".md"
+                ext = ".md"
             elif kwargs.get('parse_mode', '').lower() == 'html':
-                filename += ".html"
+                ext = ".html"
             else:
-                filename += ".txt"
-            self.updater.bot.send_document(kwargs['chat_id'], full_message, filename,
-                                           reply_to_message_id=msg.message_id,
-                                           caption=self._("Message is truncated due to its length. "
-                                                          "Full message is sent as attachment."))
-            return msg
+                ext = ".txt"
+            caption = self._("Message is truncated due to its length. "
+                             "Full message is sent as attachment.")
+            return self._chain(self._bot_edit_message_text_fallback(truncated, **kwargs),
+                               lambda msg: self._send_full_text(kwargs['chat_id'], full_message,
+                                                                "%s_%s%s" % (kwargs['chat_id'], msg.message_id, ext),
+                                                                msg, caption))
         else:
             kwargs['text'] = prefix + text + suffix
             return self._bot_edit_message_text_fallback(*args, **kwargs)
 
-    def _bot_send_message_fallback(self, *args, **kwargs):
+    def _bot_send_message_fallback(self, *args, **kwargs) -> Future:
         """
         Remove ``parse_mode`` if the server fails to parse.
         
         Returns:
-            telegram.Message: The message sent
+            concurrent.futures.Future: Future of the message sent
         """
-        try:
-            return self.updater.bot.send_message(*args, **kwargs)
-        except telegram.error.BadRequest as e:
-            if e.message.startswith("can't parse entities") and 'parse_mode' in kwargs:
+        def fallback(e: Exception):
+            if isinstance(e, telegram.error.BadRequest) and \
+                    e.message.startswith("can't parse entities") and 'parse_mode' in kwargs:
                 kwargs.pop("parse_mode")
-                return self.updater.bot.send_message(*args, **kwargs)
-            else:
-                raise e
+                return self._call(Priority.NORMAL, "send_message", *args, **kwargs)
+            raise e
+
+        return self._chain(self._call(Priority.NORMAL, "send_message", *args, **kwargs), on_error=fallback)
 
-    def _bot_edit_message_text_fallback(self, *args, **kwargs):
+    def _bot_edit_message_text_fallback(self, *args, **kwargs) -> Future:
         """
         Remove ``parse_mode`` if the server fails to parse.
 
         Returns:
-            telegram.Message: The message sent
+            concurrent.futures.Future: Future of the message sent
         """
-        try:
-            return self.updater.bot.edit_message_text(*args, **kwargs)
-        except telegram.error.BadRequest as e:
+        def fallback(e: Exception):
+            if not isinstance(e, telegram.error.BadRequest):
+                raise e
             if e.message == "Message can't be edited":
                 kwargs['reply_to_message_id'] = kwargs.pop('message_id')
-                return self.updater.bot.send_message(*args, **kwargs)
+                return self._call(Priority.NORMAL, "send_message", *args, **kwargs)
             elif e.message == "message to edit not found":
                 kwargs.pop('message_id')
-                return self.updater.bot.send_message(*args, **kwargs)
+                return self._call(Priority.NORMAL, "send_message", *args, **kwargs)
             elif e.message.startswith("can't parse entities") and 'parse_mode' in kwargs:
                 kwargs.pop("parse_mode")
-                return self.updater.bot.edit_message_text(*args, **kwargs)
+                return self._call(Priority.HIGH, "edit_message_text", *args, **kwargs)
             else:
                 raise e
 
+        return self._chain(self._call(Priority.HIGH, "edit_message_text", *args, **kwargs), on_error=fallback)
+
     # @Decorator
     def caption_affix_decorator(fn: Callable):
         def caption_affix(self, *args, **kwargs):
@@ -219,19 +329,15 @@ class TelegramBotManager(LocaleMixin):
                 truncated = prefix + text[:100] + "\n...\n" + text[:-100] + suffix
                 kwargs['caption'] = truncated
                 msg = fn(self, *args, **kwargs)
-                filename = "%s_%s.txt" % (args[0], msg.message_id)
-                self.updater.bot.send_document(args[0], full_message, filename,
-                                               reply_to_message_id=msg.message_id,
-                                               caption=self._("Caption is truncated due to its length. "
-                                                              "Full message is sent as attachment."))
-                return msg
+                return self._send_full_text(args[0], full_message, "%s_%s.txt" % (args[0], msg.message_id), msg,
+                                            self._("Caption is truncated due to its length. "
+                                                   "Full message is sent as attachment."))
             else:
                 kwargs['caption'] = prefix + text + suffix
                 return fn(self, *args, **kwargs)
 
         return caption_affix
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_picture(self, *args, **kwargs):
         """
@@ -250,11 +356,10 @@ class TelegramBotManager(LocaleMixin):
             telegram.Message
         """
         try:
-            return self.updater.bot.send_picture(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_picture", *args, **kwargs).result()
         except telegram.error.BadRequest:
-            return self.updater.bot.send_document(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_document", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_audio(self, *args, **kwargs):
         """
@@ -273,11 +378,10 @@ class TelegramBotManager(LocaleMixin):
             telegram.Message
         """
         try:
-            return self.updater.bot.send_audio(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_audio", *args, **kwargs).result()
         except telegram.error.BadRequest:
-            return self.updater.bot.send_document(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_document", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_voice(self, *args, **kwargs):
         """
@@ -296,11 +400,10 @@ class TelegramBotManager(LocaleMixin):
             telegram.Message
         """
         try:
-            return self.updater.bot.send_voice(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_voice", *args, **kwargs).result()
         except telegram.error.BadRequest:
-            return self.updater.bot.send_document(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_document", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_video(self, *args, **kwargs):
         """
@@ -319,11 +422,10 @@ class TelegramBotManager(LocaleMixin):
             telegram.Message
         """
         try:
-            return self.updater.bot.send_video(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_video", *args, **kwargs).result()
         except telegram.error.BadRequest:
-            return self.updater.bot.send_document(*args, **kwargs)
+            return self._call(Priority.NORMAL, "send_document", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_document(self, *args, **kwargs):
         """
@@ -339,9 +441,8 @@ class TelegramBotManager(LocaleMixin):
         Returns:
             telegram.Message
         """
-        return self.updater.bot.send_document(*args, **kwargs)
+        return self._call(Priority.NORMAL, "send_document", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def send_photo(self, *args, **kwargs):
         """
@@ -357,17 +458,24 @@ class TelegramBotManager(LocaleMixin):
         Returns:
             telegram.Message
         """
-        return self.updater.bot.send_photo(*args, **kwargs)
+        return self._call(Priority.NORMAL, "send_photo", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
-    def send_chat_action(self, *args, **kwargs):
-        return self.updater.bot.send_chat_action(*args, **kwargs)
+    def send_chat_action(self, chat_id, action, size: Optional[int] = None):
+        """
+        Show a chat action before the next message sent to the chat,
+        if it takes a while to be sent. See :class:`.chat_action.ChatActionManager`.
+
+        Args:
+            chat_id: Telegram chat ID
+            action (str): Chat action, see ``telegram.ChatAction``
+            size (Optional[int]): Size of the file to upload in bytes, if known.
+        """
+        self.chat_actions.request(chat_id, action, size)
+        return True
 
-    @Decorators.retry_on_timeout
     def send_venue(self, *args, **kwargs):
-        return self.updater.bot.send_venue(*args, **kwargs)
+        return self._call(Priority.NORMAL, "send_venue", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     def get_me(self, *args, **kwargs):
         return self.updater.bot.get_me(*args, **kwargs)
 
@@ -376,14 +484,20 @@ class TelegramBotManager(LocaleMixin):
                                chat_id=update.effective_chat.id,
                                message_id=update.effective_message.message_id)
 
-    @Decorators.retry_on_timeout
     @caption_affix_decorator
     def edit_message_caption(self, *args, **kwargs):
-        return self.updater.bot.edit_message_caption(*args, **kwargs)
+        return self._call(Priority.HIGH, "edit_message_caption", *args, **kwargs).result()
 
-    @Decorators.retry_on_timeout
     def edit_message_media(self, *args, **kwargs):
-        return self.updater.bot.edit_message_media(*args, **kwargs)
+        return self._call(Priority.HIGH, "edit_message_media", *args, **kwargs).result()
+
+    def edit_message_reply_markup(self, *args, **kwargs):
+        return self._call(Priority.HIGH, "edit_message_reply_markup", *args, **kwargs).result()
+
+    def edit_message_reply_markup_async(self, *args, **kwargs) -> Future:
+        """Edit reply markup of a message without waiting for it to be edited, and log the error if it fails."""
+        return self._log_failure("edit_message_reply_markup",
+                                 self._call(Priority.HIGH, "edit_message_reply_markup", *args, **kwargs))
 
     def reply_error(self, update, errmsg):
         """
@@ -395,33 +509,41 @@ class TelegramBotManager(LocaleMixin):
         return self.send_message(update.effective_chat.id, errmsg,
                                  reply_to_message_id=update.effective_message.message_id)
 
-    @Decorators.retry_on_timeout
     def get_file(self, file_id):
         return self.updater.bot.get_file(file_id)
 
-    @Decorators.retry_on_timeout
     def delete_message(self, chat_id, message_id):
-        return self.updater.bot.delete_message(chat_id, message_id)
+        return self._call(Priority.HIGH, "delete_message", chat_id, message_id).result()
 
     def polling(self):
         """
         Poll message from Telegram Bot API. Can be used to extend for web hook.
         This method must NOT be blocking.
         """
+        clean = self.channel.flag('clean_pending_updates')
         if self.webhook:
-            start_webhook = self.channel.config['webhook']['start_webhook']
+            start_webhook = dict(self.channel.config['webhook']['start_webhook'])
+            start_webhook.setdefault('clean', clean)
             self.updater.start_webhook(**start_webhook)
         else:
-            self.updater.start_polling(timeout=10)
+            # Resume from the update after the last one processed before
+            # the last stop, unless pending updates are dropped.
+            self.updater.last_update_id = self.channel.db.get_update_offset()
+            self.updater.start_polling(timeout=10, clean=clean)
 
     def graceful_stop(self):
         """Gracefully stop the bot"""
         self.updater.stop()
+        self.update_tracker.checkpoint()
+        self.chat_actions.stop()
+        if self.scheduler:
+            self.scheduler.stop()
 
     def _detect_empty_file(self, file, chat, caption, prefix, suffix):
         empty = True
         if isinstance(file, str):
-            empty = os.stat(file).st_size == 0
+            # Strings other than paths of local files are file IDs on Telegram
+            empty = os.path.isfile(file) and os.stat(file).st_size == 0
         elif hasattr(file, "seekable"):
             if file.seekable():
                 file.seek(0, 2)
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Union, TYPE_CHECKING
+
+from .rate_limiter import Priority
+
+if TYPE_CHECKING:
+    from .bot_manager import TelegramBotManager
+
+__all__ = ['ChatActionManager']
+
+
+class _PendingAction:
+    __slots__ = ('action', 'due', 'expires', 'sent', 'future')
+
+    def __init__(self, action: str, due: float, expires: float):
+        self.action = action
+        # Time to send the action next
+        self.due = due
+        # Time to give up the action if nothing is sent to the chat
+        self.expires = expires
+        self.sent = False
+        # Request of the action last sent
+        self.future: Optional[Future] = None
+
+
+class ChatActionManager:
+    """
+    Send chat actions (“typing”, “sending a photo”, etc.) only when they
+    are useful.
+
+    An action requested is only sent when the request that follows it
+    takes longer than :attr:`DELAY`, and is refreshed every
+    :attr:`REFRESH_INTERVAL` until a request to the chat is completed,
+    as an action lasts 5 seconds on Telegram. Actions requested for a
+    chat with an action pending are coalesced, and actions of small
+    uploads are skipped altogether. Actions are sent alongside requests
+    being sent to the chat, rather than after them.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Seconds to wait before sending an action
+    DELAY = 1
+    # Seconds between refreshes of an action, shorter than it lasts
+    REFRESH_INTERVAL = 4.5
+    # Seconds after which an action is dropped if nothing is sent to the chat
+    MAX_DURATION = 60
+    # Uploads smaller than this, in bytes, are expected to be quick
+    SMALL_FILE_SIZE = 256 * 1024
+
+    def __init__(self, bot_manager: 'TelegramBotManager'):
+        self.bot_manager = bot_manager
+        self.condition = threading.Condition()
+        self.pending: Dict[str, _PendingAction] = dict()
+        self.sent = 0
+        self.elided = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="ETM chat actions", daemon=True)
+        self.thread.start()
+
+    def request(self, chat_id: Union[int, str], action: str, size: Optional[int] = None):
+        """
+        Request a chat action to be shown before the next message sent
+        to a chat.
+
+        Args:
+            chat_id: Telegram chat ID
+            action: Chat action, see ``telegram.ChatAction``
+            size: Size of the file to upload in bytes, if known.
+        """
+        if size is not None and size < self.SMALL_FILE_SIZE:
+            with self.condition:
+                self.elided += 1
+            return
+        chat_id = str(chat_id)
+        now = time.monotonic()
+        with self.condition:
+            pending = self.pending.get(chat_id)
+            if pending is not None:
+                # Change the action on the next refresh
+                pending.action = action
+                pending.expires = now + self.MAX_DURATION
+                return
+            self.pending[chat_id] = _PendingAction(action, now + self.DELAY, now + self.MAX_DURATION)
+            self.condition.notify()
+
+    def clear(self, chat_id: Union[int, str]):
+        """Stop the chat action of a chat, called when a request to the chat is completed."""
+        with self.condition:
+            pending = self.pending.pop(str(chat_id), None)
+            if pending is None:
+                return
+            if not pending.sent:
+                self.elided += 1
+            if pending.future is not None:
+                pending.future.cancel()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                now = time.monotonic()
+                due = []
+                for chat_id, pending in list(self.pending.items()):
+                    if pending.expires <= now:
+                        del self.pending[chat_id]
+                    elif pending.due <= now:
+                        due.append((chat_id, pending.action))
+                        pending.due = now + self.REFRESH_INTERVAL
+                if not due:
+                    wait = min((i.due for i in self.pending.values()), default=now + self.MAX_DURATION) - now
+                    self.condition.wait(wait)
+                    continue
+            for chat_id, action in due:
+                try:
+                    future = self.bot_manager.submit("send_chat_action", chat_id, action, priority=Priority.LOW)
+                    future.add_done_callback(self._log_error)
+                except Exception as e:
+                    self.logger.debug("Failed to send chat action to %s: %r", chat_id, e)
+                    continue
+                with self.condition:
+                    self.sent += 1
+                    pending = self.pending.get(chat_id)
+                    if pending is None:
+                        # Cleared while being submitted
+                        future.cancel()
+                    else:
+                        pending.sent = True
+                        pending.future = future
+
+    def _log_error(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.debug("Failed to send chat action: %r", future.exception())
+
+    def stats(self) -> Dict[str, int]:
+        """Numbers of chat actions sent and elided."""
+        with self.condition:
+            return {"sent": self.sent, "elided": self.elided}
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending.clear()
+            self.condition.notify()
+        self.thread.join(1)
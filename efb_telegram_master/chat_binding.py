@@ -6,7 +6,7 @@ import re
 import threading
 import urllib.parse
 import io
-from typing import Tuple, Dict, Optional, List, Pattern, TYPE_CHECKING
+from typing import Tuple, Dict, Optional, List, Pattern, Set, Any, Iterable, TYPE_CHECKING
 
 import peewee
 import telegram
@@ -24,7 +24,7 @@ from .locale_mixin import LocaleMixin
 if TYPE_CHECKING:
     from . import TelegramChannel
     from .bot_manager import TelegramBotManager
-    from .db import DatabaseManager
+    from .db import BaseDatabaseManager
 
 __all__ = ['ChatBindingManager', 'ETMChat']
 
@@ -36,7 +36,7 @@ class ETMChat(EFBChat):
     def __init__(self,
                  channel: Optional[EFBChannel] = None,
                  chat: Optional[EFBChat] = None,
-                 db: 'DatabaseManager' = None):
+                 db: 'BaseDatabaseManager' = None):
         self.db = db
         if channel:
             super().__init__(channel)
@@ -181,7 +181,14 @@ class ChatBindingManager(LocaleMixin):
     def __init__(self, channel: 'TelegramChannel'):
         self.channel: 'TelegramChannel' = channel
         self.bot: 'TelegramBotManager' = channel.bot_manager
-        self.db: 'DatabaseManager' = channel.db
+        self.db: 'BaseDatabaseManager' = channel.db
+
+        # Chat lists of slave channels from the last full listing, saved in
+        # warm start snapshots.
+        self.slave_chats_directory: Dict[str, List[EFBChat]] = dict()
+        # Slave channels of which the chat list is restored from a snapshot,
+        # and not listed again since.
+        self.restored_slave_chats: Set[str] = set()
 
         # Link handler
         self.bot.dispatcher.add_handler(GlobalCommandHandler("link", self.link_chat_show_list, pass_args=True))
@@ -216,6 +223,10 @@ class ChatBindingManager(LocaleMixin):
         self.bot.dispatcher.add_handler(
             CommandHandler("unlink_all", self.unlink_all))
 
+        # Bulk link
+        self.bot.dispatcher.add_handler(
+            CommandHandler("link_bulk", self.link_bulk))
+
         # Recipient suggestion
         self.suggestion_handler: ConversationHandler = ConversationHandler(
             entry_points=[],
@@ -320,7 +331,14 @@ class ChatBindingManager(LocaleMixin):
                         chats.append(chat)
             else:
                 for slave in coordinator.slaves.values():
-                    slave_chats = slave.get_chats()
+                    if slave.channel_id in self.restored_slave_chats:
+                        # Use the chat list restored, and list again in background
+                        self.restored_slave_chats.discard(slave.channel_id)
+                        slave_chats = self.slave_chats_directory[slave.channel_id]
+                        threading.Thread(target=self._refresh_slave_chats, args=(slave,), daemon=True).start()
+                    else:
+                        slave_chats = slave.get_chats()
+                        self.slave_chats_directory[slave.channel_id] = slave_chats
                     for chat in slave_chats:
                         chat = ETMChat(chat=chat, db=self.db)
                         if chat.match(re_filter):
@@ -364,6 +382,45 @@ class ChatBindingManager(LocaleMixin):
 
         return legend, chat_btn_list
 
+    def _refresh_slave_chats(self, slave: EFBChannel):
+        """List chats of a slave channel again, after its chat list is restored from a snapshot."""
+        try:
+            self.slave_chats_directory[slave.channel_id] = slave.get_chats()
+        except Exception as e:
+            self.logger.warning("Failed to list chats of %s: %s", slave.channel_id, e)
+
+    def export_slave_chats(self) -> Dict[str, List[List[Any]]]:
+        """Chat lists of slave channels to be saved in a warm start snapshot."""
+        return {channel_id: [[i.chat_uid, i.chat_name, i.chat_alias, i.chat_type.value] for i in chats]
+                for channel_id, chats in self.slave_chats_directory.items()}
+
+    def import_slave_chats(self, data: Dict[str, List[List[Any]]]):
+        """
+        Restore chat lists of slave channels from a warm start snapshot.
+        Nothing is restored if any of the chats is malformed.
+        """
+        directory: Dict[str, List[EFBChat]] = dict()
+        for channel_id, chats in data.items():
+            if channel_id not in coordinator.slaves:
+                continue
+            slave_chats: List[EFBChat] = []
+            for chat_uid, chat_name, chat_alias, chat_type in chats:
+                chat = EFBChat(coordinator.slaves[channel_id])
+                chat.chat_uid = chat_uid
+                chat.chat_name = chat_name
+                chat.chat_alias = chat_alias
+                chat.chat_type = ChatType(chat_type)
+                slave_chats.append(chat)
+            directory[channel_id] = slave_chats
+        self.slave_chats_directory.update(directory)
+        self.restored_slave_chats.update(directory)
+
+    def discard_restored_slave_chats(self):
+        """Remove chat lists restored from a warm start snapshot."""
+        for channel_id in self.restored_slave_chats:
+            self.slave_chats_directory.pop(channel_id, None)
+        self.restored_slave_chats.clear()
+
     def _db_update_slave_chats_cache(self, chats: List[EFBChat]):
         """
         Update all slave chats info cache to database. Triggered by retrieving
@@ -373,17 +430,11 @@ class ChatBindingManager(LocaleMixin):
             chats: List of chats generated
         """
         try:
-            for i in chats:
-                self.db.set_slave_chat_info(slave_channel_id=i.module_id,
-                                            slave_channel_name=i.module_name,
-                                            slave_channel_emoji=i.channel_emoji,
-                                            slave_chat_uid=i.chat_uid,
-                                            slave_chat_name=i.chat_name,
-                                            slave_chat_alias=i.chat_alias,
-                                            slave_chat_type=i.chat_type)
-        except peewee.OperationalError:
+            with self.db.connection_context():
+                self.db.set_slave_chats_info(chats)
+        except peewee.OperationalError as e:
             # Suppress exception of background database update
-            pass
+            self.logger.warning("Failed to update slave chats cache to database: %s", e)
 
     def link_chat_gen_list(self, chat_id, message_id: int = None, offset=0,
                            pattern: str = "", chats: List[str] = None):
@@ -417,8 +468,8 @@ class ChatBindingManager(LocaleMixin):
         for i in legend:
             msg_text += "%s\n" % i
 
-        self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=msg_text,
-                                   reply_markup=telegram.InlineKeyboardMarkup(chat_btn_list))
+        self.bot.edit_message_text_async(chat_id=chat_id, message_id=message_id, text=msg_text,
+                                         reply_markup=telegram.InlineKeyboardMarkup(chat_btn_list))
 
         self.link_handler.conversations[(chat_id, message_id)] = Flags.LINK_CONFIRM
 
@@ -448,18 +499,18 @@ class ChatBindingManager(LocaleMixin):
         if callback_uid == Flags.CANCEL_PROCESS:
             # Terminate the process
             txt = self._("Cancelled.")
-            self.bot.edit_message_text(text=txt,
-                                       chat_id=tg_chat_id,
-                                       message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt,
+                                             chat_id=tg_chat_id,
+                                             message_id=tg_msg_id)
             self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
             return ConversationHandler.END
 
         if callback_uid[:4] != "chat":
             # The only possible command now is "chat".
             txt = self._("Invalid parameter ({0}). (IP01)").format(callback_uid)
-            self.bot.edit_message_text(text=txt,
-                                       chat_id=tg_chat_id,
-                                       message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt,
+                                             chat_id=tg_chat_id,
+                                             message_id=tg_msg_id)
             self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
             return ConversationHandler.END
 
@@ -503,11 +554,11 @@ class ChatBindingManager(LocaleMixin):
         btns = [btn_list,
                 [telegram.InlineKeyboardButton("Cancel", callback_data=Flags.CANCEL_PROCESS)]]
 
-        self.bot.edit_message_text(text=txt,
-                                   chat_id=tg_chat_id,
-                                   message_id=tg_msg_id,
-                                   reply_markup=telegram.InlineKeyboardMarkup(btns),
-                                   parse_mode='HTML')
+        self.bot.edit_message_text_async(text=txt,
+                                         chat_id=tg_chat_id,
+                                         message_id=tg_msg_id,
+                                         reply_markup=telegram.InlineKeyboardMarkup(btns),
+                                         parse_mode='HTML')
 
         return Flags.LINK_EXEC
 
@@ -526,7 +577,7 @@ class ChatBindingManager(LocaleMixin):
 
         if callback_uid == Flags.CANCEL_PROCESS:
             txt = self._("Cancelled.")
-            self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
             self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
             return ConversationHandler.END
 
@@ -536,12 +587,12 @@ class ChatBindingManager(LocaleMixin):
         if cmd == "unlink":
             chat.unlink()
             txt = "Chat %s is restored." % chat_display_name
-            self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
         # TODO: Restore code for muted chats.
         elif cmd == "mute":
             chat.mute()
             txt = "Chat %s is now muted." % chat_display_name
-            self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
         elif cmd == "manual_link":
             txt = self._("To link {chat_display_name} manually, please:\n\n"
                          "1. Add me to the Telegram Group you want to link to.\n"
@@ -554,17 +605,17 @@ class ChatBindingManager(LocaleMixin):
                          "message others sent in channels.</i>") \
                 .format(chat_display_name=html.escape(chat_display_name),
                         code=html.escape(utils.b64en(utils.message_id_to_str(tg_chat_id, tg_msg_id))))
-            self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id,
-                                       reply_markup=
-                                       telegram.InlineKeyboardMarkup(
-                                           [[telegram.InlineKeyboardButton(self._("Cancel"),
-                                                                           callback_data=Flags.CANCEL_PROCESS)]]),
-                                       parse_mode='HTML')
+            self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id,
+                                             reply_markup=
+                                             telegram.InlineKeyboardMarkup(
+                                                 [[telegram.InlineKeyboardButton(self._("Cancel"),
+                                                                                 callback_data=Flags.CANCEL_PROCESS)]]),
+                                             parse_mode='HTML')
             return Flags.LINK_EXEC
         else:
             txt = self._("Command '{command}' ({query}) is not recognised, please try again") \
                 .format(command=cmd, query=callback_uid)
-            self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
         self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
         return ConversationHandler.END
 
@@ -594,11 +645,11 @@ class ChatBindingManager(LocaleMixin):
             chat.link(self.channel.channel_id, tg_chat_to_link, self.channel.flag("multiple_slave_chats"))
 
             txt = self._("Chat {0} is now linked.").format(chat_display_name)
-            self.bot.edit_message_text(text=txt, chat_id=msg.chat.id, message_id=msg.message_id)
+            self.bot.edit_message_text_async(text=txt, chat_id=msg.chat.id, message_id=msg.message_id)
 
-            self.bot.edit_message_text(chat_id=storage_key[0],
-                                       message_id=storage_key[1],
-                                       text=txt)
+            self.bot.edit_message_text_async(chat_id=storage_key[0],
+                                             message_id=storage_key[1],
+                                             text=txt)
 
     def unlink_all(self, bot, update):
         """
@@ -648,6 +699,109 @@ class ChatBindingManager(LocaleMixin):
                                              parse_mode=telegram.ParseMode.MARKDOWN,
                                              reply_to_message_id=update.message.message_id)
 
+    def link_bulk(self, bot, update):
+        """
+        Link, unlink or mute many remote chats at once, as listed in a
+        mapping file. Triggered by `/link_bulk` in reply to the file.
+
+        Each line of the file is one of::
+
+            link <Telegram chat ID> <slave channel ID> <slave chat ID>
+            unlink <slave channel ID> <slave chat ID>
+            mute <slave channel ID> <slave chat ID>
+
+        Empty lines and lines starting with ``#`` are ignored.
+
+        Args:
+            bot: Telegram Bot instance
+            update: Message update
+        """
+        reply_to = update.message.reply_to_message
+        if not reply_to or not reply_to.document:
+            return self.bot.reply_error(update, self._("Send /link_bulk in reply to a mapping file to apply it."))
+        try:
+            file = io.BytesIO()
+            self.bot.get_file(reply_to.document.file_id).download(out=file)
+            changes = self.parse_link_mapping(file.getvalue().decode())
+            count = self.apply_link_changes(changes)
+        except ValueError as e:
+            return self.bot.reply_error(update, self._("Failed to apply the mapping file: {0}").format(e))
+        return self.bot.send_message(update.effective_chat.id,
+                                     self.ngettext("{0} change of chat links is applied.",
+                                                   "{0} changes of chat links are applied.",
+                                                   count).format(count),
+                                     reply_to_message_id=update.effective_message.message_id)
+
+    def parse_link_mapping(self, text: str) -> List[Dict[str, str]]:
+        """
+        Parse a mapping file of ``/link_bulk`` into changes for
+        :meth:`apply_link_changes`.
+
+        Raises:
+            ValueError: when a line is not valid
+        """
+        changes: List[Dict[str, str]] = []
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            action = line.split(None, 1)[0]
+            parts = line.split(None, 3 if action == "link" else 2)
+            if len(parts) != (4 if action == "link" else 3):
+                raise ValueError(self._("Line {0} is not valid.").format(line_no))
+            change = {"action": action, "slave_channel_id": parts[-2], "slave_chat_uid": parts[-1]}
+            if action == "link":
+                change["telegram_chat_id"] = parts[1]
+            changes.append(change)
+        return changes
+
+    def apply_link_changes(self, changes: Iterable[Dict[str, Any]]) -> int:
+        """
+        Link, unlink or mute many remote chats in one transaction.
+
+        Each change is a dict with the following keys:
+
+        * ``action``: ``"link"``, ``"unlink"`` or ``"mute"``
+        * ``slave_channel_id``: ID of the slave channel
+        * ``slave_chat_uid``: ID of the chat in the slave channel
+        * ``telegram_chat_id``: ID of the Telegram chat, for ``"link"`` only.
+          Can be a string, as IDs of Telegram channels do not fit in
+          XML-RPC integers.
+
+        All changes are checked before any of them is applied.
+
+        Returns:
+            int: Number of changes applied.
+
+        Raises:
+            ValueError: when a change is not valid
+        """
+        db_changes: List[Dict[str, Any]] = []
+        for i in changes:
+            channel_id, chat_uid = i.get('slave_channel_id'), i.get('slave_chat_uid')
+            if channel_id not in coordinator.slaves:
+                raise ValueError(self._("Slave channel {0} is not found.").format(channel_id))
+            if not chat_uid:
+                raise ValueError(self._("Slave chat ID is not provided."))
+            slave_uid = utils.chat_id_to_str(channel_id, chat_uid)
+            action = i.get('action')
+            if action == "link":
+                try:
+                    telegram_chat_id = int(i.get('telegram_chat_id'))
+                except (TypeError, ValueError):
+                    raise ValueError(self._("Telegram chat ID {0} is not valid.").format(i.get('telegram_chat_id')))
+                db_changes.append({"action": "link", "slave_uid": slave_uid,
+                                   "master_uid": utils.chat_id_to_str(self.channel.channel_id, telegram_chat_id),
+                                   "multiple_slave": self.channel.flag("multiple_slave_chats")})
+            elif action == "mute":
+                db_changes.append({"action": "link", "slave_uid": slave_uid,
+                                   "master_uid": ETMChat.MUTE_CHAT_ID, "multiple_slave": True})
+            elif action == "unlink":
+                db_changes.append({"action": "unlink", "slave_uid": slave_uid})
+            else:
+                raise ValueError(self._("Action {0} is not recognised.").format(action))
+        return self.db.update_chat_assoc(db_changes)
+
     def start_chat_list(self, bot, update, args=None):
         """
         Send a list to for chat list generation.
@@ -706,9 +860,9 @@ class ChatBindingManager(LocaleMixin):
                                       "from this group.").format(channel_emoji=channel.channel_emoji,
                                                                  channel_name=channel.channel_name,
                                                                  chat_id=slave_chat_id)
-                self.bot.edit_message_text(text=msg_text,
-                                           chat_id=chat_id,
-                                           message_id=message_id)
+                self.bot.edit_message_text_async(text=msg_text,
+                                                 chat_id=chat_id,
+                                                 message_id=message_id)
                 return ConversationHandler.END
             else:
                 msg_text = self._("This Telegram group is linked to the following chats, "
@@ -722,10 +876,10 @@ class ChatBindingManager(LocaleMixin):
         msg_text += self._("\n\nLegend:\n")
         for i in legend:
             msg_text += "%s\n" % i
-        self.bot.edit_message_text(text=msg_text,
-                                   chat_id=chat_id,
-                                   message_id=message_id,
-                                   reply_markup=telegram.InlineKeyboardMarkup(chat_btn_list))
+        self.bot.edit_message_text_async(text=msg_text,
+                                         chat_id=chat_id,
+                                         message_id=message_id,
+                                         reply_markup=telegram.InlineKeyboardMarkup(chat_btn_list))
 
         self.chat_head_handler.conversations[(chat_id, message_id)] = Flags.CHAT_HEAD_CONFIRM
 
@@ -750,18 +904,18 @@ class ChatBindingManager(LocaleMixin):
         if callback_uid == Flags.CANCEL_PROCESS:
             txt = self._("Cancelled.")
             self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
-            self.bot.edit_message_text(text=txt,
-                                       chat_id=tg_chat_id,
-                                       message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt,
+                                             chat_id=tg_chat_id,
+                                             message_id=tg_msg_id)
             return ConversationHandler.END
 
         if callback_uid[:4] != "chat":
             # Invalid command
             txt = self._("Invalid command. ({0})").format(callback_uid)
             self.msg_storage.pop((tg_chat_id, tg_msg_id), None)
-            self.bot.edit_message_text(text=txt,
-                                       chat_id=tg_chat_id,
-                                       message_id=tg_msg_id)
+            self.bot.edit_message_text_async(text=txt,
+                                             chat_id=tg_chat_id,
+                                             message_id=tg_msg_id)
             return ConversationHandler.END
 
         callback_uid = int(callback_uid.split()[1])
@@ -780,7 +934,7 @@ class ChatBindingManager(LocaleMixin):
                    "slave_member_display_name": None,
                    "slave_message_id": "__chathead__"}
         self.db.add_msg_log(**msg_log)
-        self.bot.edit_message_text(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
+        self.bot.edit_message_text_async(text=txt, chat_id=tg_chat_id, message_id=tg_msg_id)
         return ConversationHandler.END
 
     def get_chat_from_db(self, channel_id: str, chat_id: str) -> Optional[EFBChat]:
@@ -810,11 +964,11 @@ class ChatBindingManager(LocaleMixin):
         self.msg_storage[storage_id].set_chat_suggestion(update, candidates)
         legends, buttons = self.channel.chat_binding.slave_chats_pagination(
             storage_id, 0, source_chats=candidates)
-        self.bot.edit_message_text(text=self._("Error: No recipient specified.\n"
-                                               "Please reply to a previous message, "
-                                               "or choose a recipient:\n\nLegend:\n") + "\n".join(legends),
-                                   chat_id=chat_id, message_id=message_id,
-                                   reply_markup=telegram.InlineKeyboardMarkup(buttons))
+        self.bot.edit_message_text_async(text=self._("Error: No recipient specified.\n"
+                                                     "Please reply to a previous message, "
+                                                     "or choose a recipient:\n\nLegend:\n") + "\n".join(legends),
+                                         chat_id=chat_id, message_id=message_id,
+                                         reply_markup=telegram.InlineKeyboardMarkup(buttons))
         self.suggestion_handler.conversations[storage_id] = Flags.SUGGEST_RECIPIENT
 
     def suggested_recipient(self, bot, update: telegram.Update):
@@ -828,20 +982,20 @@ class ChatBindingManager(LocaleMixin):
             chat = ETMChat(chat=self.get_chat_from_db(*utils.chat_id_str_to_id(chat)), db=self.db)
             self.channel.master_messages.process_telegram_message(bot, update, channel_id=chat.module_id,
                                                                   chat_id=chat.chat_uid)
-            self.bot.edit_message_text(text=self._("Delivering the message to {0}").format(chat.full_name),
-                                       chat_id=chat_id,
-                                       message_id=msg_id)
+            self.bot.edit_message_text_async(text=self._("Delivering the message to {0}").format(chat.full_name),
+                                             chat_id=chat_id,
+                                             message_id=msg_id)
         elif param == Flags.CANCEL_PROCESS:
-            self.bot.edit_message_text(text=self._("Error: No recipient specified.\n"
-                                                   "Please reply to a previous message."),
-                                       chat_id=chat_id,
-                                       message_id=msg_id)
+            self.bot.edit_message_text_async(text=self._("Error: No recipient specified.\n"
+                                                         "Please reply to a previous message."),
+                                             chat_id=chat_id,
+                                             message_id=msg_id)
         else:
-            self.bot.edit_message_text(text=self._("Error: No recipient specified.\n"
-                                                   "Please reply to a previous message.\n\n"
-                                                   "Invalid parameter ({0}).").format(param),
-                                       chat_id=chat_id,
-                                       message_id=msg_id)
+            self.bot.edit_message_text_async(text=self._("Error: No recipient specified.\n"
+                                                         "Please reply to a previous message.\n\n"
+                                                         "Invalid parameter ({0}).").format(param),
+                                             chat_id=chat_id,
+                                             message_id=msg_id)
         return ConversationHandler.END
 
     def update_group_info(self, bot: telegram.Bot, update: telegram.Update):
@@ -88,12 +88,12 @@ class CommandsManager(LocaleMixin):
         if not callback.isdecimal():
             msg = self._("Invalid parameter: {0}. (CE01)").format(callback)
             self.msg_storage.pop(index, None)
-            self.bot.edit_message_text(text=msg, chat_id=chat_id, message_id=message_id)
+            self.bot.edit_message_text_async(text=msg, chat_id=chat_id, message_id=message_id)
             return ConversationHandler.END
         elif not (0 <= int(callback) < len(self.msg_storage[index].commands)):
             msg = self._("Index out of bound: {0}. (CE02)").format(callback)
             self.msg_storage.pop(index, None)
-            self.bot.edit_message_text(text=msg, chat_id=chat_id, message_id=message_id)
+            self.bot.edit_message_text_async(text=msg, chat_id=chat_id, message_id=message_id)
             return ConversationHandler.END
 
         callback = int(callback)
@@ -114,8 +114,8 @@ class CommandsManager(LocaleMixin):
             msg = self._command_fallback(*command.args, __channel_id=module_id, __callable=command.callable_name,
                                          **command.kwargs)
         self.msg_storage.pop(index, None)
-        self.bot.edit_message_text(prefix=prefix, text=msg,
-                                   chat_id=chat_id, message_id=message_id)
+        self.bot.edit_message_text_async(prefix=prefix, text=msg,
+                                         chat_id=chat_id, message_id=message_id)
         return ConversationHandler.END
 
     def extra_listing(self, bot, update):
@@ -137,7 +137,7 @@ class CommandsManager(LocaleMixin):
                     msg += "\n- <b>%s</b> %s" % (extra_fns[j].name, fn_name)
             else:
                 msg += "\n" + self._("No command found.")
-        self.bot.send_message(update.effective_chat.id, msg, parse_mode="HTML")
+        self.bot.send_message_async(update.effective_chat.id, msg, parse_mode="HTML")
 
     def extra_usage(self, bot, update, groupdict: Dict[str, str] = None):
         if int(groupdict['id']) >= len(self.modules_list):
@@ -156,7 +156,7 @@ class CommandsManager(LocaleMixin):
         fn_name = "/%s_%s" % (groupdict['id'], groupdict['command'])
         msg += "\n\n%s <b>(%s)</b>\n%s" % (
             fn_name, command.name, command.desc.format(function_name=fn_name))
-        self.bot.send_message(update.effective_chat.id, msg, parse_mode="HTML")
+        self.bot.send_message_async(update.effective_chat.id, msg, parse_mode="HTML")
 
     def extra_call(self, bot, update, groupdict: Dict[str, str] = None):
         """
@@ -187,8 +187,8 @@ class CommandsManager(LocaleMixin):
 
         result = functions[groupdict['command']](" ".join(update.message.text.split(' ', 1)[1:]))
 
-        self.bot.edit_message_text(prefix=header, text=result,
-                                   chat_id=update.message.chat.id, message_id=msg.message_id)
+        self.bot.edit_message_text_async(prefix=header, text=result,
+                                         chat_id=update.message.chat.id, message_id=msg.message_id)
 
     def _command_fallback(self, *args, __channel_id: str, __callable: str, **kwargs) -> str:
         return self._("Error: Command is not found in the channel.\n"
@@ -15,6 +15,8 @@ class Flags:
     COMMAND_PENDING = 0x31
     # Message recipient suggestions
     SUGGEST_RECIPIENT = 0x32
+    # Message search
+    SEARCH_RESULT = 0x41
 
 
 class Emoji:
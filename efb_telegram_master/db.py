@@ -2,21 +2,729 @@
 
 import datetime
 import logging
-from typing import List, Optional
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import List, Optional, Dict, Tuple, Iterable, Callable, Any
 
-from peewee import Model, TextField, DateTimeField, CharField, SqliteDatabase, DoesNotExist
+from peewee import Model, TextField, CharField, SqliteDatabase, DoesNotExist, IntegerField, \
+    TimestampField, DateTimeField, fn, chunked, format_date_time, SQL
 from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.sqlite_ext import FTS5Model, SearchField, AutoIncrementField
 
-from ehforwarderbot import utils, EFBChannel
+from ehforwarderbot import utils, EFBChannel, EFBChat
 
 
-class DatabaseManager:
+class CompressedTextField(TextField):
+    """
+    Text field that stores values longer than ``threshold`` bytes as
+    zlib-compressed BLOBs, prefixed with :attr:`MARKER`.
+
+    Values without the marker are read as plain text, so existing rows
+    and rows below the threshold are left as is.
+    """
+
+    MARKER = b"\x00zlib\x00"
+
+    def __init__(self, threshold: int = 0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def db_value(self, value):
+        value = super().db_value(value)
+        if value is None or self.threshold <= 0:
+            return value
+        raw = value.encode()
+        if len(raw) <= self.threshold:
+            return value
+        compressed = self.MARKER + zlib.compress(raw)
+        if len(compressed) >= len(raw):
+            return value
+        return compressed
+
+    def python_value(self, value):
+        if isinstance(value, bytes) and value.startswith(self.MARKER):
+            return zlib.decompress(value[len(self.MARKER):]).decode()
+        return super().python_value(value)
+
+
+class LegacyTimestampField(TimestampField):
+    """
+    Timestamp field that also accepts times stored as text by earlier
+    versions, which are left in place until converted by a backfill.
+    Text times are read as local time, as they were written.
+    """
+
+    def _parse(self, value):
+        parsed = format_date_time(value, DateTimeField.formats)
+        return parsed if isinstance(parsed, datetime.datetime) else None
+
+    def db_value(self, value):
+        if isinstance(value, str):
+            value = self._parse(value)
+        return super().db_value(value)
+
+    def python_value(self, value):
+        if isinstance(value, str):
+            return self._parse(value)
+        return super().python_value(value)
+
+
+class MsgLogWriter:
+    """
+    Background writer that groups message log inserts and updates
+    into batched transactions.
+
+    Entries are queued in memory and flushed in a single transaction
+    every ``interval`` seconds, or as soon as ``batch_size`` entries are
+    queued. Queued entries are readable through :meth:`get` until they
+    are committed.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db: 'DatabaseManager', interval: float, batch_size: int):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending: 'OrderedDict[str, MsgLog]' = OrderedDict()
+        self.lock = threading.RLock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="ETM MsgLog writer", daemon=True)
+        self.thread.start()
+
+    def put(self, msg_log: 'MsgLog'):
+        """Queue a message log entry to be written."""
+        with self.lock:
+            self.pending.pop(msg_log.master_msg_id, None)
+            self.pending[msg_log.master_msg_id] = msg_log
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+
+    def get(self, master_msg_id: Optional[str] = None,
+            slave_msg_id: Optional[str] = None,
+            slave_origin_uid: Optional[str] = None) -> Optional['MsgLog']:
+        """Get a queued message log entry, None if it is not queued."""
+        with self.lock:
+            if master_msg_id:
+                return self.pending.get(master_msg_id)
+            for i in reversed(self.pending.values()):
+                if i.slave_message_id == slave_msg_id and i.slave_origin_uid == slave_origin_uid:
+                    return i
+        return None
+
+    def discard(self, master_msg_id: Optional[str] = None,
+                slave_msg_id: Optional[str] = None,
+                slave_origin_uid: Optional[str] = None):
+        """Remove queued message log entries that are not yet written."""
+        with self.lock:
+            if master_msg_id:
+                self.pending.pop(master_msg_id, None)
+            else:
+                for key, i in list(self.pending.items()):
+                    if i.slave_message_id == slave_msg_id and i.slave_origin_uid == slave_origin_uid:
+                        del self.pending[key]
+
+    def flush(self):
+        """Write all queued entries in one transaction."""
+        with self.lock:
+            if not self.pending:
+                return
+            msg_logs = list(self.pending.values())
+            with self.db.db.atomic():
+                self.db._unindex_msg_logs([i.master_msg_id for i in msg_logs])
+                # Updated entries may come from the archive, write them back where they are.
+                for model in {type(i) for i in msg_logs}:
+                    model.replace_many([i.__data__ for i in msg_logs if type(i) is model]).execute()
+                self.db._index_msg_logs(msg_logs)
+            self.pending.clear()
+        self.logger.debug("%s message log entries are written to the database.", len(msg_logs))
+
+    def run(self):
+        with self.db.connection_context():
+            while not self.stopped:
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.logger.exception("Failed to write message log entries to database: %s", e)
+
+    def stop(self):
+        """Stop the writer thread and write all remaining entries."""
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+
+
+class MsgLogCache:
+    """
+    Bounded LRU cache of recent message log entries, indexed by
+    Telegram message ID and by slave message ID.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: 'OrderedDict[str, MsgLog]' = OrderedDict()
+        self.slave_index: Dict[Tuple[str, str], List[str]] = dict()
+        # Slave key of each entry when it is cached, as entries may be
+        # updated in place before being put again.
+        self.slave_keys: Dict[str, Tuple[str, str]] = dict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, msg_log: 'MsgLog'):
+        """Add or refresh an entry, and evict the least recently used ones."""
+        with self.lock:
+            self._remove(msg_log.master_msg_id)
+            slave_key = (msg_log.slave_message_id, msg_log.slave_origin_uid)
+            self.entries[msg_log.master_msg_id] = msg_log
+            self.slave_keys[msg_log.master_msg_id] = slave_key
+            self.slave_index.setdefault(slave_key, []).append(msg_log.master_msg_id)
+            while len(self.entries) > self.capacity:
+                # Evict all entries of the same slave message together, so that
+                # lookups by slave message ID never return an outdated one.
+                for key in list(self.slave_index[self.slave_keys[next(iter(self.entries))]]):
+                    self._remove(key)
+
+    def get(self, master_msg_id: Optional[str] = None,
+            slave_msg_id: Optional[str] = None,
+            slave_origin_uid: Optional[str] = None) -> Optional['MsgLog']:
+        """Get a cached entry, None if it is not cached."""
+        with self.lock:
+            if not master_msg_id:
+                keys = self.slave_index.get((slave_msg_id, slave_origin_uid))
+                master_msg_id = keys[-1] if keys else None
+            msg_log = self.entries.get(master_msg_id) if master_msg_id else None
+            if msg_log is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(master_msg_id)
+            return msg_log
+
+    def discard(self, master_msg_id: Optional[str] = None,
+                slave_msg_id: Optional[str] = None,
+                slave_origin_uid: Optional[str] = None):
+        """Remove cached entries."""
+        with self.lock:
+            if master_msg_id:
+                self._remove(master_msg_id)
+            else:
+                for key in list(self.slave_index.get((slave_msg_id, slave_origin_uid), [])):
+                    self._remove(key)
+
+    def _remove(self, master_msg_id: str):
+        if self.entries.pop(master_msg_id, None) is None:
+            return
+        slave_key = self.slave_keys.pop(master_msg_id)
+        keys = self.slave_index.get(slave_key)
+        if keys and master_msg_id in keys:
+            keys.remove(master_msg_id)
+            if not keys:
+                del self.slave_index[slave_key]
+
+    def stats(self) -> Dict[str, int]:
+        """Size, capacity, and hit and miss counts of the cache."""
+        with self.lock:
+            return {"size": len(self.entries), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class PeriodicTask:
+    """
+    Background worker that runs a database task every ``interval``
+    seconds in its own connection.
+
+    The task is called with an event that is set when the worker is
+    stopping, so that long tasks can end early.
+    """
+
     logger = logging.getLogger(__name__)
 
+    def __init__(self, db: 'DatabaseManager', name: str, interval: float,
+                 task: Callable[[threading.Event], None]):
+        self.db = db
+        self.name = name
+        self.interval = interval
+        self.task = task
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ETM %s" % name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with self.db.connection_context():
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.task(self.stopped)
+                except Exception as e:
+                    self.logger.exception("Failed to run %s: %s", self.name, e)
+
+    def stop(self):
+        """Stop the worker thread."""
+        self.stopped.set()
+        self.thread.join()
+
+
+class QueryStats:
+    """
+    Call counts and latency histograms of database methods, and a log
+    of recent slow SQL statements with their query plans.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Upper bounds of histogram buckets in milliseconds
+    BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+    # Number of slow statements kept
+    SLOW_QUERY_LOG_SIZE = 100
+
+    def __init__(self, slow_threshold: float):
+        """
+        Args:
+            slow_threshold: Statements taking longer than this in
+                milliseconds are logged, 0 to disable.
+        """
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.methods: Dict[str, Dict[str, Any]] = dict()
+        self.slow_queries: 'deque[Dict[str, Any]]' = deque(maxlen=self.SLOW_QUERY_LOG_SIZE)
+
+    @property
+    def current_method(self) -> Optional[str]:
+        """Outermost timed method running in the current thread."""
+        return getattr(self.local, 'method', None)
+
+    def record(self, method: str, elapsed: float):
+        """Record a call of a method taking ``elapsed`` seconds."""
+        ms = elapsed * 1000
+        bucket = next((str(i) for i in self.BUCKETS if ms <= i), "+Inf")
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                "histogram": {i: 0 for i in self.bucket_names()}}
+            stats["count"] += 1
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["histogram"][bucket] += 1
+
+    def record_query(self, db: SqliteDatabase, sql: str, params, elapsed: float):
+        """Log a statement taking ``elapsed`` seconds if it is slow."""
+        ms = elapsed * 1000
+        if not self.slow_threshold or ms < self.slow_threshold:
+            return
+        plan = ""
+        if sql.lstrip()[:6].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLAC"):
+            try:
+                cursor = SqliteDatabase.execute_sql(db, "EXPLAIN QUERY PLAN " + sql, params)
+                plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+            except Exception as e:
+                plan = "(%s)" % e
+        self.logger.warning("Slow query in %s took %.1f ms: %s %s\n%s",
+                            self.current_method, ms, sql, params, plan)
+        with self.lock:
+            self.slow_queries.append({"method": self.current_method or "", "ms": ms, "sql": sql,
+                                      "params": repr(params), "plan": plan,
+                                      "time": datetime.datetime.now().isoformat()})
+
+    def bucket_names(self) -> List[str]:
+        return [str(i) for i in self.BUCKETS] + ["+Inf"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "methods": {k: dict(v, histogram=v["histogram"].copy()) for k, v in self.methods.items()},
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.methods.clear()
+            self.slow_queries.clear()
+
+
+def timed(method: Callable) -> Callable:
+    """Record latency of a method of :class:`DatabaseManager` in its ``query_stats``."""
+
+    @wraps(method)
+    def wrapper(self: 'DatabaseManager', *args, **kwargs):
+        stats = self.query_stats
+        outermost = stats.current_method is None
+        if outermost:
+            stats.local.method = method.__name__
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            stats.record(method.__name__, time.perf_counter() - start)
+            if outermost:
+                stats.local.method = None
+
+    return wrapper
+
+
+class TimedSqliteDatabase(SqliteDatabase):
+    """SQLite database that reports the time taken by every statement to :class:`QueryStats`."""
+
+    def __init__(self, database, query_stats: QueryStats, **kwargs):
+        self.query_stats = query_stats
+        super().__init__(database, **kwargs)
+
+    def execute_sql(self, sql, params=None, commit=None):
+        start = time.perf_counter()
+        cursor = super().execute_sql(sql, params, commit)
+        self.query_stats.record_query(self, sql, params, time.perf_counter() - start)
+        return cursor
+
+
+class BackfillRunner:
+    """
+    Background worker that runs pending data backfills of schema
+    migrations in its own connection, one chunk per transaction, and
+    exits when all of them are done.
+
+    Progress of each backfill is saved with every chunk, so that an
+    interrupted backfill resumes where it stopped on next start.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db: 'DatabaseManager'):
+        self.db = db
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ETM schema backfill", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with self.db.connection_context():
+            try:
+                self.db.run_backfills(self.stopped)
+            except Exception as e:
+                self.logger.exception("Failed to run schema backfill: %s", e)
+
+    def stop(self):
+        """Stop the worker thread after the current chunk."""
+        self.stopped.set()
+        self.thread.join()
+
+
+class BaseDatabaseManager(ABC):
+    """
+    Storage of chat associations, message logs and slave chat info.
+
+    :class:`DatabaseManager` stores them in SQLite, and
+    :class:`~.memory_db.MemoryDatabaseManager` keeps them in memory only.
+    The storage engine is selected with ``storage`` in the channel config.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Whether ``search_msg_log`` is supported.
+    has_search = False
+
+    # Time of the last update from Telegram or message log entry.
+    last_activity: float = 0.0
+
+    def mark_activity(self):
+        """Record that the bot is processing messages now."""
+        self.last_activity = time.time()
+
+    @abstractmethod
+    def add_chat_assoc(self, master_uid: str, slave_uid: str, multiple_slave: bool = False):
+        """
+        Add chat associations (chat links).
+        One Master channel with many Slave channel.
+
+        Args:
+            master_uid (str): Master channel UID ("%(chat_id)s")
+            slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
+            multiple_slave (bool): Keep other slave chats linked to the master chat.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove_chat_assoc(self, master_uid: str = None, slave_uid: str = None) -> int:
+        """
+        Remove chat associations (chat links).
+        Only one parameter is to be provided.
+
+        Args:
+            master_uid (str): Master channel UID ("%(chat_id)s")
+            slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
+
+        Returns:
+            int: Number of associations removed.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_chat_assoc(self, master_uid: str = None, slave_uid: str = None) -> List[str]:
+        """
+        Get chat association (chat link) information.
+        Only one parameter is to be provided.
+
+        Args:
+            master_uid (str): Master channel UID ("%(chat_id)s")
+            slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
+
+        Returns:
+            list: The counterpart ID.
+        """
+        raise NotImplementedError()
+
+    def update_chat_assoc(self, changes: Iterable[Dict[str, Any]]) -> int:
+        """
+        Apply many changes of chat associations (chat links) at once.
+
+        Each change is a dict with the following keys:
+
+        * ``action``: ``"link"`` or ``"unlink"``
+        * ``slave_uid``: Slave channel UID ("%(channel_id)s.%(chat_id)s")
+        * ``master_uid``: Master channel UID ("%(chat_id)s"), for ``"link"`` only
+        * ``multiple_slave``: Keep other slave chats linked to the master
+          chat, for ``"link"`` only. Default: ``False``
+
+        All changes are checked before any of them is applied.
+
+        Returns:
+            int: Number of changes applied.
+        """
+        changes = list(changes)
+        for i in changes:
+            if i.get('action') not in ('link', 'unlink'):
+                raise ValueError("Unknown action of chat association change: %s" % i.get('action'))
+            if not i.get('slave_uid') or (i['action'] == 'link' and not i.get('master_uid')):
+                raise ValueError("Both master_uid and slave_uid are to be provided to link a chat.")
+        for i in changes:
+            if i['action'] == 'link':
+                self.add_chat_assoc(master_uid=i['master_uid'], slave_uid=i['slave_uid'],
+                                    multiple_slave=i.get('multiple_slave', False))
+            else:
+                self.remove_chat_assoc(slave_uid=i['slave_uid'])
+        return len(changes)
+
+    @abstractmethod
+    def get_last_msg_from_chat(self, chat_id):
+        """Get the last message log of a Telegram chat, None if not exist."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def add_msg_log(self, **kwargs):
+        """
+        Add an entry to message log, or update it with ``update=True``.
+
+        See :meth:`DatabaseManager.add_msg_log` for arguments.
+
+        Returns:
+            The added/updated entry.
+
+        Raises:
+            peewee.DoesNotExist: The entry to update is not found, as
+                ``MsgLog.DoesNotExist`` of the storage engine.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_msg_log(self,
+                    master_msg_id: Optional[str] = None,
+                    slave_msg_id: Optional[str] = None,
+                    slave_origin_uid: Optional[str] = None):
+        """
+        Get message log by message ID, None if not exist.
+
+        Either ``master_msg_id``, or both ``slave_msg_id`` and
+        ``slave_origin_uid`` are to be provided.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete_msg_log(self,
+                       master_msg_id: Optional[str] = None,
+                       slave_msg_id: Optional[str] = None,
+                       slave_origin_uid: Optional[str] = None):
+        """
+        Remove a message log by message ID.
+
+        Either ``master_msg_id``, or both ``slave_msg_id`` and
+        ``slave_origin_uid`` are to be provided.
+        """
+        raise NotImplementedError()
+
+    def search_msg_log(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, str]]:
+        """Search message logs by text. Not supported by default."""
+        return []
+
+    def backup(self, path: Optional[str] = None,
+               progress: Optional[Callable[[int, int], Any]] = None) -> Dict[str, Any]:
+        """Copy the storage to a file while the bot is running. Not supported by default."""
+        raise NotImplementedError("Backup is not supported by this storage engine.")
+
+    @abstractmethod
+    def get_update_offset(self) -> int:
+        """Get the offset of the next Telegram update to process, 0 if not known."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set_update_offset(self, offset: int):
+        """Save the offset of the next Telegram update to process."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_recent_slave_chats(self, master_chat_id, limit=5) -> List[str]:
+        """Get slave chats recently delivered to or from a Telegram chat, most recent first."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_slave_chat_info(self, slave_channel_id=None, slave_chat_uid=None):
+        """Get cached slave chat info, None if not exist."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set_slave_chat_info(self,
+                            slave_channel_id=None,
+                            slave_channel_name=None,
+                            slave_channel_emoji=None,
+                            slave_chat_uid=None,
+                            slave_chat_name=None,
+                            slave_chat_alias="",
+                            slave_chat_type=None):
+        """Insert or update slave chat info entry, and return it."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set_slave_chats_info(self, chats: Iterable[EFBChat]) -> int:
+        """Insert or update slave chat info entries of a list of chats, and return the count."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete_slave_chat_info(self, slave_channel_id, slave_chat_uid):
+        """Remove a slave chat info entry."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _split_master_msg_id(master_msg_id: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Split a Telegram message ID string into integer chat ID and message ID.
+
+        Args:
+            master_msg_id: Telegram message ID ("%(chat_id)s.%(msg_id)s")
+
+        Returns:
+            chat_id, message_id; ``(None, None)`` if not in the expected format.
+        """
+        try:
+            chat_id, message_id = master_msg_id.split(".", 1)
+            return int(chat_id), int(message_id)
+        except (AttributeError, ValueError):
+            return None, None
+
+    @contextmanager
+    def connection_context(self):
+        """Context to run storage operations in a background thread."""
+        yield
+
+    def export_cache_state(self) -> Dict[str, Any]:
+        """In-memory state to be saved in a warm start snapshot, and restored by ``import_cache_state``."""
+        return {}
+
+    def import_cache_state(self, state: Dict[str, Any]) -> bool:
+        """Restore in-memory state from a warm start snapshot."""
+        return False
+
+    def graceful_stop(self):
+        """Stop background workers, and write all pending changes to the storage."""
+        pass
+
+
+class DatabaseManager(BaseDatabaseManager):
+    """Storage in an SQLite database (``tgdata.db``) in the channel data directory."""
+
+    logger = logging.getLogger(__name__)
+
+    # Connection profile applied on every new SQLite connection,
+    # can be overridden by the ``sqlite_pragmas`` flag.
+    DEFAULT_PRAGMAS = {
+        # Only takes effect on new databases, or after a full VACUUM,
+        # see ``enable_incremental_vacuum``.
+        "auto_vacuum": "incremental",
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000,
+        "cache_size": -8000,
+        "mmap_size": 64 * 1024 * 1024,
+    }
+
+    # Number of message log entries moved to the archive per transaction,
+    # and the pause between two transactions to let live traffic through.
+    ARCHIVE_CHUNK_SIZE = 500
+    ARCHIVE_CHUNK_INTERVAL = 0.05
+
+    # Number of rows per INSERT statement in bulk writes, kept below the
+    # limit of bound variables of older SQLite builds (999).
+    BULK_INSERT_SIZE = 100
+
+    # Number of pages copied in each step of online backup, and the pause
+    # between two steps in seconds.
+    BACKUP_STEP_PAGES = 256
+    BACKUP_STEP_INTERVAL = 0.05
+    # Restarts of online backup allowed before copying in one step.
+    BACKUP_MAX_RESTARTS = 3
+
+    # Seconds between checks whether maintenance is due, pages reclaimed
+    # per step of incremental vacuum, and rows sampled per index by ANALYZE.
+    MAINTENANCE_CHECK_INTERVAL = 60
+    VACUUM_STEP_PAGES = 256
+    ANALYSIS_LIMIT = 1000
+
+    # Number of message log entries rewritten per transaction by
+    # ``recompress_msg_log``.
+    RECOMPRESS_CHUNK_SIZE = 500
+
+    # Number of message log entries indexed per transaction when
+    # building the search index.
+    SEARCH_INDEX_CHUNK_SIZE = 1000
+    # Backfills building the search index, and the key in ``BotState``
+    # set when all of them are done.
+    SEARCH_BACKFILLS = ("msglog_search", "msglog_search_archive")
+    SEARCH_INDEX_KEY = "search_index"
+
+    # Number of distinct recent slave chats kept in memory per Telegram chat.
+    RECENT_SLAVE_CHATS_SIZE = 10
+
+    # Schema version after all migrations, saved as ``user_version``
+    # of the database.
+    SCHEMA_VERSION = 5
+
+    # Time of message logs in epoch milliseconds, for entries with text
+    # time not rewritten by ``msglog_compact`` yet. Text always sorts
+    # above integers in SQLite, so the two can't be ordered as they are.
+    LEGACY_TIME_SQL = ("CASE WHEN typeof(time) = 'text' THEN "
+                       "CAST(strftime('%s', time, 'utc') AS INTEGER) * 1000 + "
+                       "CAST(substr(strftime('%f', time), 4) AS INTEGER) ELSE time END")
+
+    # Number of rows rewritten per transaction by data backfills of
+    # migrations, and the pause between two transactions.
+    BACKFILL_CHUNK_SIZE = 1000
+    BACKFILL_CHUNK_INTERVAL = 0.05
+
     def __init__(self, channel: EFBChannel):
         base_path = utils.get_data_path(channel.channel_id)
 
-        self.db = SqliteDatabase(str(base_path / 'tgdata.db'))
+        pragmas = self.DEFAULT_PRAGMAS.copy()
+        pragmas.update(channel.flag('sqlite_pragmas'))
+        self.query_stats = QueryStats(channel.flag('db_slow_query_threshold'))
+        self.db = TimedSqliteDatabase(str(base_path / 'tgdata.db'), self.query_stats, pragmas=pragmas)
 
         self.db.connect()
 
@@ -28,11 +736,19 @@ class DatabaseManager:
             master_uid = TextField()
             slave_uid = TextField()
 
+            class Meta:
+                indexes = (
+                    (('master_uid', 'slave_uid'), False),
+                    (('slave_uid', 'master_uid'), False),
+                )
+
         class MsgLog(BaseModel):
             master_msg_id = TextField(unique=True, primary_key=True)
+            master_chat_id = IntegerField(null=True)
+            master_message_id = IntegerField(null=True)
             master_msg_id_alt = TextField(null=True)
             slave_message_id = TextField()
-            text = TextField()
+            text = CompressedTextField(threshold=channel.flag('msg_log_compress_threshold'))
             slave_origin_uid = TextField()
             slave_origin_display_name = TextField(null=True)
             slave_member_uid = TextField(null=True)
@@ -42,7 +758,21 @@ class DatabaseManager:
             file_id = TextField(null=True)
             msg_type = TextField()
             sent_to = TextField()
-            time = DateTimeField(default=datetime.datetime.now, null=True)
+            # Stored as text by versions before migration 2, until the
+            # ``msglog_compact`` backfill converts it.
+            time = LegacyTimestampField(resolution=1000, default=datetime.datetime.now, null=True)
+
+            class Meta:
+                indexes = (
+                    (('slave_message_id', 'slave_origin_uid', 'time'), False),
+                    (('master_chat_id', 'time', 'slave_origin_uid'), False),
+                    (('time',), False),
+                )
+
+        class ArchivedMsgLog(MsgLog):
+            class Meta:
+                schema = "archive"
+                table_name = "msglog"
 
         class SlaveChatInfo(BaseModel):
             slave_channel_id = TextField()
@@ -52,26 +782,193 @@ class DatabaseManager:
             slave_chat_alias = TextField(null=True)
             slave_chat_type = CharField()
 
+            class Meta:
+                indexes = (
+                    (('slave_channel_id', 'slave_chat_uid'), True),
+                )
+
+        # Contentless full-text index, text is only kept in message logs.
+        # Its rows are removed with the text they are indexed with, see
+        # ``_unindex_msg_logs``.
+        class MsgLogSearch(FTS5Model):
+            text = SearchField()
+
+            class Meta:
+                database = self.db
+                table_name = "msglog_fts"
+                options = {'content': "''"}
+
+        # Message logs in the search index, by row ID of their entries in it
+        class MsgLogSearchKey(BaseModel):
+            # Never reused, so that a new entry does not take tokens left
+            # in the index by a removed message log.
+            id = AutoIncrementField()
+            master_msg_id = TextField(unique=True)
+
+            class Meta:
+                table_name = "msglog_fts_key"
+
+        # Values of bot state by key
+        class BotState(BaseModel):
+            key = TextField(primary_key=True)
+            value = TextField()
+
+        # Data backfills of migrations that are not finished yet
+        class SchemaBackfill(BaseModel):
+            name = TextField(primary_key=True)
+            # Last row ID processed
+            cursor = IntegerField(default=0)
+
         self.BaseModel = BaseModel
         self.ChatAssoc = ChatAssoc
         self.MsgLog = MsgLog
+        self.ArchivedMsgLog = ArchivedMsgLog
         self.SlaveChatInfo = SlaveChatInfo
+        self.MsgLogSearch = MsgLogSearch
+        self.MsgLogSearchKey = MsgLogSearchKey
+        self.SchemaBackfill = SchemaBackfill
+        self.BotState = BotState
+
+        # Data backfills of migrations by name, run in chunks by
+        # ``run_backfills`` after the structural changes are made.
+        # Backfills run in the order listed here, as later ones may
+        # depend on earlier ones, e.g. the search index is built from
+        # entries rewritten by ``msglog_compact``.
+        self.backfills: 'OrderedDict[str, Callable[[int], Optional[int]]]' = OrderedDict([
+            ("msglog_compact", self._backfill_msglog_compact),
+            ("msglog_search", self._backfill_msglog_search),
+            ("msglog_search_archive", self._backfill_msglog_search_archive),
+        ])
 
         if not ChatAssoc.table_exists():
             self._create()
-        elif "file_id" not in {i.name for i in self.db.get_columns("MsgLog")}:
-            self._migrate(0)
+        else:
+            self.db.create_tables([SchemaBackfill])
+            version = self.schema_version
+            if not version:
+                version = self._detect_schema_version()
+            if version < self.SCHEMA_VERSION:
+                self._migrate(version)
+
+        # Cold archive of message logs. Entries can be archived over RPC
+        # without a retention policy, so it is always attached here, before
+        # any other thread opens a connection.
+        self.archive_path = base_path / 'tgdata_archive.db'
+        self.has_archive = False
+        self._attach_archive()
+
+        # Full-text search index of message logs, built from existing
+        # entries by backfills after ``msglog_compact``.
+        self.has_search = False
+        if channel.flag('msg_log_search'):
+            if not MsgLogSearch.fts5_installed():
+                self.logger.warning("Message search is disabled as FTS5 is not available in SQLite.")
+            else:
+                self.has_search = True
+                self._schedule_search_index()
+        else:
+            self._drop_search_index()
+
+        # In-memory routing table of chat associations, loaded once at startup
+        # and written through by ``add_chat_assoc`` and ``remove_chat_assoc``.
+        self._assoc_lock = threading.Lock()
+        self._slaves_by_master: Dict[str, List[str]] = dict()
+        self._masters_by_slave: Dict[str, List[str]] = dict()
+        self._load_chat_assoc()
+
+        # Most recent distinct slave chats per Telegram chat, loaded lazily
+        # from message logs and updated by ``add_msg_log``.
+        self._recent_lock = threading.Lock()
+        self._recent_slave_chats: Dict[int, 'OrderedDict[str, None]'] = dict()
+
+        # Entries are also looked up by ``master_msg_id`` in Telegram chats
+        # until ``msglog_compact`` fills in ``master_chat_id``.
+        self._compact_pending = SchemaBackfill.select().where(SchemaBackfill.name == "msglog_compact").exists()
+
+        # Batched message log writer, disabled when interval is 0.
+        self.msg_log_writer: Optional[MsgLogWriter] = None
+        batch_interval = channel.flag('msg_log_batch_interval')
+        if batch_interval > 0:
+            self.msg_log_writer = MsgLogWriter(self, batch_interval / 1000,
+                                               channel.flag('msg_log_batch_size'))
+
+        # Cache of recent message log entries, disabled when size is 0.
+        self.msg_log_cache: Optional[MsgLogCache] = None
+        cache_size = channel.flag('msg_log_cache_size')
+        if cache_size > 0:
+            self.msg_log_cache = MsgLogCache(cache_size)
+
+        # Background tasks
+        self.tasks: List[PeriodicTask] = []
+
+        # Message log archiver, disabled when no retention policy is set.
+        retention_days = channel.flag('msg_log_retention_days')
+        retention_rows = channel.flag('msg_log_retention_rows')
+        self.retention_max_age = datetime.timedelta(days=retention_days) if retention_days > 0 else None
+        self.retention_max_rows = retention_rows if retention_rows > 0 else None
+        if retention_days > 0 or retention_rows > 0:
+            self.tasks.append(PeriodicTask(self, "MsgLog archiver", channel.flag('msg_log_archive_interval'),
+                                           self._archive_task))
+
+        # Maintenance in idle time, disabled when interval is 0.
+        self.db_path = base_path / 'tgdata.db'
+        self.maintenance_interval = channel.flag('db_maintenance_interval')
+        self.maintenance_idle = channel.flag('db_maintenance_idle')
+        self.last_maintenance = time.time()
+        if self.maintenance_interval > 0:
+            self.tasks.append(PeriodicTask(self, "database maintenance", self.MAINTENANCE_CHECK_INTERVAL,
+                                           self._maintenance_task))
+
+        # Scheduled backup, disabled when interval is 0.
+        self.backup_path = base_path / 'backups'
+        self.backup_keep = channel.flag('db_backup_keep')
+        backup_interval = channel.flag('db_backup_interval')
+        if backup_interval > 0:
+            self.tasks.append(PeriodicTask(self, "database backup", backup_interval, self._backup_task))
+
+        # Data backfills left by migrations, run while the bot is serving.
+        self.backfill_runner: Optional[BackfillRunner] = None
+        if SchemaBackfill.select().exists():
+            self.backfill_runner = BackfillRunner(self)
 
     def _create(self):
         """
         Initializing tables.
         """
-        self.db.execute_sql("PRAGMA journal_mode = OFF")
-        self.db.create_tables([self.ChatAssoc, self.MsgLog, self.SlaveChatInfo])
+        self.db.create_tables([self.ChatAssoc, self.MsgLog, self.SlaveChatInfo, self.SchemaBackfill,
+                               self.BotState])
+        self.schema_version = self.SCHEMA_VERSION
+
+    @property
+    def schema_version(self) -> int:
+        """Schema version of the database, 0 if it is not recorded yet."""
+        return self.db.execute_sql("PRAGMA user_version").fetchone()[0]
+
+    @schema_version.setter
+    def schema_version(self, version: int):
+        self.db.execute_sql("PRAGMA user_version = %d" % version)
+
+    def _detect_schema_version(self) -> int:
+        """Detect the schema version of a database created before versions are recorded."""
+        if "file_id" not in {i.name for i in self.db.get_columns("MsgLog")}:
+            return 0
+        if "slavechatinfo_slave_channel_id_slave_chat_uid" not in \
+                {i.name for i in self.db.get_indexes("SlaveChatInfo")}:
+            return 1
+        if "master_chat_id" not in {i.name for i in self.db.get_columns("MsgLog")}:
+            return 2
+        if "msglog_time" not in {i.name for i in self.db.get_indexes("MsgLog")}:
+            return 3
+        return 4
 
     def _migrate(self, i):
         """
-        Run migrations.
+        Run migrations, starting from the migration ID given, and record
+        the new schema version.
+
+        Only structural changes are made here. Data backfills are
+        scheduled in ``SchemaBackfill``, and run in the background by
+        ``run_backfills``.
 
         Args:
             i: Migration ID
@@ -79,8 +976,9 @@ class DatabaseManager:
         Returns:
             False: when migration ID is not found
         """
+        self.logger.info("Migrating database schema from version %s to %s.", i, self.SCHEMA_VERSION)
         migrator = SqliteMigrator(self.db)
-        if i >= 0:
+        if i <= 0:
             # Migration 0: Add media file ID and editable message ID
             # 2019JAN08
             migrate(
@@ -89,6 +987,46 @@ class DatabaseManager:
                 migrator.add_column("msglog", "mime", self.MsgLog.mime),
                 migrator.add_column("msglog", "master_msg_id_alt", self.MsgLog.master_msg_id_alt)
             )
+        if i <= 1:
+            # Migration 1: Add indexes for chat association, message log and
+            # slave chat info lookups.
+            # Duplicate slave chat info entries are removed before adding the
+            # unique index, keeping only the latest one.
+            # 2026OCT16
+            with self.db.atomic():
+                self.db.execute_sql("DELETE FROM slavechatinfo WHERE id NOT IN "
+                                    "(SELECT MAX(id) FROM slavechatinfo "
+                                    "GROUP BY slave_channel_id, slave_chat_uid)")
+                migrate(
+                    migrator.add_index("chatassoc", ("master_uid", "slave_uid"), False),
+                    migrator.add_index("chatassoc", ("slave_uid", "master_uid"), False),
+                    migrator.add_index("msglog", ("slave_message_id", "slave_origin_uid", "time"), False),
+                    migrator.add_index("slavechatinfo", ("slave_channel_id", "slave_chat_uid"), True)
+                )
+        if i <= 2:
+            # Migration 2: Compact message log schema.
+            # Split Telegram chat ID and message ID from ``master_msg_id`` into
+            # integer columns, and store ``time`` as epoch milliseconds.
+            # Existing entries are rewritten by the ``msglog_compact`` backfill.
+            # 2026OCT16
+            with self.db.atomic():
+                migrate(
+                    migrator.add_column("msglog", "master_chat_id", self.MsgLog.master_chat_id),
+                    migrator.add_column("msglog", "master_message_id", self.MsgLog.master_message_id),
+                    migrator.add_index("msglog", ("master_chat_id", "time", "slave_origin_uid"), False)
+                )
+                self.SchemaBackfill.insert(name="msglog_compact").on_conflict_ignore().execute()
+        if i <= 3:
+            # Migration 3: Add index on message time for retention policy.
+            # 2026OCT16
+            migrate(
+                migrator.add_index("msglog", ("time",), False)
+            )
+        if i <= 4:
+            # Migration 4: Add table of bot state, for offset of Telegram updates.
+            # 2026OCT16
+            self.db.create_tables([self.BotState])
+        self.schema_version = self.SCHEMA_VERSION
         # if i == 0:
         #     # Migration 0: Added Time column in MsgLog table.
         #     # 2016JUN15
@@ -103,6 +1041,158 @@ class DatabaseManager:
         # else:
         return False
 
+    def _backfill_msglog_compact(self, cursor: int) -> Optional[int]:
+        """
+        Backfill of migration 2: fill in Telegram chat and message IDs,
+        and convert text time to epoch milliseconds, for one chunk of
+        message log entries after the row ID given.
+
+        Returns:
+            Last row ID processed, ``None`` when there is no more entry.
+        """
+        last = self.db.execute_sql("SELECT MAX(rowid) FROM (SELECT rowid FROM msglog WHERE rowid > ? "
+                                   "ORDER BY rowid LIMIT ?)", (cursor, self.BACKFILL_CHUNK_SIZE)).fetchone()[0]
+        if last is None:
+            return None
+        self.db.execute_sql("UPDATE msglog SET "
+                            "master_chat_id = CAST(substr(master_msg_id, 1, "
+                            "instr(master_msg_id, '.') - 1) AS INTEGER), "
+                            "master_message_id = CAST(substr(master_msg_id, "
+                            "instr(master_msg_id, '.') + 1) AS INTEGER) "
+                            "WHERE rowid > ? AND rowid <= ? AND master_chat_id IS NULL "
+                            "AND instr(master_msg_id, '.') > 0", (cursor, last))
+        self.db.execute_sql("UPDATE msglog SET "
+                            "time = CAST(strftime('%s', time, 'utc') AS INTEGER) * 1000 + "
+                            "CAST(substr(strftime('%f', time), 4) AS INTEGER) "
+                            "WHERE rowid > ? AND rowid <= ? AND typeof(time) = 'text'", (cursor, last))
+        return last
+
+    @timed
+    def run_backfills(self, stopped: Optional[threading.Event] = None):
+        """
+        Run pending data backfills of migrations, one chunk per transaction.
+        Progress is saved with every chunk, so that backfills resume
+        where they stopped when interrupted.
+
+        Args:
+            stopped: Event to stop after the current chunk when set.
+        """
+        for backfill in self._pending_backfills():
+            task = self.backfills.get(backfill.name)
+            if task is None:
+                self.logger.warning("Unknown schema backfill %s is skipped.", backfill.name)
+                continue
+            total = self.db.execute_sql("SELECT MAX(rowid) FROM msglog").fetchone()[0] or 0
+            self.logger.info("Running schema backfill %s from row %s of %s.", backfill.name, backfill.cursor, total)
+            cursor = backfill.cursor
+            reported = 0
+            while True:
+                if stopped is not None and stopped.is_set():
+                    self.logger.info("Schema backfill %s is paused at row %s.", backfill.name, cursor)
+                    return
+                with self.db.atomic():
+                    last = task(cursor)
+                    if last is None:
+                        backfill.delete_instance()
+                    else:
+                        self.SchemaBackfill.update(cursor=last) \
+                            .where(self.SchemaBackfill.name == backfill.name).execute()
+                if last is None:
+                    self.logger.info("Schema backfill %s is finished.", backfill.name)
+                    self._backfill_finished(backfill.name)
+                    break
+                cursor = last
+                # Report every 10%
+                if total and cursor * 10 // total > reported:
+                    reported = cursor * 10 // total
+                    self.logger.info("Schema backfill %s: %s%% done.", backfill.name, min(reported * 10, 100))
+                if stopped is not None:
+                    stopped.wait(self.BACKFILL_CHUNK_INTERVAL)
+
+    def _pending_backfills(self) -> List['SchemaBackfill']:
+        """Pending backfills in the order they run, unknown ones last."""
+        order = list(self.backfills)
+        return sorted(self.SchemaBackfill.select(),
+                      key=lambda i: (order.index(i.name) if i.name in order else len(order), i.name))
+
+    def _backfill_finished(self, name: str):
+        if name == "msglog_compact":
+            self._compact_pending = False
+            # Recent chats may be loaded before all entries are rewritten
+            with self._recent_lock:
+                self._recent_slave_chats.clear()
+
+    def get_query_stats(self) -> Dict[str, Any]:
+        """
+        Timing of database methods since start or the last reset.
+
+        Returns:
+            Dict with ``methods``: call count, total and maximum time in
+            milliseconds, and a histogram of calls by time (upper bounds
+            in milliseconds) of each method; and ``slow_queries``: recent
+            statements slower than ``db_slow_query_threshold``, with their
+            SQL and query plan.
+        """
+        return self.query_stats.stats()
+
+    def reset_query_stats(self) -> bool:
+        """Clear timing of database methods."""
+        self.query_stats.reset()
+        return True
+
+    @timed
+    def get_migration_progress(self) -> Dict[str, Any]:
+        """
+        Schema version and progress of pending data backfills.
+
+        Returns:
+            Dict with ``version``, and ``backfills``: a list of dicts with
+            ``name``, ``cursor`` (last row ID processed) and ``total``
+            (largest row ID of the table).
+        """
+        total = self.db.execute_sql("SELECT MAX(rowid) FROM msglog").fetchone()[0] or 0
+        return {
+            "version": self.schema_version,
+            "backfills": [{"name": i.name, "cursor": i.cursor, "total": total}
+                          for i in self._pending_backfills()],
+        }
+
+    def _attach_archive(self):
+        """Attach the archive database to every connection, and create its tables."""
+        self.db.attach(str(self.archive_path), "archive")
+        self.db.execute_sql('PRAGMA "archive".journal_mode = wal')
+        self.db.create_tables([self.ArchivedMsgLog])
+        self.has_archive = True
+
+    @contextmanager
+    def connection_context(self):
+        """
+        Open a database connection for the current thread if it does not have
+        one yet, and close it when the context exits. Used in threads created
+        outside of the dispatcher.
+
+        Usage::
+
+            with db.connection_context():
+                ...
+        """
+        opened = self.db.connect(reuse_if_open=True)
+        try:
+            yield
+        finally:
+            if opened:
+                self.db.close()
+
+    def _load_chat_assoc(self):
+        """Load all chat associations into the in-memory routing table."""
+        with self._assoc_lock:
+            self._slaves_by_master.clear()
+            self._masters_by_slave.clear()
+            for row in self.ChatAssoc.select().order_by(self.ChatAssoc.id):
+                self._slaves_by_master.setdefault(row.master_uid, []).append(row.slave_uid)
+                self._masters_by_slave.setdefault(row.slave_uid, []).append(row.master_uid)
+
+    @timed
     def add_chat_assoc(self, master_uid, slave_uid, multiple_slave=False):
         """
         Add chat associations (chat links).
@@ -115,8 +1205,13 @@ class DatabaseManager:
         if not multiple_slave:
             self.remove_chat_assoc(master_uid=master_uid)
         self.remove_chat_assoc(slave_uid=slave_uid)
-        return self.ChatAssoc.create(master_uid=master_uid, slave_uid=slave_uid)
+        row = self.ChatAssoc.create(master_uid=master_uid, slave_uid=slave_uid)
+        with self._assoc_lock:
+            self._slaves_by_master.setdefault(master_uid, []).append(slave_uid)
+            self._masters_by_slave.setdefault(slave_uid, []).append(master_uid)
+        return row
 
+    @timed
     def remove_chat_assoc(self, master_uid=None, slave_uid=None):
         """
         Remove chat associations (chat links).
@@ -130,17 +1225,54 @@ class DatabaseManager:
             if bool(master_uid) == bool(slave_uid):
                 raise ValueError("Only one parameter is to be provided.")
             elif master_uid:
-                return self.ChatAssoc.delete().where(self.ChatAssoc.master_uid == master_uid).execute()
+                count = self.ChatAssoc.delete().where(self.ChatAssoc.master_uid == master_uid).execute()
+                with self._assoc_lock:
+                    for i in self._slaves_by_master.pop(master_uid, []):
+                        self._discard_assoc(self._masters_by_slave, i, master_uid)
+                return count
             elif slave_uid:
-                return self.ChatAssoc.delete().where(self.ChatAssoc.slave_uid == slave_uid).execute()
+                count = self.ChatAssoc.delete().where(self.ChatAssoc.slave_uid == slave_uid).execute()
+                with self._assoc_lock:
+                    for i in self._masters_by_slave.pop(slave_uid, []):
+                        self._discard_assoc(self._slaves_by_master, i, slave_uid)
+                return count
         except DoesNotExist:
             return 0
 
+    @timed
+    def update_chat_assoc(self, changes: Iterable[Dict[str, Any]]) -> int:
+        """
+        Apply many changes of chat associations (chat links) in one
+        transaction. See :meth:`BaseDatabaseManager.update_chat_assoc`.
+
+        Returns:
+            int: Number of changes applied.
+        """
+        try:
+            with self.db.atomic():
+                return super().update_chat_assoc(changes)
+        except Exception:
+            # Roll back the routing table along with the database
+            self._load_chat_assoc()
+            raise
+
+    @staticmethod
+    def _discard_assoc(table: Dict[str, List[str]], key: str, value: str):
+        """Remove all occurrences of ``value`` from ``table[key]``, and drop the key when empty."""
+        values = [i for i in table.get(key, []) if i != value]
+        if values:
+            table[key] = values
+        else:
+            table.pop(key, None)
+
+    @timed
     def get_chat_assoc(self, master_uid: str = None, slave_uid: str = None) -> List[str]:
         """
         Get chat association (chat link) information.
         Only one parameter is to be provided.
 
+        Answered from the in-memory routing table without querying the database.
+
         Args:
             master_uid (str): Master channel UID ("%(chat_id)s")
             slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
@@ -148,24 +1280,14 @@ class DatabaseManager:
         Returns:
             list: The counterpart ID.
         """
-        try:
-            if bool(master_uid) == bool(slave_uid):
-                raise ValueError("Only one parameter is to be provided.")
-            elif master_uid:
-                slaves = self.ChatAssoc.select().where(self.ChatAssoc.master_uid == master_uid)
-                if len(slaves) > 0:
-                    return [i.slave_uid for i in slaves]
-                else:
-                    return []
-            elif slave_uid:
-                masters = self.ChatAssoc.select().where(self.ChatAssoc.slave_uid == slave_uid)
-                if len(masters) > 0:
-                    return [i.master_uid for i in masters]
-                else:
-                    return []
-        except DoesNotExist:
-            return []
+        if bool(master_uid) == bool(slave_uid):
+            raise ValueError("Only one parameter is to be provided.")
+        elif master_uid:
+            return list(self._slaves_by_master.get(master_uid, ()))
+        else:
+            return list(self._masters_by_slave.get(slave_uid, ()))
 
+    @timed
     def get_last_msg_from_chat(self, chat_id):
         """Get last message from the selected chat from Telegram
 
@@ -175,12 +1297,25 @@ class DatabaseManager:
         Returns:
             MsgLog: The last message from the chat
         """
+        if self.msg_log_writer:
+            self.msg_log_writer.flush()
         try:
-            return self.MsgLog.select().where(self.MsgLog.master_msg_id.startswith("%s." % chat_id)).order_by(
-                self.MsgLog.time.desc()).first()
+            msg_log = self.MsgLog.select().where(self.MsgLog.master_chat_id == int(chat_id)).order_by(
+                self.MsgLog.time.desc(), self.MsgLog.master_message_id.desc()).first()
+            if msg_log is None and self._compact_pending:
+                # Entries not rewritten yet are older than all rewritten ones
+                msg_log = self.MsgLog.select().where(self._legacy_chat_condition(chat_id)) \
+                    .order_by(SQL(self.LEGACY_TIME_SQL).desc(), SQL("rowid").desc()).first()
+            return msg_log
         except DoesNotExist:
             return None
 
+    def _legacy_chat_condition(self, chat_id):
+        """Condition of message logs of a Telegram chat not rewritten by ``msglog_compact`` yet."""
+        return self.MsgLog.master_chat_id.is_null() & \
+            self.MsgLog.master_msg_id.startswith("%s." % int(chat_id))
+
+    @timed
     def add_msg_log(self, **kwargs):
         """
         Add an entry to message log.
@@ -219,8 +1354,11 @@ class DatabaseManager:
         file_id = kwargs.get('file_id', None)
         mime = kwargs.get('mime', None)
         update = kwargs.get('update', False)
+        self.mark_activity()
         if update:
-            msg_log = self.MsgLog.get(self.MsgLog.master_msg_id == master_msg_id)
+            msg_log = self.get_msg_log(master_msg_id=master_msg_id)
+            if not msg_log:
+                raise self.MsgLog.DoesNotExist("Message log %s is not found." % master_msg_id)
             msg_log.text = text or msg_log.text
             msg_log.msg_type = msg_type or msg_log.msg_type
             msg_log.sent_to = sent_to or msg_log.sent_to
@@ -233,24 +1371,47 @@ class DatabaseManager:
             msg_log.media_type = media_type or msg_log.media_type
             msg_log.file_id = file_id or msg_log.file_id
             msg_log.mime = mime or msg_log.mime
-            msg_log.save()
+            if self.msg_log_writer:
+                self.msg_log_writer.put(msg_log)
+            else:
+                with self.db.atomic():
+                    self._unindex_msg_logs([master_msg_id])
+                    msg_log.save()
+                    self._index_msg_logs([msg_log])
+            if self.msg_log_cache:
+                self.msg_log_cache.put(msg_log)
             return msg_log
         else:
-            return self.MsgLog.create(master_msg_id=master_msg_id,
-                                      slave_message_id=slave_message_id,
-                                      text=text,
-                                      slave_origin_uid=slave_origin_uid,
-                                      msg_type=msg_type,
-                                      sent_to=sent_to,
-                                      slave_origin_display_name=slave_origin_display_name,
-                                      slave_member_uid=slave_member_uid,
-                                      slave_member_display_name=slave_member_display_name,
-                                      master_msg_id_alt=master_msg_id_alt,
-                                      media_type=media_type,
-                                      file_id=file_id,
-                                      mime=mime
-                                      )
+            master_chat_id, master_message_id = self._split_master_msg_id(master_msg_id)
+            msg_log = self.MsgLog(master_msg_id=master_msg_id,
+                                  master_chat_id=master_chat_id,
+                                  master_message_id=master_message_id,
+                                  slave_message_id=slave_message_id,
+                                  text=text,
+                                  slave_origin_uid=slave_origin_uid,
+                                  msg_type=msg_type,
+                                  sent_to=sent_to,
+                                  slave_origin_display_name=slave_origin_display_name,
+                                  slave_member_uid=slave_member_uid,
+                                  slave_member_display_name=slave_member_display_name,
+                                  master_msg_id_alt=master_msg_id_alt,
+                                  media_type=media_type,
+                                  file_id=file_id,
+                                  mime=mime
+                                  )
+            if self.msg_log_writer:
+                self.msg_log_writer.put(msg_log)
+            else:
+                with self.db.atomic():
+                    self._unindex_msg_logs([master_msg_id])
+                    msg_log.save(force_insert=True)
+                    self._index_msg_logs([msg_log])
+            if self.msg_log_cache:
+                self.msg_log_cache.put(msg_log)
+            self._touch_recent_slave_chat(master_chat_id, slave_origin_uid)
+            return msg_log
 
+    @timed
     def get_msg_log(self,
                     master_msg_id: Optional[str] = None,
                     slave_msg_id: Optional[str] = None,
@@ -270,17 +1431,33 @@ class DatabaseManager:
             raise ValueError('master_msg_id and slave_msg_id is mutual exclusive')
         if not master_msg_id and not (slave_msg_id and slave_origin_uid):
             raise ValueError('slave_msg_id and slave_origin_uid must exists together.')
-        try:
-            if master_msg_id:
-                return self.MsgLog.select().where(self.MsgLog.master_msg_id == master_msg_id) \
-                    .order_by(self.MsgLog.time.desc()).first()
-            else:
-                return self.MsgLog.select().where((self.MsgLog.slave_message_id == slave_msg_id) &
-                                                  (self.MsgLog.slave_origin_uid == slave_origin_uid)
-                                                  ).order_by(self.MsgLog.time.desc()).first()
-        except DoesNotExist:
-            return None
+        if self.msg_log_cache:
+            cached = self.msg_log_cache.get(master_msg_id, slave_msg_id, slave_origin_uid)
+            if cached:
+                return cached
+        if self.msg_log_writer:
+            pending = self.msg_log_writer.get(master_msg_id, slave_msg_id, slave_origin_uid)
+            if pending:
+                return pending
+        models = [self.MsgLog, self.ArchivedMsgLog] if self.has_archive else [self.MsgLog]
+        for model in models:
+            try:
+                if master_msg_id:
+                    msg_log = model.select().where(model.master_msg_id == master_msg_id) \
+                        .order_by(model.time.desc()).first()
+                else:
+                    msg_log = model.select().where((model.slave_message_id == slave_msg_id) &
+                                                   (model.slave_origin_uid == slave_origin_uid)
+                                                   ).order_by(model.time.desc()).first()
+            except DoesNotExist:
+                msg_log = None
+            if msg_log:
+                if self.msg_log_cache:
+                    self.msg_log_cache.put(msg_log)
+                return msg_log
+        return None
 
+    @timed
     def delete_msg_log(self,
                        master_msg_id: Optional[str] = None,
                        slave_msg_id: Optional[str] = None,
@@ -297,16 +1474,501 @@ class DatabaseManager:
             raise ValueError('master_msg_id and slave_msg_id is mutual exclusive')
         if not master_msg_id and not (slave_msg_id and slave_origin_uid):
             raise ValueError('slave_msg_id and slave_origin_uid must exists together.')
-        try:
+        if self.msg_log_cache:
+            self.msg_log_cache.discard(master_msg_id, slave_msg_id, slave_origin_uid)
+        if self.msg_log_writer:
+            self.msg_log_writer.discard(master_msg_id, slave_msg_id, slave_origin_uid)
+        models = [self.MsgLog, self.ArchivedMsgLog] if self.has_archive else [self.MsgLog]
+        if self.has_search:
             if master_msg_id:
-                self.MsgLog.delete().where(self.MsgLog.master_msg_id == master_msg_id).execute()
+                self._unindex_msg_logs([master_msg_id])
             else:
-                self.MsgLog.delete().where((self.MsgLog.slave_message_id == slave_msg_id) &
-                                           (self.MsgLog.slave_origin_uid == slave_origin_uid)
-                                           ).execute()
-        except DoesNotExist:
+                for model in models:
+                    self._unindex_msg_logs([i.master_msg_id for i in model.select(model.master_msg_id).where(
+                        (model.slave_message_id == slave_msg_id) & (model.slave_origin_uid == slave_origin_uid))])
+        for model in models:
+            try:
+                if master_msg_id:
+                    model.delete().where(model.master_msg_id == master_msg_id).execute()
+                else:
+                    model.delete().where((model.slave_message_id == slave_msg_id) &
+                                         (model.slave_origin_uid == slave_origin_uid)
+                                         ).execute()
+            except DoesNotExist:
+                pass
+
+    def _search_rows(self, msg_logs: Iterable['MsgLog']) -> List[dict]:
+        return [dict(master_msg_id=i.master_msg_id, text=i.text) for i in msg_logs if i.text]
+
+    def _index_msg_logs(self, msg_logs: List['MsgLog']):
+        """
+        Add message logs to the search index. Their earlier entries in the
+        index must be removed by :meth:`_unindex_msg_logs` before the new
+        values are written.
+        """
+        if not self.has_search:
+            return
+        for batch in chunked(self._search_rows(msg_logs), self.BULK_INSERT_SIZE):
+            self.MsgLogSearchKey.insert_many([{"master_msg_id": i["master_msg_id"]} for i in batch]).execute()
+            keys = dict(self.MsgLogSearchKey
+                        .select(self.MsgLogSearchKey.master_msg_id, self.MsgLogSearchKey.id)
+                        .where(self.MsgLogSearchKey.master_msg_id.in_([i["master_msg_id"] for i in batch]))
+                        .tuples())
+            self.MsgLogSearch.insert_many([{self.MsgLogSearch.rowid: keys[i["master_msg_id"]],
+                                            self.MsgLogSearch.text: i["text"]} for i in batch]).execute()
+
+    def _unindex_msg_logs(self, master_msg_ids: List[str]):
+        """
+        Remove message logs from the search index. As the index is
+        contentless, this must be done before their text is changed or
+        removed, while it is still the text they are indexed with.
+        """
+        if not self.has_search:
+            return
+        models = [self.MsgLog, self.ArchivedMsgLog] if self.has_archive else [self.MsgLog]
+        table = self.MsgLogSearch._meta.table_name
+        for batch in chunked(master_msg_ids, self.BULK_INSERT_SIZE):
+            keys = dict(self.MsgLogSearchKey
+                        .select(self.MsgLogSearchKey.master_msg_id, self.MsgLogSearchKey.id)
+                        .where(self.MsgLogSearchKey.master_msg_id.in_(batch))
+                        .tuples())
+            if not keys:
+                continue
+            for model in models:
+                for master_msg_id, text in model.select(model.master_msg_id, model.text) \
+                        .where(model.master_msg_id.in_(list(keys))).tuples():
+                    if text:
+                        self.db.execute_sql('INSERT INTO "%s" ("%s", rowid, "text") VALUES (\'delete\', ?, ?)'
+                                            % (table, table), (keys[master_msg_id], text))
+            self.MsgLogSearchKey.delete().where(self.MsgLogSearchKey.id.in_(list(keys.values()))).execute()
+
+    def _schedule_search_index(self):
+        """
+        Create the search index, and schedule backfills to add existing
+        message logs to it, unless it is built or being built.
+        An index left incomplete by earlier versions, or built by versions
+        before it is contentless, is built again.
+        """
+        if self.MsgLogSearchKey.table_exists() and (
+                self.BotState.select().where(self.BotState.key == self.SEARCH_INDEX_KEY).exists() or
+                self.SchemaBackfill.select().where(self.SchemaBackfill.name.in_(self.SEARCH_BACKFILLS)).exists()):
+            return
+        self.logger.info("Building search index of message logs in background.")
+        with self.db.atomic():
+            self.BotState.delete().where(self.BotState.key == self.SEARCH_INDEX_KEY).execute()
+            self.SchemaBackfill.delete().where(self.SchemaBackfill.name.in_(self.SEARCH_BACKFILLS)).execute()
+            self.db.drop_tables([self.MsgLogSearch, self.MsgLogSearchKey], safe=True)
+            self.db.create_tables([self.MsgLogSearch, self.MsgLogSearchKey])
+            self.SchemaBackfill.insert_many([{"name": i} for i in self.SEARCH_BACKFILLS]).execute()
+
+    def _drop_search_index(self):
+        """Remove the search index, so that it is built again when search is enabled again."""
+        if not self.db.table_exists(self.MsgLogSearch._meta.table_name):
+            return
+        with self.db.atomic():
+            self.BotState.delete().where(self.BotState.key == self.SEARCH_INDEX_KEY).execute()
+            self.SchemaBackfill.delete().where(self.SchemaBackfill.name.in_(self.SEARCH_BACKFILLS)).execute()
+            self.db.drop_tables([self.MsgLogSearch, self.MsgLogSearchKey], safe=True)
+
+    def _index_chunk(self, name: str, model, table: str, cursor: int) -> Optional[int]:
+        """
+        Add a chunk of message logs after the row ID given to the search
+        index, and mark the index as built when all backfills of it are done.
+
+        Returns:
+            Last row ID processed, ``None`` when there is no more entry.
+        """
+        last = None
+        if self.has_search and (model is self.MsgLog or self.has_archive):
+            last = self.db.execute_sql("SELECT MAX(rowid) FROM (SELECT rowid FROM %s WHERE rowid > ? "
+                                       "ORDER BY rowid LIMIT ?)" % table,
+                                       (cursor, self.SEARCH_INDEX_CHUNK_SIZE)).fetchone()[0]
+        if last is None:
+            if not self.SchemaBackfill.select().where(self.SchemaBackfill.name.in_(self.SEARCH_BACKFILLS) &
+                                                      (self.SchemaBackfill.name != name)).exists():
+                self.BotState.replace(key=self.SEARCH_INDEX_KEY, value="1").execute()
+                self.logger.info("Search index of message logs is built.")
+            return None
+        chunk = list(model.select().where(SQL("rowid > ? AND rowid <= ?", (cursor, last))))
+        # Entries written after the backfill started are indexed already
+        self._unindex_msg_logs([i.master_msg_id for i in chunk])
+        self._index_msg_logs(chunk)
+        return last
+
+    def _backfill_msglog_search(self, cursor: int) -> Optional[int]:
+        """Backfill of the search index: add a chunk of message logs to it."""
+        return self._index_chunk("msglog_search", self.MsgLog, '"msglog"', cursor)
+
+    def _backfill_msglog_search_archive(self, cursor: int) -> Optional[int]:
+        """Backfill of the search index: add a chunk of archived message logs to it."""
+        return self._index_chunk("msglog_search_archive", self.ArchivedMsgLog, '"archive"."msglog"', cursor)
+
+    @timed
+    def search_msg_log(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, str]]:
+        """
+        Search message logs by text, ranked by relevance.
+
+        Every word in the query must appear in the message.
+
+        Args:
+            query: Words to search for
+            limit: Maximum number of results to return
+            offset: Number of results to skip
+
+        Returns:
+            List[Dict[str, str]]: ``master_msg_id``, ``slave_origin_uid``,
+            ``text`` and ``time`` (ISO 8601) of matching messages, best match first.
+        """
+        if not self.has_search:
+            return []
+        if self.msg_log_writer:
+            self.msg_log_writer.flush()
+        terms = ['"%s"' % i.replace('"', '""') for i in query.split()]
+        if not terms:
+            return []
+        rowids = [i for i, in self.MsgLogSearch.select(self.MsgLogSearch.rowid)
+                  .where(self.MsgLogSearch.text.match(" ".join(terms)))
+                  .order_by(self.MsgLogSearch.rank())
+                  .limit(limit).offset(offset).tuples()]
+        if not rowids:
+            return []
+        keys = dict(self.MsgLogSearchKey.select(self.MsgLogSearchKey.id, self.MsgLogSearchKey.master_msg_id)
+                    .where(self.MsgLogSearchKey.id.in_(rowids)).tuples())
+        msg_logs = dict()
+        models = [self.MsgLog, self.ArchivedMsgLog] if self.has_archive else [self.MsgLog]
+        for model in models:
+            for i in model.select(model.master_msg_id, model.slave_origin_uid, model.text, model.time) \
+                    .where(model.master_msg_id.in_(list(keys.values()))):
+                msg_logs[i.master_msg_id] = i
+        results = [msg_logs[keys[i]] for i in rowids if keys.get(i) in msg_logs]
+        return [dict(master_msg_id=i.master_msg_id,
+                     slave_origin_uid=i.slave_origin_uid or "",
+                     text=i.text,
+                     time=i.time.isoformat() if i.time else "")
+                for i in results]
+
+    def _archive_task(self, stopped: threading.Event):
+        start = time.time()
+        count = self.archive_msg_log(max_age=self.retention_max_age, max_rows=self.retention_max_rows,
+                                     stopped=stopped)
+        if count:
+            self.logger.info("%s message log entries are archived in %.2f seconds.", count, time.time() - start)
+
+    @timed
+    def archive_msg_log(self, max_age: Optional[datetime.timedelta] = None,
+                        max_rows: Optional[int] = None,
+                        stopped: Optional[threading.Event] = None) -> int:
+        """
+        Move message logs beyond the retention policy to the archive database,
+        in chunks of ``ARCHIVE_CHUNK_SIZE`` entries per transaction.
+
+        Args:
+            max_age: Archive entries older than this.
+            max_rows: Archive the oldest entries beyond this number of entries.
+            stopped: Stop archiving after the current chunk when this event is set.
+
+        Returns:
+            int: Number of entries archived.
+        """
+        if not self.has_archive:
+            self.logger.warning("Message logs are not archived as the archive database is not attached.")
+            return 0
+        cutoff: Optional[datetime.datetime] = None
+        if max_age:
+            cutoff = datetime.datetime.now() - max_age
+        if max_rows:
+            boundary = self.MsgLog.select(self.MsgLog.time).order_by(self.MsgLog.time.desc()) \
+                .offset(max_rows).limit(1).first()
+            if boundary and boundary.time:
+                boundary = boundary.time + datetime.timedelta(milliseconds=1)
+                if cutoff is None or boundary > cutoff:
+                    cutoff = boundary
+        if cutoff is None:
+            return 0
+
+        fields = self.MsgLog._meta.sorted_fields
+        count = 0
+        while not (stopped and stopped.is_set()):
+            with self.db.atomic():
+                ids = [i.master_msg_id for i in
+                       self.MsgLog.select(self.MsgLog.master_msg_id)
+                           .where(self.MsgLog.time < cutoff)
+                           .order_by(self.MsgLog.time)
+                           .limit(self.ARCHIVE_CHUNK_SIZE)]
+                if not ids:
+                    break
+                self.ArchivedMsgLog.insert_from(
+                    self.MsgLog.select(*fields).where(self.MsgLog.master_msg_id.in_(ids)),
+                    self.ArchivedMsgLog._meta.sorted_fields
+                ).on_conflict_replace().execute()
+                self.MsgLog.delete().where(self.MsgLog.master_msg_id.in_(ids)).execute()
+                # Cached entries are of rows no longer in the main table
+                if self.msg_log_cache:
+                    for master_msg_id in ids:
+                        self.msg_log_cache.discard(master_msg_id=master_msg_id)
+            count += len(ids)
+            time.sleep(self.ARCHIVE_CHUNK_INTERVAL)
+        return count
+
+    @timed
+    def recompress_msg_log(self) -> Dict[str, int]:
+        """
+        Rewrite text of all existing message logs with the current
+        compression threshold, in chunks of ``RECOMPRESS_CHUNK_SIZE``
+        entries per transaction.
+
+        Texts above the threshold are compressed, and compressed texts
+        below it (or all of them when compression is disabled) are
+        stored as plain text again.
+
+        Returns:
+            Dict[str, int]: Number of ``rows`` rewritten, and ``kb_saved``
+            (in KiB, to fit in integers of XML-RPC; negative if texts are
+            decompressed).
+        """
+        if self.msg_log_writer:
+            self.msg_log_writer.flush()
+        field = self.MsgLog.text
+        rows = 0
+        bytes_saved = 0
+        models = [self.MsgLog, self.ArchivedMsgLog] if self.has_archive else [self.MsgLog]
+        for model in models:
+            table = '"%s"."%s"' % (model._meta.schema or "main", model._meta.table_name)
+            last_rowid = 0
+            while True:
+                with self.db.atomic():
+                    chunk = self.db.execute_sql('SELECT rowid, "text" FROM %s WHERE rowid > ? '
+                                                'ORDER BY rowid LIMIT ?' % table,
+                                                (last_rowid, self.RECOMPRESS_CHUNK_SIZE)).fetchall()
+                    if not chunk:
+                        break
+                    for rowid, old_value in chunk:
+                        if old_value is None:
+                            continue
+                        new_value = field.db_value(field.python_value(old_value))
+                        if new_value == old_value:
+                            continue
+                        self.db.execute_sql('UPDATE %s SET "text" = ? WHERE rowid = ?' % table,
+                                            (new_value, rowid))
+                        old_size = len(old_value) if isinstance(old_value, bytes) else len(old_value.encode())
+                        new_size = len(new_value) if isinstance(new_value, bytes) else len(new_value.encode())
+                        rows += 1
+                        bytes_saved += old_size - new_size
+                    last_rowid = chunk[-1][0]
+        self.logger.info("Recompressed %s message log entries, %s bytes saved.", rows, bytes_saved)
+        return {"rows": rows, "kb_saved": int(bytes_saved / 1024)}
+
+    @timed
+    def backup(self, path: Optional[str] = None,
+               progress: Optional[Callable[[int, int], Any]] = None) -> Dict[str, Any]:
+        """
+        Copy the database to a file while the bot is running, with the
+        SQLite online backup API. Archived message logs are copied to a
+        file next to it, see :meth:`archive_backup_path`.
+
+        ``BACKUP_STEP_PAGES`` pages are copied at a time, with a pause of
+        ``BACKUP_STEP_INTERVAL`` seconds in between so that writers are never
+        blocked for long. As a write from another connection restarts the
+        copy, the remaining pages are copied in one step from a read
+        snapshot after ``BACKUP_MAX_RESTARTS`` restarts.
+
+        Args:
+            path: Path of the backup file. Defaults to a timestamped file
+                in the ``backups`` folder of the channel data directory.
+            progress: Function called with the number of pages copied and
+                the total number of pages after each step.
+
+        Returns:
+            Dict[str, Any]: ``path`` of the backup, ``archive_path`` of the
+            backup of archived message logs (empty if there is no archive),
+            number of ``pages`` copied, and ``seconds`` spent.
+        """
+        if self.msg_log_writer:
+            self.msg_log_writer.flush()
+        if path is None:
+            self.backup_path.mkdir(parents=True, exist_ok=True)
+            path = str(self.backup_path / datetime.datetime.now().strftime("tgdata-%Y%m%d-%H%M%S.db"))
+        targets = [("main", path)]
+        if self.has_archive:
+            targets.append(("archive", self.archive_backup_path(path)))
+        start = time.time()
+        pages = 0
+
+        with self.connection_context():
+            source = self.db.connection()
+            if not hasattr(source, "backup"):
+                raise NotImplementedError("Online backup requires Python 3.7 or later.")
+            try:
+                for name, target_path in targets:
+                    pages += self._backup_schema(source, name, target_path + ".part", pages, progress)
+            except BaseException:
+                # Do not leave incomplete backups behind
+                for _, target_path in targets:
+                    if os.path.exists(target_path + ".part"):
+                        os.unlink(target_path + ".part")
+                raise
+        for _, target_path in targets:
+            os.replace(target_path + ".part", target_path)
+        duration = time.time() - start
+        self.logger.info("Database is backed up to %s in %.2f seconds (%s pages).", path, duration, pages)
+        return {"path": path, "archive_path": targets[1][1] if len(targets) > 1 else "",
+                "pages": pages, "seconds": duration}
+
+    def _backup_schema(self, source: sqlite3.Connection, name: str, path: str, copied: int,
+                       progress: Optional[Callable[[int, int], Any]]) -> int:
+        """
+        Copy a schema of the database to a file, and return the number of
+        pages copied. Progress includes the ``copied`` pages of schemas before.
+        """
+        state = {"remaining": None, "restarts": 0, "total": 0}
+
+        class BackupRestarted(Exception):
+            pass
+
+        def step(status, remaining, total):
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > self.BACKUP_MAX_RESTARTS:
+                    raise BackupRestarted()
+            state["remaining"] = remaining
+            state["total"] = total
+            if progress:
+                progress(copied + total - remaining, copied + total)
+
+        target = sqlite3.connect(path)
+        try:
+            try:
+                source.backup(target, pages=self.BACKUP_STEP_PAGES, progress=step,
+                              name=name, sleep=self.BACKUP_STEP_INTERVAL)
+            except BackupRestarted:
+                self.logger.info("Database backup restarted %s times by concurrent writes, "
+                                 "copying the rest in one step.", state["restarts"] - 1)
+                source.backup(target, pages=-1, progress=step, name=name)
+        finally:
+            target.close()
+        return state["total"]
+
+    @staticmethod
+    def archive_backup_path(path: str) -> str:
+        """Path of the backup of archived message logs, next to the backup at ``path``."""
+        root, ext = os.path.splitext(path)
+        return root + "_archive" + ext
+
+    def _backup_task(self, stopped: threading.Event):
+        self.backup()
+        backups = sorted(i for i in self.backup_path.glob("tgdata-*.db") if not i.stem.endswith("_archive"))
+        for i in backups[:max(len(backups) - self.backup_keep, 0)]:
+            i.unlink()
+            archive = self.archive_backup_path(str(i))
+            if os.path.exists(archive):
+                os.unlink(archive)
+            self.logger.info("Removed old database backup %s.", i)
+
+    def _maintenance_task(self, stopped: threading.Event):
+        if time.time() - self.last_maintenance < self.maintenance_interval:
+            return
+        if time.time() - self.last_activity < self.maintenance_idle:
             return
+        self.maintain(stopped=stopped)
+
+    def _db_size(self) -> int:
+        """Size of the database file and its WAL in bytes."""
+        paths = [self.db_path, self.db_path.with_name(self.db_path.name + "-wal")]
+        return sum(i.stat().st_size for i in paths if i.exists())
+
+    def _maintenance_steps(self, interrupted: Callable[[], bool]) -> bool:
+        """Run maintenance steps until ``interrupted``, and return whether all steps are done."""
+        # Statistics for the query planner, sampled to keep it short.
+        self.db.execute_sql("PRAGMA analysis_limit = %d" % self.ANALYSIS_LIMIT)
+        self.db.execute_sql("ANALYZE")
+        if interrupted():
+            return False
+
+        # Incremental vacuum only works with auto_vacuum = incremental (2),
+        # see ``enable_incremental_vacuum`` for older databases.
+        if self.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while self.db.execute_sql("PRAGMA freelist_count").fetchone()[0] > 0:
+                if interrupted():
+                    return False
+                self.db.execute_sql("PRAGMA incremental_vacuum(%d)" % self.VACUUM_STEP_PAGES).fetchall()
+
+        self.db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return True
+
+    @timed
+    def maintain(self, stopped: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        Refresh query planner statistics, reclaim free pages with
+        incremental vacuum, and truncate the WAL.
+
+        Steps are short, and the rest is skipped when there is new activity
+        (see :meth:`mark_activity`) or ``stopped`` is set, to yield to live
+        traffic. Skipped steps are run in the next maintenance.
+
+        Returns:
+            Dict[str, Any]: Whether all steps are ``completed``, ``kb_reclaimed``
+            (in KiB, to fit in integers of XML-RPC) and ``seconds`` spent.
+        """
+        start = time.time()
+        size_before = self._db_size()
+
+        def interrupted():
+            return (stopped is not None and stopped.is_set()) or self.last_activity > start
+
+        with self.connection_context():
+            if self.msg_log_writer:
+                self.msg_log_writer.flush()
+            completed = self._maintenance_steps(interrupted)
+        if completed:
+            self.last_maintenance = time.time()
+        reclaimed = size_before - self._db_size()
+        result = {"completed": completed,
+                  "kb_reclaimed": reclaimed // 1024,
+                  "seconds": time.time() - start}
+        self.logger.info("Database maintenance %s in %.2f seconds, %s bytes reclaimed.",
+                         "completed" if completed else "postponed for new activity",
+                         result["seconds"], reclaimed)
+        return result
 
+    @timed
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Switch a database created without incremental auto vacuum to it,
+        so that maintenance can reclaim free pages.
+
+        This runs a full ``VACUUM``, which locks the database until it is
+        done and needs free disk space of about the size of the database.
+        Only run it when the bot is stopped or idle, e.g. through RPC.
+
+        Returns:
+            bool: Whether the database was converted, ``False`` if it is
+            already using incremental auto vacuum.
+        """
+        with self.connection_context():
+            if self.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            if self.msg_log_writer:
+                self.msg_log_writer.flush()
+            start = time.time()
+            self.db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            self.db.execute_sql("VACUUM")
+        self.logger.info("Database is converted to incremental auto vacuum in %.2f seconds.", time.time() - start)
+        return True
+
+    @timed
+    def get_msg_log_cache_stats(self) -> Dict[str, int]:
+        """
+        Get statistics of the recent message log cache.
+
+        Returns:
+            Dict[str, int]: ``size``, ``capacity``, ``hits`` and ``misses``
+            of the cache, empty if the cache is disabled.
+        """
+        if not self.msg_log_cache:
+            return {}
+        return self.msg_log_cache.stats()
+
+    @timed
     def get_slave_chat_info(self, slave_channel_id=None, slave_chat_uid=None) -> Optional['SlaveChatInfo']:
         """
         Get cached slave chat info from database.
@@ -323,6 +1985,7 @@ class DatabaseManager:
         except DoesNotExist:
             return None
 
+    @timed
     def set_slave_chat_info(self,
                             slave_channel_id=None,
                             slave_channel_name=None,
@@ -346,34 +2009,172 @@ class DatabaseManager:
         Returns:
             SlaveChatInfo: The inserted or updated row
         """
-        if self.get_slave_chat_info(slave_channel_id=slave_channel_id, slave_chat_uid=slave_chat_uid):
-            chat_info = self.SlaveChatInfo.get(self.SlaveChatInfo.slave_channel_id == slave_channel_id,
-                                               self.SlaveChatInfo.slave_chat_uid == slave_chat_uid)
-            chat_info.slave_channel_name = slave_channel_name
-            chat_info.slave_channel_emoji = slave_channel_emoji
-            chat_info.slave_chat_name = slave_chat_name
-            chat_info.slave_chat_alias = slave_chat_alias
-            chat_info.slave_chat_type = slave_chat_type.value
-            chat_info.save()
-            return chat_info
-        else:
-            return self.SlaveChatInfo.create(slave_channel_id=slave_channel_id,
-                                             slave_channel_name=slave_channel_name,
-                                             slave_channel_emoji=slave_channel_emoji,
-                                             slave_chat_uid=slave_chat_uid,
-                                             slave_chat_name=slave_chat_name,
-                                             slave_chat_alias=slave_chat_alias,
-                                             slave_chat_type=slave_chat_type.value)
+        self._upsert_slave_chat_info([dict(slave_channel_id=slave_channel_id,
+                                           slave_channel_emoji=slave_channel_emoji,
+                                           slave_chat_uid=slave_chat_uid,
+                                           slave_chat_name=slave_chat_name,
+                                           slave_chat_alias=slave_chat_alias,
+                                           slave_chat_type=slave_chat_type.value)])
+        return self.get_slave_chat_info(slave_channel_id=slave_channel_id, slave_chat_uid=slave_chat_uid)
 
+    @timed
+    def set_slave_chats_info(self, chats: Iterable[EFBChat]) -> int:
+        """
+        Insert or update slave chat info entries of a list of chats
+        in one transaction.
+
+        Args:
+            chats: Slave chats to update
+
+        Returns:
+            int: Number of chats updated
+        """
+        return self._upsert_slave_chat_info(dict(slave_channel_id=i.module_id,
+                                                 slave_channel_emoji=i.channel_emoji,
+                                                 slave_chat_uid=i.chat_uid,
+                                                 slave_chat_name=i.chat_name,
+                                                 slave_chat_alias=i.chat_alias,
+                                                 slave_chat_type=i.chat_type.value)
+                                            for i in chats)
+
+    def _upsert_slave_chat_info(self, rows: Iterable[dict]) -> int:
+        """Insert slave chat info rows, and update existing rows on conflict."""
+        count = 0
+        conflict_target = [self.SlaveChatInfo.slave_channel_id, self.SlaveChatInfo.slave_chat_uid]
+        preserve = [self.SlaveChatInfo.slave_channel_emoji,
+                    self.SlaveChatInfo.slave_chat_name, self.SlaveChatInfo.slave_chat_alias,
+                    self.SlaveChatInfo.slave_chat_type]
+        with self.db.atomic():
+            for batch in chunked(rows, self.BULK_INSERT_SIZE):
+                self.SlaveChatInfo.insert_many(batch) \
+                    .on_conflict(conflict_target=conflict_target, preserve=preserve).execute()
+                count += len(batch)
+        return count
+
+    @timed
     def delete_slave_chat_info(self, slave_channel_id, slave_chat_uid):
         return self.SlaveChatInfo.delete()\
             .where((self.SlaveChatInfo.slave_channel_id == slave_channel_id) &
                    (self.SlaveChatInfo.slave_chat_uid == slave_chat_uid)).execute()
 
+    @timed
+    def get_update_offset(self) -> int:
+        state = self.BotState.get_or_none(self.BotState.key == "update_offset")
+        return int(state.value) if state else 0
+
+    @timed
+    def set_update_offset(self, offset: int):
+        self.BotState.replace(key="update_offset", value=str(offset)).execute()
+        return True
+
+    def _touch_recent_slave_chat(self, master_chat_id: Optional[int], slave_origin_uid: Optional[str]):
+        """Move a slave chat to the top of recent chats of a Telegram chat, if loaded."""
+        if master_chat_id is None or not slave_origin_uid:
+            return
+        with self._recent_lock:
+            recent = self._recent_slave_chats.get(master_chat_id)
+            if recent is None:
+                return
+            recent[slave_origin_uid] = None
+            recent.move_to_end(slave_origin_uid, last=False)
+            while len(recent) > self.RECENT_SLAVE_CHATS_SIZE:
+                recent.popitem()
+
+    @timed
     def get_recent_slave_chats(self, master_chat_id, limit=5):
-        return [i.slave_origin_uid for i in
-                self.MsgLog.select(self.MsgLog.slave_origin_uid)
-                    .distinct()
-                    .where(self.MsgLog.master_msg_id.startswith("%s." % master_chat_id))
-                    .order_by(self.MsgLog.time.desc())
-                    .limit(limit)]
+        """
+        Get slave chats recently delivered to or from a Telegram chat.
+
+        Args:
+            master_chat_id: Telegram chat ID
+            limit: Maximum number of chats to return
+
+        Returns:
+            List[str]: Slave chat IDs, most recent first.
+        """
+        master_chat_id = int(master_chat_id)
+        with self._recent_lock:
+            recent = self._recent_slave_chats.get(master_chat_id)
+            if recent is not None and limit <= self.RECENT_SLAVE_CHATS_SIZE:
+                return list(recent)[:limit]
+        if self.msg_log_writer:
+            self.msg_log_writer.flush()
+        chats = [i.slave_origin_uid for i in
+                 self.MsgLog.select(self.MsgLog.slave_origin_uid)
+                     .where(self.MsgLog.master_chat_id == master_chat_id)
+                     .group_by(self.MsgLog.slave_origin_uid)
+                     .order_by(fn.MAX(self.MsgLog.time).desc())
+                     .limit(max(limit, self.RECENT_SLAVE_CHATS_SIZE))]
+        if self._compact_pending and len(chats) < max(limit, self.RECENT_SLAVE_CHATS_SIZE):
+            # Entries not rewritten yet are older than all rewritten ones
+            for i in self.MsgLog.select(self.MsgLog.slave_origin_uid) \
+                    .where(self._legacy_chat_condition(master_chat_id)) \
+                    .group_by(self.MsgLog.slave_origin_uid) \
+                    .order_by(fn.MAX(SQL(self.LEGACY_TIME_SQL)).desc()) \
+                    .limit(max(limit, self.RECENT_SLAVE_CHATS_SIZE)):
+                if i.slave_origin_uid not in chats:
+                    chats.append(i.slave_origin_uid)
+        with self._recent_lock:
+            self._recent_slave_chats.setdefault(
+                master_chat_id, OrderedDict((i, None) for i in chats[:self.RECENT_SLAVE_CHATS_SIZE]))
+        return chats[:limit]
+
+    @timed
+    def export_cache_state(self) -> Dict[str, Any]:
+        """
+        In-memory state to be saved in a warm start snapshot: recent slave
+        chats of each Telegram chat, and keys of cached message logs from
+        the least recently used.
+        """
+        with self._recent_lock:
+            recent_slave_chats = {str(k): list(v) for k, v in self._recent_slave_chats.items()}
+        msg_log_cache: List[str] = []
+        if self.msg_log_cache:
+            with self.msg_log_cache.lock:
+                msg_log_cache = list(self.msg_log_cache.entries)
+        return {
+            "schema_version": self.SCHEMA_VERSION,
+            "recent_slave_chats": recent_slave_chats,
+            "msg_log_cache": msg_log_cache,
+        }
+
+    @timed
+    def import_cache_state(self, state: Dict[str, Any]) -> bool:
+        """
+        Restore in-memory state from a warm start snapshot. Cached message
+        logs are read again from the database. Nothing is restored if the
+        state is malformed.
+
+        Returns:
+            bool: If the state is restored, ``False`` when the snapshot is
+            saved with another schema version.
+        """
+        if state.get("schema_version") != self.SCHEMA_VERSION:
+            self.logger.info("Database state in warm start snapshot of schema version %s is ignored.",
+                             state.get("schema_version"))
+            return False
+        recent_slave_chats = {int(chat_id): OrderedDict((str(i), None) for i in chats[:self.RECENT_SLAVE_CHATS_SIZE])
+                              for chat_id, chats in state.get("recent_slave_chats", {}).items()}
+        master_msg_ids = [str(i) for i in state.get("msg_log_cache", [])]
+        with self._recent_lock:
+            for chat_id, chats in recent_slave_chats.items():
+                self._recent_slave_chats.setdefault(chat_id, chats)
+        if self.msg_log_cache:
+            master_msg_ids = master_msg_ids[-self.msg_log_cache.capacity:]
+            msg_logs: Dict[str, 'MsgLog'] = dict()
+            for batch in chunked(master_msg_ids, self.BULK_INSERT_SIZE):
+                for i in self.MsgLog.select().where(self.MsgLog.master_msg_id.in_(batch)):
+                    msg_logs[i.master_msg_id] = i
+            for i in master_msg_ids:
+                if i in msg_logs:
+                    self.msg_log_cache.put(msg_logs[i])
+        return True
+
+    def graceful_stop(self):
+        """Stop background workers, and write all pending changes to the database."""
+        for task in self.tasks:
+            task.stop()
+        if self.backfill_runner:
+            self.backfill_runner.stop()
+        if self.msg_log_writer:
+            self.msg_log_writer.stop()
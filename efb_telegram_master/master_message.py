@@ -31,7 +31,7 @@ from pypinyin import lazy_pinyin
 if TYPE_CHECKING:
     from . import TelegramChannel
     from .bot_manager import TelegramBotManager
-    from .db import DatabaseManager
+    from .db import BaseDatabaseManager
 
 
 class MasterMessageProcessor(LocaleMixin):
@@ -59,7 +59,7 @@ class MasterMessageProcessor(LocaleMixin):
     def __init__(self, channel: 'TelegramChannel'):
         self.channel: 'TelegramChannel' = channel
         self.bot: 'TelegramBotManager' = channel.bot_manager
-        self.db: 'DatabaseManager' = channel.db
+        self.db: 'BaseDatabaseManager' = channel.db
         self.bot.dispatcher.add_handler(MessageHandler(
             Filters.text | Filters.photo | Filters.sticker | Filters.document |
             Filters.venue | Filters.location | Filters.audio | Filters.voice | Filters.video,
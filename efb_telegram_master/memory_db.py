@@ -0,0 +1,266 @@
+# coding=utf-8
+
+import datetime
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Tuple, Iterable
+
+from peewee import DoesNotExist
+
+from ehforwarderbot import EFBChannel, EFBChat
+from .db import BaseDatabaseManager
+
+__all__ = ['MemoryDatabaseManager', 'MemoryMsgLog', 'MemorySlaveChatInfo']
+
+
+class MemoryMsgLog:
+    """Message log entry kept in memory, with the same attributes as ``DatabaseManager.MsgLog``."""
+
+    __slots__ = ('master_msg_id', 'master_chat_id', 'master_message_id', 'master_msg_id_alt',
+                 'slave_message_id', 'text', 'slave_origin_uid', 'slave_origin_display_name',
+                 'slave_member_uid', 'slave_member_display_name', 'media_type', 'mime', 'file_id',
+                 'msg_type', 'sent_to', 'time')
+
+    class DoesNotExist(DoesNotExist):
+        """Raised when an entry to update is not found, like ``DatabaseManager.MsgLog.DoesNotExist``."""
+
+    def __init__(self, **kwargs):
+        for i in self.__slots__:
+            setattr(self, i, kwargs.get(i))
+        if self.time is None:
+            self.time = datetime.datetime.now()
+
+    def __repr__(self):
+        return "<MemoryMsgLog: %s>" % self.master_msg_id
+
+
+class MemorySlaveChatInfo:
+    """Slave chat info entry kept in memory, with the same attributes as ``DatabaseManager.SlaveChatInfo``."""
+
+    __slots__ = ('slave_channel_id', 'slave_channel_emoji', 'slave_chat_uid',
+                 'slave_chat_name', 'slave_chat_alias', 'slave_chat_type')
+
+    def __init__(self, **kwargs):
+        for i in self.__slots__:
+            setattr(self, i, kwargs.get(i))
+
+    def __repr__(self):
+        return "<MemorySlaveChatInfo: %s %s>" % (self.slave_channel_id, self.slave_chat_uid)
+
+
+class MemoryDatabaseManager(BaseDatabaseManager):
+    """
+    Storage kept in memory with dicts and indexes only, for tests,
+    benchmarks and ephemeral deployments.
+
+    Nothing is written to disk, and everything is lost when the
+    channel stops. Message logs are never removed automatically.
+    """
+
+    MsgLog = MemoryMsgLog
+
+    def __init__(self, channel: EFBChannel):
+        self.lock = threading.RLock()
+
+        # Chat associations
+        self.slaves_by_master: Dict[str, List[str]] = dict()
+        self.masters_by_slave: Dict[str, List[str]] = dict()
+
+        # Message logs, and indexes by slave message and by Telegram chat
+        self.msg_logs: Dict[str, MemoryMsgLog] = dict()
+        self.msg_logs_by_slave: Dict[Tuple[str, str], List[str]] = dict()
+        self.msg_logs_by_chat: Dict[int, 'OrderedDict[str, None]'] = dict()
+        self.recent_slave_chats: Dict[int, 'OrderedDict[str, None]'] = dict()
+
+        # Slave chat info
+        self.slave_chat_info: Dict[Tuple[str, str], MemorySlaveChatInfo] = dict()
+
+        # Offset of the next Telegram update
+        self.update_offset = 0
+
+    def add_chat_assoc(self, master_uid, slave_uid, multiple_slave=False):
+        with self.lock:
+            if not multiple_slave:
+                self.remove_chat_assoc(master_uid=master_uid)
+            self.remove_chat_assoc(slave_uid=slave_uid)
+            self.slaves_by_master.setdefault(master_uid, []).append(slave_uid)
+            self.masters_by_slave.setdefault(slave_uid, []).append(master_uid)
+
+    def remove_chat_assoc(self, master_uid=None, slave_uid=None):
+        if bool(master_uid) == bool(slave_uid):
+            raise ValueError("Only one parameter is to be provided.")
+        with self.lock:
+            if master_uid:
+                slaves = self.slaves_by_master.pop(master_uid, [])
+                for i in slaves:
+                    self.masters_by_slave[i].remove(master_uid)
+                    if not self.masters_by_slave[i]:
+                        del self.masters_by_slave[i]
+                return len(slaves)
+            else:
+                masters = self.masters_by_slave.pop(slave_uid, [])
+                for i in masters:
+                    self.slaves_by_master[i].remove(slave_uid)
+                    if not self.slaves_by_master[i]:
+                        del self.slaves_by_master[i]
+                return len(masters)
+
+    def get_chat_assoc(self, master_uid: str = None, slave_uid: str = None) -> List[str]:
+        if bool(master_uid) == bool(slave_uid):
+            raise ValueError("Only one parameter is to be provided.")
+        with self.lock:
+            if master_uid:
+                return list(self.slaves_by_master.get(master_uid, ()))
+            else:
+                return list(self.masters_by_slave.get(slave_uid, ()))
+
+    def get_last_msg_from_chat(self, chat_id):
+        with self.lock:
+            msg_ids = self.msg_logs_by_chat.get(int(chat_id))
+            if not msg_ids:
+                return None
+            return self.msg_logs[next(reversed(msg_ids))]
+
+    def _index_msg_log(self, msg_log: MemoryMsgLog, chat: bool = True):
+        """Index an entry, and by its Telegram chat as the last one unless ``chat`` is False."""
+        self.msg_logs[msg_log.master_msg_id] = msg_log
+        self.msg_logs_by_slave.setdefault((msg_log.slave_message_id, msg_log.slave_origin_uid), []) \
+            .append(msg_log.master_msg_id)
+        if chat and msg_log.master_chat_id is not None:
+            self.msg_logs_by_chat.setdefault(msg_log.master_chat_id, OrderedDict())[msg_log.master_msg_id] = None
+            if msg_log.slave_origin_uid:
+                recent = self.recent_slave_chats.setdefault(msg_log.master_chat_id, OrderedDict())
+                recent[msg_log.slave_origin_uid] = None
+                recent.move_to_end(msg_log.slave_origin_uid, last=False)
+
+    def _unindex_msg_log(self, msg_log: MemoryMsgLog, chat: bool = True):
+        """Remove an entry from indexes, keeping it in the index by Telegram chat unless ``chat``."""
+        self.msg_logs.pop(msg_log.master_msg_id, None)
+        slave_key = (msg_log.slave_message_id, msg_log.slave_origin_uid)
+        msg_ids = self.msg_logs_by_slave.get(slave_key, [])
+        if msg_log.master_msg_id in msg_ids:
+            msg_ids.remove(msg_log.master_msg_id)
+        if not msg_ids:
+            self.msg_logs_by_slave.pop(slave_key, None)
+        if not chat:
+            return
+        chat_msg_ids = self.msg_logs_by_chat.get(msg_log.master_chat_id)
+        if chat_msg_ids is not None:
+            chat_msg_ids.pop(msg_log.master_msg_id, None)
+            if not chat_msg_ids:
+                del self.msg_logs_by_chat[msg_log.master_chat_id]
+
+    def add_msg_log(self, **kwargs):
+        fields = ('text', 'msg_type', 'sent_to', 'slave_origin_uid', 'slave_origin_display_name',
+                  'slave_member_uid', 'slave_member_display_name', 'slave_message_id',
+                  'media_type', 'file_id', 'mime')
+        master_msg_id = kwargs.get('master_msg_id')
+        with self.lock:
+            update = kwargs.get('update', False)
+            if update:
+                msg_log = self.msg_logs.get(master_msg_id)
+                if not msg_log:
+                    raise self.MsgLog.DoesNotExist("Message log %s is not found." % master_msg_id)
+                # Updated entries keep their place in the chat, as they keep their time
+                self._unindex_msg_log(msg_log, chat=False)
+                for i in fields:
+                    setattr(msg_log, i, kwargs.get(i) or getattr(msg_log, i))
+                msg_log.master_msg_id_alt = kwargs.get('master_msg_id_alt', None)
+            else:
+                master_chat_id, master_message_id = self._split_master_msg_id(master_msg_id)
+                msg_log = MemoryMsgLog(master_msg_id=master_msg_id,
+                                       master_chat_id=master_chat_id,
+                                       master_message_id=master_message_id,
+                                       master_msg_id_alt=kwargs.get('master_msg_id_alt', None),
+                                       **{i: kwargs.get(i) for i in fields})
+                if master_msg_id in self.msg_logs:
+                    self._unindex_msg_log(self.msg_logs[master_msg_id])
+            self._index_msg_log(msg_log, chat=not update)
+            return msg_log
+
+    def get_msg_log(self,
+                    master_msg_id: Optional[str] = None,
+                    slave_msg_id: Optional[str] = None,
+                    slave_origin_uid: Optional[str] = None) -> Optional[MemoryMsgLog]:
+        if (master_msg_id and (slave_msg_id or slave_origin_uid)) \
+                or not (master_msg_id or (slave_msg_id or slave_origin_uid)):
+            raise ValueError('master_msg_id and slave_msg_id is mutual exclusive')
+        if not master_msg_id and not (slave_msg_id and slave_origin_uid):
+            raise ValueError('slave_msg_id and slave_origin_uid must exists together.')
+        with self.lock:
+            if not master_msg_id:
+                msg_ids = self.msg_logs_by_slave.get((slave_msg_id, slave_origin_uid))
+                if not msg_ids:
+                    return None
+                master_msg_id = msg_ids[-1]
+            return self.msg_logs.get(master_msg_id)
+
+    def delete_msg_log(self,
+                       master_msg_id: Optional[str] = None,
+                       slave_msg_id: Optional[str] = None,
+                       slave_origin_uid: Optional[str] = None):
+        if (master_msg_id and (slave_msg_id or slave_origin_uid)) \
+                or not (master_msg_id or (slave_msg_id or slave_origin_uid)):
+            raise ValueError('master_msg_id and slave_msg_id is mutual exclusive')
+        if not master_msg_id and not (slave_msg_id and slave_origin_uid):
+            raise ValueError('slave_msg_id and slave_origin_uid must exists together.')
+        with self.lock:
+            if master_msg_id:
+                msg_ids = [master_msg_id]
+            else:
+                msg_ids = list(self.msg_logs_by_slave.get((slave_msg_id, slave_origin_uid), []))
+            for i in msg_ids:
+                if i in self.msg_logs:
+                    self._unindex_msg_log(self.msg_logs[i])
+
+    def get_update_offset(self) -> int:
+        return self.update_offset
+
+    def set_update_offset(self, offset: int):
+        self.update_offset = offset
+        return True
+
+    def get_recent_slave_chats(self, master_chat_id, limit=5):
+        with self.lock:
+            return list(self.recent_slave_chats.get(int(master_chat_id), ()))[:limit]
+
+    def get_slave_chat_info(self, slave_channel_id=None, slave_chat_uid=None) -> Optional[MemorySlaveChatInfo]:
+        if slave_channel_id is None or slave_chat_uid is None:
+            raise ValueError("Both slave_channel_id and slave_chat_id should be provided.")
+        with self.lock:
+            return self.slave_chat_info.get((slave_channel_id, slave_chat_uid))
+
+    def set_slave_chat_info(self,
+                            slave_channel_id=None,
+                            slave_channel_name=None,
+                            slave_channel_emoji=None,
+                            slave_chat_uid=None,
+                            slave_chat_name=None,
+                            slave_chat_alias="",
+                            slave_chat_type=None) -> MemorySlaveChatInfo:
+        chat_info = MemorySlaveChatInfo(slave_channel_id=slave_channel_id,
+                                        slave_channel_emoji=slave_channel_emoji,
+                                        slave_chat_uid=slave_chat_uid,
+                                        slave_chat_name=slave_chat_name,
+                                        slave_chat_alias=slave_chat_alias,
+                                        slave_chat_type=slave_chat_type.value)
+        with self.lock:
+            self.slave_chat_info[(slave_channel_id, slave_chat_uid)] = chat_info
+        return chat_info
+
+    def set_slave_chats_info(self, chats: Iterable[EFBChat]) -> int:
+        count = 0
+        with self.lock:
+            for i in chats:
+                self.set_slave_chat_info(slave_channel_id=i.module_id,
+                                         slave_channel_emoji=i.channel_emoji,
+                                         slave_chat_uid=i.chat_uid,
+                                         slave_chat_name=i.chat_name,
+                                         slave_chat_alias=i.chat_alias,
+                                         slave_chat_type=i.chat_type)
+                count += 1
+        return count
+
+    def delete_slave_chat_info(self, slave_channel_id, slave_chat_uid):
+        with self.lock:
+            return 1 if self.slave_chat_info.pop((slave_channel_id, slave_chat_uid), None) else 0
@@ -0,0 +1,125 @@
+# coding=utf-8
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from ehforwarderbot import EFBMsg, EFBChat, coordinator
+from ehforwarderbot.constants import MsgType, ChatType
+
+from . import utils
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+    from .db import BaseDatabaseManager
+
+
+class MessageLookupManager:
+    """
+    Look up messages delivered to or from Telegram by their ETM message
+    ID (``"chat_id.message_id"``), for ``TelegramChannel.get_message_by_id``.
+
+    Messages are rebuilt from message logs, and the messages rebuilt are
+    kept in a bounded LRU cache, which is checked against the message
+    log on every lookup, so that edited messages are rebuilt again.
+    """
+
+    logger: logging.Logger = logging.getLogger(__name__)
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel: 'TelegramChannel' = channel
+        self.db: 'BaseDatabaseManager' = channel.db
+        self.capacity: int = channel.flag('msg_log_cache_size')
+        self.lock = threading.Lock()
+        # Message rebuilt and the message log fields it is built from, by message ID
+        self.cache: 'OrderedDict[str, Tuple[tuple, EFBMsg]]' = OrderedDict()
+
+    @staticmethod
+    def _fields(msg_log) -> tuple:
+        return (msg_log.text, msg_log.msg_type, msg_log.slave_origin_uid, msg_log.slave_origin_display_name,
+                msg_log.slave_member_uid, msg_log.slave_member_display_name, msg_log.slave_message_id,
+                msg_log.sent_to, msg_log.media_type, msg_log.mime, msg_log.file_id)
+
+    def get_message_by_id(self, msg_id: str) -> Optional[EFBMsg]:
+        """
+        Get a message delivered to or from Telegram.
+
+        Args:
+            msg_id: ETM message ID (``"chat_id.message_id"``)
+
+        Returns:
+            A copy of the message rebuilt from the message log, without
+            the media file. Telegram file ID of the media is in
+            ``vendor_specific["telegram_file_id"]``. ``None`` if the
+            message is not found.
+        """
+        msg_log = self.db.get_msg_log(master_msg_id=msg_id)
+        if msg_log is None:
+            with self.lock:
+                self.cache.pop(msg_id, None)
+            return None
+        fields = self._fields(msg_log)
+        with self.lock:
+            cached = self.cache.get(msg_id)
+            if cached is not None and cached[0] == fields:
+                self.cache.move_to_end(msg_id)
+                return self._copy(cached[1])
+        msg = self.build_message(msg_id, msg_log)
+        if self.capacity > 0:
+            with self.lock:
+                self.cache[msg_id] = (fields, msg)
+                self.cache.move_to_end(msg_id)
+                while len(self.cache) > self.capacity:
+                    self.cache.popitem(last=False)
+        return self._copy(msg)
+
+    @staticmethod
+    def _copy(msg: EFBMsg) -> EFBMsg:
+        """Copy of a cached message that can be changed by the caller."""
+        result = copy.copy(msg)
+        result.vendor_specific = msg.vendor_specific.copy()
+        return result
+
+    def build_message(self, msg_id: str, msg_log) -> EFBMsg:
+        """Rebuild a message from its message log."""
+        msg = EFBMsg()
+        msg.uid = msg_id
+        msg.text = msg_log.text
+        # Types were saved as ``MsgType.Text`` by earlier versions
+        msg_type = str(msg_log.msg_type).split(".")[-1]
+        msg.type = MsgType(msg_type) if msg_type in MsgType.__members__ else MsgType.Unsupported
+        msg.mime = msg_log.mime
+
+        chat_ids = utils.chat_id_str_to_id(msg_log.slave_origin_uid or "")
+        channel_id, chat_uid = chat_ids if len(chat_ids) == 2 else (None, "")
+        slave = coordinator.slaves.get(channel_id)
+        msg.chat = EFBChat(slave)
+        msg.chat.chat_uid = chat_uid
+        chat_info = self.db.get_slave_chat_info(channel_id, chat_uid) if slave else None
+        if chat_info:
+            msg.chat.chat_name = chat_info.slave_chat_name
+            msg.chat.chat_alias = chat_info.slave_chat_alias
+            msg.chat.chat_type = ChatType(chat_info.slave_chat_type)
+        elif msg_log.slave_origin_display_name != "__chat__":
+            msg.chat.chat_name = msg_log.slave_origin_display_name
+            msg.chat.chat_alias = msg_log.slave_origin_display_name
+
+        # Member ID is only saved for messages not sent by the user
+        if not msg_log.slave_member_uid:
+            msg.author = EFBChat(self.channel).self()
+        elif msg_log.slave_member_uid == chat_uid:
+            msg.author = msg.chat
+        else:
+            msg.author = EFBChat(slave)
+            msg.author.chat_name = msg_log.slave_member_display_name
+            msg.author.chat_alias = msg_log.slave_member_display_name
+            msg.author.chat_uid = msg_log.slave_member_uid
+            msg.author.is_chat = False
+            msg.author.group = msg.chat
+
+        if msg_log.file_id:
+            msg.vendor_specific["telegram_file_id"] = msg_log.file_id
+            msg.vendor_specific["telegram_media_type"] = msg_log.media_type
+        return msg
@@ -0,0 +1,148 @@
+# coding=utf-8
+
+import logging
+from typing import Tuple, Dict, List, TYPE_CHECKING
+
+import telegram
+from telegram.ext import ConversationHandler, CommandHandler, CallbackQueryHandler
+
+from . import utils
+from .chat_binding import ETMChat
+from .constants import Flags
+from .locale_mixin import LocaleMixin
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+    from .bot_manager import TelegramBotManager
+    from .db import BaseDatabaseManager
+
+
+class MessageSearchManager(LocaleMixin):
+    """
+    Full-text search of delivered messages.
+    Triggered by ``/search``.
+    """
+
+    results_per_page = 10
+    preview_length = 100
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel: 'TelegramChannel' = channel
+        self.bot: 'TelegramBotManager' = channel.bot_manager
+        self.db: 'BaseDatabaseManager' = channel.db
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        # Search query of each result message
+        self.msg_storage: Dict[Tuple[int, int], str] = dict()
+
+        self.bot.dispatcher.add_handler(CommandHandler("search", self.search, pass_args=True))
+        self.search_handler = ConversationHandler(
+            entry_points=[],
+            states={Flags.SEARCH_RESULT: [CallbackQueryHandler(self.search_result_page)]},
+            fallbacks=[CallbackQueryHandler(self.bot.session_expired)],
+            per_message=True,
+            per_chat=True,
+            per_user=False
+        )
+        self.bot.dispatcher.add_handler(self.search_handler)
+
+    def search(self, bot, update, args=None):
+        """
+        Search for messages delivered to or from Telegram.
+        Triggered by ``/search``.
+
+        Args:
+            bot: Telegram Bot instance
+            update: Message update
+            args: Words to search for
+        """
+        if not self.db.has_search:
+            return self.bot.reply_error(update, self._("Message search is not enabled."))
+        query = " ".join(args or [])
+        if not query:
+            return self.bot.reply_error(update, self._("Usage: /search keywords"))
+        chat_id = update.effective_chat.id
+        message_id = self.bot.send_message(chat_id, self._("Searching...")).message_id
+        self.msg_storage[(chat_id, message_id)] = query
+        return self.search_result_gen_page(chat_id, message_id)
+
+    def search_result_gen_page(self, chat_id: int, message_id: int, offset: int = 0) -> int:
+        """
+        Show a page of search results in a message.
+
+        Args:
+            chat_id: Telegram chat ID of the result message
+            message_id: Telegram message ID of the result message
+            offset: Number of results to skip
+
+        Returns:
+            int: Next status
+        """
+        query = self.msg_storage[(chat_id, message_id)]
+        results = self.db.search_msg_log(query, limit=self.results_per_page + 1, offset=offset)
+        has_next = len(results) > self.results_per_page
+        results = results[:self.results_per_page]
+
+        if not results:
+            self.bot.edit_message_text_async(text=self._("No message is found for \"{query}\".").format(query=query),
+                                             chat_id=chat_id, message_id=message_id)
+            self.msg_storage.pop((chat_id, message_id), None)
+            return ConversationHandler.END
+
+        lines: List[str] = [self._("Messages found for \"{query}\":").format(query=query)]
+        for i, result in enumerate(results, start=offset + 1):
+            text = result['text']
+            if len(text) > self.preview_length:
+                text = text[:self.preview_length] + "…"
+            lines.append("\n%s. %s [%s]\n%s" % (i, self.get_chat_name(result['slave_origin_uid']),
+                                               result['time'][:16].replace("T", " "), text))
+
+        buttons: List[telegram.InlineKeyboardButton] = []
+        if offset > 0:
+            buttons.append(telegram.InlineKeyboardButton(self._("< Prev"), callback_data="offset %s" % (
+                max(offset - self.results_per_page, 0))))
+        buttons.append(telegram.InlineKeyboardButton(self._("Close"), callback_data=Flags.CANCEL_PROCESS))
+        if has_next:
+            buttons.append(telegram.InlineKeyboardButton(self._("Next >"), callback_data="offset %s" % (
+                offset + self.results_per_page)))
+
+        self.bot.edit_message_text_async(text="\n".join(lines), chat_id=chat_id, message_id=message_id,
+                                         reply_markup=telegram.InlineKeyboardMarkup([buttons]))
+        self.search_handler.conversations[(chat_id, message_id)] = Flags.SEARCH_RESULT
+        return Flags.SEARCH_RESULT
+
+    def search_result_page(self, bot, update) -> int:
+        """
+        Turn pages of search results. Triggered by callback message on status
+        `Flags.SEARCH_RESULT`.
+
+        Args:
+            bot: Telegram Bot instance
+            update: The update
+
+        Returns:
+            int: Next status
+        """
+        chat_id = update.effective_chat.id
+        message_id = update.effective_message.message_id
+        callback_uid: str = update.callback_query.data
+        if callback_uid.split()[0] == "offset" and (chat_id, message_id) in self.msg_storage:
+            return self.search_result_gen_page(chat_id, message_id, offset=int(callback_uid.split()[1]))
+
+        # Close the result, or the query is lost
+        self.bot.edit_message_reply_markup_async(chat_id=chat_id, message_id=message_id)
+        self.msg_storage.pop((chat_id, message_id), None)
+        return ConversationHandler.END
+
+    def get_chat_name(self, chat_uid: str) -> str:
+        """Display name of a slave chat by its ID, the ID itself if not known."""
+        if not chat_uid:
+            return self._("Unknown chat")
+        try:
+            channel_id, chat_id = utils.chat_id_str_to_id(chat_uid)
+        except ValueError:
+            return chat_uid
+        chat = self.channel.chat_binding.get_chat_from_db(channel_id, chat_id)
+        if not chat:
+            return chat_uid
+        return ETMChat(chat=chat, db=self.db).full_name
@@ -0,0 +1,163 @@
+# coding=utf-8
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import telegram
+
+from ehforwarderbot import EFBMsg
+
+from . import utils
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+    from .bot_manager import TelegramBotManager
+
+__all__ = ['MirrorTarget', 'MirrorManager']
+
+
+class MirrorTarget:
+    """
+    A Telegram chat where messages from slave channels are mirrored to.
+
+    Args:
+        chat_id: Telegram chat ID
+        chats: Only mirror messages from these slave chats, in the
+            form of ``"channel_id chat_uid"``. All chats if ``None``.
+        exclude_chats: Never mirror messages from these slave chats.
+        types: Only mirror messages of these types, by names of
+            ``MsgType``. All types if ``None``.
+    """
+
+    def __init__(self, chat_id: int, chats: Optional[List[str]] = None,
+                 exclude_chats: Optional[List[str]] = None, types: Optional[List[str]] = None):
+        self.chat_id = chat_id
+        self.chats = set(chats) if chats is not None else None
+        self.exclude_chats = set(exclude_chats or ())
+        self.types = set(types) if types is not None else None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'MirrorTarget':
+        return cls(config['chat_id'], config.get('chats'), config.get('exclude_chats'), config.get('types'))
+
+    def match(self, msg: EFBMsg) -> bool:
+        """If a message from slave channel is mirrored to this chat."""
+        chat = utils.chat_id_to_str(chat=msg.chat)
+        if self.chats is not None and chat not in self.chats:
+            return False
+        if chat in self.exclude_chats:
+            return False
+        if self.types is not None and msg.type.name not in self.types:
+            return False
+        return True
+
+
+class MirrorManager:
+    """
+    Deliver messages from slave channels to mirror chats.
+
+    Each mirror chat has its own queue, and messages are sent to it in
+    the order they are delivered. Deliveries to mirror chats run
+    alongside the delivery to the primary chat, so that a slow mirror
+    never delays the primary chat, nor any other mirror.
+
+    Mirror chats are configured with ``mirrors`` in the configuration,
+    or are the second admin if it is omitted.
+    """
+
+    logger: logging.Logger = logging.getLogger(__name__)
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel: 'TelegramChannel' = channel
+        self.bot: 'TelegramBotManager' = channel.bot_manager
+        self.targets: List[MirrorTarget] = self.load_targets(channel.config)
+        self.executors: Dict[int, ThreadPoolExecutor] = {
+            i.chat_id: ThreadPoolExecutor(max_workers=1, thread_name_prefix="ETM mirror %s" % i.chat_id)
+            for i in self.targets
+        }
+        # Messages are dropped after stop, as executors no longer take them.
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    @staticmethod
+    def load_targets(config: Dict[str, Any]) -> List[MirrorTarget]:
+        if 'mirrors' in config:
+            return [MirrorTarget.from_config(i) for i in config['mirrors'] or ()]
+        # Mirror to the second admin by default
+        return [MirrorTarget(i) for i in config['admins'][1:2]]
+
+    def targets_of(self, msg: EFBMsg) -> List[MirrorTarget]:
+        return [i for i in self.targets if i.match(msg)]
+
+    def send(self, msg: EFBMsg, method: str, *args, **kwargs) -> List[Future]:
+        """
+        Send a message to all mirror chats it is mirrored to, without
+        waiting for it to be sent.
+
+        Args:
+            msg: Message from slave channel
+            method: Name of the method of :class:`.bot_manager.TelegramBotManager`
+            *args: Parameters of the method after the chat ID
+            **kwargs: Keyword parameters of the method
+
+        Returns:
+            Futures of messages sent to each mirror chat, empty if
+            delivery is stopped.
+        """
+        # Messages replied to are only in the primary chat
+        kwargs.pop('reply_to_message_id', None)
+        with self.lock:
+            if self.stopped:
+                self.logger.debug("[%s] Mirror delivery is stopped, message is not mirrored.", msg.uid)
+                return []
+            return [self.executors[i.chat_id].submit(self._send, msg.uid, method, i.chat_id, *args, **kwargs)
+                    for i in self.targets_of(msg)]
+
+    def send_media(self, msg: EFBMsg, tg_msg: telegram.Message, **kwargs) -> List[Future]:
+        """
+        Send the media of a message sent to the primary chat to all
+        mirror chats, by its file ID on Telegram, without uploading it
+        again.
+
+        Args:
+            msg: Message from slave channel
+            tg_msg: Message sent to the primary chat
+            **kwargs: Parameters of the method sending the media,
+                besides the chat and the file.
+
+        Returns:
+            Futures of messages sent to each mirror chat.
+        """
+        media = self._media_of(tg_msg)
+        if media is None:
+            self.logger.debug("[%s] No media is found in the message to mirror.", msg.uid)
+            return []
+        media_type, file_id = media
+        return self.send(msg, "send_" + media_type, file_id, **kwargs)
+
+    @staticmethod
+    def _media_of(tg_msg: telegram.Message) -> Optional[Tuple[str, str]]:
+        """Type and file ID of the media in a message."""
+        for media_type in ('video', 'audio', 'voice', 'document'):
+            attachment = getattr(tg_msg, media_type, None)
+            if attachment:
+                return media_type, attachment.file_id
+        if getattr(tg_msg, 'photo', None):
+            return 'photo', tg_msg.photo[-1].file_id
+        return None
+
+    def _send(self, xid: str, method: str, chat_id: int, *args, **kwargs) -> Optional[telegram.Message]:
+        try:
+            return getattr(self.bot, method)(chat_id, *args, **kwargs)
+        except Exception as e:
+            self.logger.error("[%s] Failed to send message to mirror chat %s. Reason: %r", xid, chat_id, e)
+            return None
+
+    def stop(self):
+        """Stop delivering to mirror chats, without waiting for messages queued."""
+        with self.lock:
+            self.stopped = True
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
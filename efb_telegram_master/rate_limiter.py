@@ -0,0 +1,348 @@
+# coding=utf-8
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import telegram.error
+
+from .retry_policy import RetryEngine
+
+__all__ = ['Priority', 'TokenBucket', 'OutboundScheduler']
+
+
+class Priority:
+    """Priorities of outbound requests, lower ones are sent first."""
+    # Responses to the user, e.g. replies to commands and edits of menus
+    HIGH = 0
+    # Messages relayed from slave channels
+    NORMAL = 10
+    # Chat actions, and other requests that can wait
+    LOW = 20
+
+
+class TokenBucket:
+    """
+    Token bucket of ``rate`` tokens per second, holding at most
+    ``capacity`` tokens. Not thread safe.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # No token is given before this time, set on flood control
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """Time when a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return max(now, self.paused_until)
+        return max(now + (1 - self.tokens) / self.rate, self.paused_until)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'chat_id', 'fn', 'args', 'kwargs', 'future', 'attempts',
+                 'started', 'not_before', 'files', 'ordered')
+
+    def __init__(self, priority: int, seq: int, chat_id: Optional[Union[int, str]],
+                 fn: Callable, args: tuple, kwargs: dict, ordered: bool = True):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        # Sent one at a time with other ordered requests to the chat
+        self.ordered = ordered
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.attempts = 0
+        self.started = time.monotonic()
+        # Not sent before this time, set on retries
+        self.not_before = 0.0
+        # Files to rewind before retries, None if they can't be rewound
+        self.files = RetryEngine.file_positions(args, kwargs)
+
+    def __lt__(self, other: '_Request'):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """
+    Central scheduler of requests to Telegram Bot API, which keeps within
+    the rate limits of Telegram with token buckets, globally, per chat,
+    and per group.
+
+    Requests are sent by priority, and then in the order they are
+    submitted. Requests to the same chat are sent one at a time, except
+    unordered ones, e.g. chat actions, which are sent alongside them.
+    Failed requests are sent again as decided by the retry engine,
+    without blocking requests to other chats.
+
+    Args:
+        retry: Retry engine of failed requests. Only flood control is
+            retried by default.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Limits of requests, as (number of requests, in seconds): to all
+    # chats, to a chat, and to a group or a channel. Up to the number of
+    # requests can be sent at once after a quiet period.
+    GLOBAL_LIMIT = (30, 1)
+    CHAT_LIMIT = (1, 1)
+    GROUP_LIMIT = (20, 60)
+    # Number of requests sent at the same time
+    WORKERS = 8
+    # Seconds of inactivity before the bucket of a chat is dropped
+    BUCKET_EXPIRY = 300
+
+    def __init__(self, retry: Optional[RetryEngine] = None):
+        self.retry = retry or RetryEngine()
+        self.condition = threading.Condition()
+        # Requests to send next: the first request of each chat not being
+        # sent to, and requests not sent to a chat. Entries that are no
+        # longer the first of their chats are dropped when popped.
+        self.queue: List[_Request] = []
+        # Requests to each chat, by priority and then order
+        self.chat_queues: Dict[str, List[_Request]] = dict()
+        # Number of requests waiting to be sent
+        self.pending = 0
+        self.seq = itertools.count()
+        self.global_bucket = self._bucket(self.GLOBAL_LIMIT)
+        self.chat_buckets: Dict[str, Tuple[TokenBucket, Optional[TokenBucket]]] = dict()
+        # Chats with a request being sent
+        self.busy_chats = set()
+        self.executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix="ETM outbound")
+        self.stopped = False
+        self.last_cleanup = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="ETM outbound scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn: Callable, *args, chat_id: Optional[Union[int, str]] = None,
+               priority: int = Priority.NORMAL, ordered: bool = True, **kwargs) -> Future:
+        """
+        Schedule a request to Telegram Bot API.
+
+        Args:
+            fn: Method of the bot to call
+            chat_id: ID of the chat the request is sent to, ``None`` if it
+                is not sent to a chat.
+            priority: Priority of the request, see :class:`Priority`.
+            ordered: If the request waits for other requests to the chat.
+                Unordered requests are sent even when the chat is busy,
+                and are only limited by flood control of the chat.
+
+        Returns:
+            Future of the result of ``fn``.
+        """
+        # Chat IDs are given both as int and str
+        chat_id = str(chat_id) if chat_id is not None else None
+        request = _Request(priority, next(self.seq), chat_id, fn, args, kwargs, ordered)
+        with self.condition:
+            if self.stopped:
+                request.future.set_exception(RuntimeError("Outbound scheduler is stopped."))
+                return request.future
+            self._enqueue(request)
+            self.condition.notify()
+        return request.future
+
+    def _enqueue(self, request: _Request):
+        self.pending += 1
+        if request.chat_id is None or not request.ordered:
+            heapq.heappush(self.queue, request)
+            return
+        chat_queue = self.chat_queues.setdefault(request.chat_id, [])
+        heapq.heappush(chat_queue, request)
+        if chat_queue[0] is request and request.chat_id not in self.busy_chats:
+            heapq.heappush(self.queue, request)
+
+    def _release(self, request: _Request):
+        """Let the next request to a chat be sent, after the current one is done."""
+        if request.chat_id is None or not request.ordered:
+            return
+        self.busy_chats.discard(request.chat_id)
+        chat_queue = self.chat_queues.get(request.chat_id)
+        if chat_queue:
+            heapq.heappush(self.queue, chat_queue[0])
+
+    def _is_next(self, request: _Request) -> bool:
+        """If a request is the first of its chat, and no request is being sent to the chat."""
+        if request.chat_id is None or not request.ordered:
+            return True
+        chat_queue = self.chat_queues.get(request.chat_id)
+        return bool(chat_queue) and chat_queue[0] is request and request.chat_id not in self.busy_chats
+
+    @staticmethod
+    def _bucket(limit: Tuple[int, float]) -> TokenBucket:
+        count, period = limit
+        return TokenBucket(count / period, count)
+
+    def _buckets(self, chat_id: str) -> Tuple[TokenBucket, Optional[TokenBucket]]:
+        if chat_id not in self.chat_buckets:
+            is_group = chat_id.startswith("-")
+            self.chat_buckets[chat_id] = (self._bucket(self.CHAT_LIMIT),
+                                          self._bucket(self.GROUP_LIMIT) if is_group else None)
+        return self.chat_buckets[chat_id]
+
+    def _ready_at(self, request: _Request, now: float) -> float:
+        ready_at = max(self.global_bucket.ready_at(now), request.not_before)
+        if request.chat_id is not None:
+            for bucket in self._buckets(request.chat_id):
+                if bucket and request.ordered:
+                    ready_at = max(ready_at, bucket.ready_at(now))
+                elif bucket:
+                    ready_at = max(ready_at, bucket.paused_until)
+        return ready_at
+
+    def _next_request(self) -> Tuple[Optional[_Request], Optional[float]]:
+        """
+        Pick the first request that can be sent now.
+
+        Returns:
+            The request, or ``None`` and the seconds to wait for the
+            next request to be ready, ``None`` if there is no request.
+        """
+        if not self.pending:
+            return None, None
+        now = time.monotonic()
+        ready_at = self.global_bucket.ready_at(now)
+        if ready_at > now:
+            return None, ready_at - now
+        wait: Optional[float] = None
+        found: Optional[_Request] = None
+        # Requests not ready yet
+        skipped: List[_Request] = []
+        while self.queue:
+            request = heapq.heappop(self.queue)
+            if not self._is_next(request):
+                continue
+            ready_at = self._ready_at(request, now)
+            if ready_at <= now:
+                found = request
+                break
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+            skipped.append(request)
+        for request in skipped:
+            heapq.heappush(self.queue, request)
+        if found is None:
+            return None, wait
+        self.pending -= 1
+        if found.chat_id is not None and found.ordered:
+            chat_queue = self.chat_queues[found.chat_id]
+            heapq.heappop(chat_queue)
+            if not chat_queue:
+                del self.chat_queues[found.chat_id]
+        return found, None
+
+    def run(self):
+        while True:
+            with self.condition:
+                request, wait = self._next_request()
+                while request is None:
+                    if self.stopped and not self.pending and not self.busy_chats:
+                        return
+                    self.condition.wait(wait)
+                    request, wait = self._next_request()
+                if not request.attempts and not request.future.set_running_or_notify_cancel():
+                    # Cancelled before being sent
+                    continue
+                now = time.monotonic()
+                self.global_bucket.take(now)
+                if request.chat_id is not None and request.ordered:
+                    for bucket in self._buckets(request.chat_id):
+                        if bucket:
+                            bucket.take(now)
+                    self.busy_chats.add(request.chat_id)
+                self._cleanup(now)
+            self.executor.submit(self._send, request)
+
+    def _send(self, request: _Request):
+        request.attempts += 1
+        try:
+            if request.attempts > 1:
+                self.retry.rewind(request.files)
+            result = request.fn(*request.args, **request.kwargs)
+        except telegram.error.TelegramError as e:
+            method = getattr(request.fn, '__name__', repr(request.fn))
+            delay = self.retry.next_delay(method, request.attempts, request.started, e,
+                                          request.files is not None)
+            if delay is None:
+                self._done(request)
+                request.future.set_exception(e)
+                return
+            with self.condition:
+                stopped = self.stopped
+                if not stopped:
+                    until = time.monotonic() + delay
+                    if isinstance(e, telegram.error.RetryAfter):
+                        # Flood control applies to all requests to the chat
+                        if request.chat_id is not None:
+                            self._buckets(request.chat_id)[0].pause(until)
+                        else:
+                            self.global_bucket.pause(until)
+                    request.not_before = until
+                    self._enqueue(request)
+                self._release(request)
+                self.condition.notify()
+            if stopped:
+                # Requests queued after stop() would never be resolved.
+                # Resolved out of the lock, as callbacks may take other locks.
+                request.future.set_exception(e)
+        except BaseException as e:
+            self._done(request)
+            request.future.set_exception(e)
+        else:
+            self._done(request)
+            request.future.set_result(result)
+
+    def _done(self, request: _Request):
+        with self.condition:
+            self._release(request)
+            self.condition.notify()
+
+    def _cleanup(self, now: float):
+        """Drop buckets of chats idle for a while, which are full again."""
+        if now - self.last_cleanup < self.BUCKET_EXPIRY:
+            return
+        self.last_cleanup = now
+        for chat_id in [k for k, (bucket, _) in self.chat_buckets.items()
+                        if now - bucket.updated > self.BUCKET_EXPIRY and k not in self.busy_chats]:
+            del self.chat_buckets[chat_id]
+
+    def stop(self, timeout: float = 10):
+        """Send requests already scheduled, and stop the scheduler."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(timeout)
+        with self.condition:
+            requests = [i for i in self.queue if i.chat_id is None or not i.ordered]
+            for chat_queue in self.chat_queues.values():
+                requests.extend(chat_queue)
+            self.queue.clear()
+            self.chat_queues.clear()
+            self.pending = 0
+        # Resolved out of the lock, as callbacks may take other locks.
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Outbound scheduler is stopped."))
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,180 @@
+# coding=utf-8
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from itertools import chain
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import telegram.error
+
+__all__ = ['RetryPolicy', 'RetryEngine']
+
+
+class RetryPolicy:
+    """
+    Retry policy of a method of Telegram Bot API.
+
+    Args:
+        attempts: Maximum number of attempts, including the first one.
+        base_delay: Seconds to wait before the first retry, doubled on
+            each retry after it.
+        max_delay: Maximum seconds to wait before a retry.
+        budget: Maximum seconds from the first attempt to the last
+            retry of transient errors.
+    """
+
+    def __init__(self, attempts: int = 4, base_delay: float = 1, max_delay: float = 15, budget: float = 60):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait after ``attempt`` attempts, with jitter."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryEngine:
+    """
+    Decide if and when a failed request to Telegram Bot API is sent again,
+    and count retries and give-ups of each method.
+
+    Flood control (``RetryAfter``) is always retried after the delay
+    given by Telegram. Transient network errors are only retried when
+    ``retry_on_error`` is enabled, as the request may have reached
+    Telegram already. Files uploaded are read again from where they
+    started on each retry, and requests with files that cannot be
+    read again are never retried.
+
+    Args:
+        retry_on_error: Retry on transient network errors.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    DEFAULT_POLICY = RetryPolicy()
+    POLICIES: Dict[str, RetryPolicy] = {
+        # Chat actions are of no use once late
+        "send_chat_action": RetryPolicy(attempts=1),
+        # Uploads take longer
+        "send_document": RetryPolicy(attempts=3, base_delay=2, budget=120),
+        "send_photo": RetryPolicy(attempts=3, base_delay=2, budget=120),
+        "send_audio": RetryPolicy(attempts=3, base_delay=2, budget=120),
+        "send_voice": RetryPolicy(attempts=3, base_delay=2, budget=120),
+        "send_video": RetryPolicy(attempts=3, base_delay=2, budget=120),
+        # Edits and deletions are only useful soon after the request
+        "edit_message_text": RetryPolicy(attempts=3, budget=30),
+        "edit_message_caption": RetryPolicy(attempts=3, budget=30),
+        "edit_message_media": RetryPolicy(attempts=3, budget=30),
+        "edit_message_reply_markup": RetryPolicy(attempts=3, budget=30),
+        "delete_message": RetryPolicy(attempts=3, budget=30),
+    }
+
+    def __init__(self, retry_on_error: bool = False):
+        self.retry_on_error = retry_on_error
+        self.lock = threading.Lock()
+        self.retries: Counter = Counter()
+        self.give_ups: Counter = Counter()
+
+    def policy(self, method: str) -> RetryPolicy:
+        return self.POLICIES.get(method, self.DEFAULT_POLICY)
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """If an error is caused by the network rather than the request."""
+        return isinstance(error, telegram.error.NetworkError) and \
+            not isinstance(error, telegram.error.BadRequest)
+
+    @staticmethod
+    def file_positions(args: tuple, kwargs: dict) -> Optional[List[Tuple[Any, int]]]:
+        """
+        Files in the parameters of a request, with their current positions
+        to rewind to before a retry.
+
+        Returns:
+            Files and their positions, ``None`` if any of them cannot be
+            rewound.
+        """
+        positions = []
+        for value in chain(args, kwargs.values()):
+            if not hasattr(value, 'read'):
+                continue
+            try:
+                if not value.seekable():
+                    return None
+                positions.append((value, value.tell()))
+            except (AttributeError, OSError, ValueError):
+                return None
+        return positions
+
+    @staticmethod
+    def rewind(positions: List[Tuple[Any, int]]):
+        """Rewind files to positions from :meth:`file_positions`."""
+        for file, position in positions:
+            file.seek(position)
+
+    def next_delay(self, method: str, attempts: int, started: float, error: Exception,
+                   rewindable: bool = True) -> Optional[float]:
+        """
+        Seconds to wait before sending a failed request again.
+
+        Args:
+            method: Name of the method of the bot
+            attempts: Number of attempts made so far
+            started: Time of the first attempt, from ``time.monotonic()``
+            error: Error raised by the last attempt
+            rewindable: If files uploaded by the request can be read again
+
+        Returns:
+            Seconds to wait, or ``None`` if the request is not sent again.
+        """
+        policy = self.policy(method)
+        if isinstance(error, telegram.error.RetryAfter):
+            delay = error.retry_after
+            exhausted = attempts >= max(policy.attempts, 2)
+        elif self.retry_on_error and self.is_transient(error):
+            delay = policy.backoff(attempts)
+            exhausted = attempts >= policy.attempts or \
+                time.monotonic() + delay - started > policy.budget
+        else:
+            return None
+        if not rewindable:
+            # Files already read would be uploaded empty
+            exhausted = True
+        with self.lock:
+            if exhausted:
+                self.give_ups[method] += 1
+            else:
+                self.retries[method] += 1
+        if exhausted:
+            self.logger.warning("Gave up calling %s after %s attempts: %r", method, attempts, error)
+            return None
+        self.logger.info("Failed to call %s (attempt %s): %r, retrying in %.1f seconds.",
+                         method, attempts, error, delay)
+        return delay
+
+    def call(self, method: str, fn: Callable, *args, **kwargs):
+        """Call a function, and retry in the current thread on failure."""
+        attempts = 0
+        started = time.monotonic()
+        positions = self.file_positions(args, kwargs)
+        while True:
+            attempts += 1
+            try:
+                return fn(*args, **kwargs)
+            except telegram.error.TelegramError as e:
+                delay = self.next_delay(method, attempts, started, e, positions is not None)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                self.rewind(positions)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Numbers of retries and give-ups of each method."""
+        with self.lock:
+            return {method: {"retries": self.retries[method], "give_ups": self.give_ups[method]}
+                    for method in set(self.retries) | set(self.give_ups)}
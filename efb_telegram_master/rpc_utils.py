@@ -1,5 +1,5 @@
 import threading
-from typing import TYPE_CHECKING, KeysView, Optional, Iterable
+from typing import TYPE_CHECKING, Dict, KeysView, Optional, Iterable
 from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
 
 from ehforwarderbot import coordinator, EFBChannel, EFBChat
@@ -36,6 +36,8 @@ class RPCUtilities:
         self.server.register_function(self.get_slave_channels_id)
         self.server.register_function(self.get_slave_channel_by_id)
         self.server.register_function(self.get_chats_from_channel_by_id)
+        self.server.register_function(self.channel.chat_binding.apply_link_changes)
+        self.server.register_function(self.get_retry_stats)
 
         threading.Thread(target=self.server.serve_forever)
 
@@ -44,6 +46,10 @@ class RPCUtilities:
         if self.server:
             self.server.shutdown()
 
+    def get_retry_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the numbers of retries and give-ups of requests to Telegram Bot API, by method."""
+        return self.channel.bot_manager.retry.stats()
+
     @staticmethod
     def get_slave_channels_id() -> KeysView[str]:
         """Get the collection of slave channel IDs in current instance"""
@@ -28,12 +28,13 @@ from . import utils, ETMChat
 from .commands import ETMCommandMsgStorage
 from .constants import Emoji
 from .locale_mixin import LocaleMixin
+from .mirror import MirrorManager
 from pypinyin import lazy_pinyin
 
 if TYPE_CHECKING:
     from . import TelegramChannel
     from .bot_manager import TelegramBotManager
-    from .db import DatabaseManager
+    from .db import BaseDatabaseManager
 
 
 class SlaveMessageProcessor(LocaleMixin):
@@ -44,7 +45,8 @@ class SlaveMessageProcessor(LocaleMixin):
         self.bot: 'TelegramBotManager' = self.channel.bot_manager
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.flag: utils.ExperimentalFlagsManager = self.channel.flag
-        self.db: 'DatabaseManager' = channel.db
+        self.db: 'BaseDatabaseManager' = channel.db
+        self.mirrors: MirrorManager = MirrorManager(channel)
 
     def send_message(self, msg: EFBMsg) -> EFBMsg:
         """
@@ -167,8 +169,8 @@ class SlaveMessageProcessor(LocaleMixin):
                                                         reply_markup)
             else:
                 self.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
-                self.bot.send_message(self.channel.config['admins'][1], prefix=msg_template,
-                                               text=self._("Unsupported type of message. (UT01)"))
+                self.mirrors.send(msg, "send_message", prefix=msg_template,
+                                  text=self._("Unsupported type of message. (UT01)"))
                 tg_msg = self.bot.send_message(tg_dest, prefix=msg_template,
                                                text=self._("Unsupported type of message. (UT01)"))
 
@@ -223,6 +225,14 @@ class SlaveMessageProcessor(LocaleMixin):
             self.logger.error("[%s] Error occurred while processing message from slave channel.\nMessage: %s\n%s\n%s",
                               xid, repr(msg), repr(e), traceback.format_exc())
 
+    @staticmethod
+    def _file_size(msg: EFBMsg) -> Optional[int]:
+        """Size of the file of a message in bytes, ``None`` if unknown."""
+        try:
+            return os.path.getsize(msg.path) if msg.path else None
+        except OSError:
+            return None
+
     def slave_message_text(self, msg: EFBMsg, tg_dest: str, msg_template: str,
                            old_msg_id: Optional[Tuple[str, str]] = None,
                            target_msg_id: Optional[str] = None,
@@ -317,16 +327,15 @@ class SlaveMessageProcessor(LocaleMixin):
             text = html.escape(text)
 
         if not old_msg_id:
+            self.mirrors.send(msg, "send_message",
+                              text=text, prefix=msg_template,
+                              parse_mode='HTML',
+                              reply_markup=reply_markup)
             tg_msg = self.bot.send_message(tg_dest,
                                            text=text, prefix=msg_template,
                                            parse_mode='HTML',
                                            reply_to_message_id=target_msg_id,
                                            reply_markup=reply_markup)
-            self.bot.send_message(self.channel.config['admins'][1],
-                                           text=text, prefix=msg_template,
-                                           parse_mode='HTML',
-                                           reply_to_message_id=target_msg_id,
-                                           reply_markup=reply_markup)
         else:
             # Cannot change reply_to_message_id when editing a message
             tg_msg = self.bot.edit_message_text(chat_id=old_msg_id[0],
@@ -362,12 +371,11 @@ class SlaveMessageProcessor(LocaleMixin):
                                               prefix=msg_template, parse_mode='HTML',
                                               reply_markup=reply_markup)
         else:
-            self.bot.send_message(chat_id=self.channel.config['admins'][1],
-                                         text=text,
-                                         prefix=msg_template,
-                                         parse_mode="HTML",
-                                         reply_to_message_id=target_msg_id,
-                                         reply_markup=reply_markup)
+            self.mirrors.send(msg, "send_message",
+                              text=text,
+                              prefix=msg_template,
+                              parse_mode="HTML",
+                              reply_markup=reply_markup)
             return self.bot.send_message(chat_id=tg_dest,
                                          text=text,
                                          prefix=msg_template,
@@ -379,7 +387,7 @@ class SlaveMessageProcessor(LocaleMixin):
                             old_msg_id: Optional[Tuple[str, str]] = None,
                             target_msg_id: Optional[str] = None,
                             reply_markup: Optional[telegram.ReplyMarkup] = None) -> telegram.Message:
-        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_PHOTO)
+        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_PHOTO, size=self._file_size(msg))
         self.logger.debug("[%s] Message is of %s type.\nPath: %s\nMIME: %s", msg.uid, msg.type, msg.path, msg.mime)
         if msg.path:
             self.logger.debug("[%s] Size of %s is %s.", msg.uid, msg.path, os.stat(msg.path).st_size)
@@ -396,30 +404,23 @@ class SlaveMessageProcessor(LocaleMixin):
                 return self.bot.edit_message_caption(chat_id=old_msg_id[0], message_id=old_msg_id[1],
                                                      prefix=msg_template, caption=msg.text)
             elif msg.mime == "image/gif":
-                self.bot.send_document(self.channel.config['admins'][1], msg.file, prefix=msg_template, caption=msg.text,
-                                              reply_to_message_id=target_msg_id,
-                                              reply_markup=reply_markup)
-                return self.bot.send_document(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
-                                              reply_to_message_id=target_msg_id,
-                                              reply_markup=reply_markup)
+                tg_msg = self.bot.send_document(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
+                                                reply_to_message_id=target_msg_id,
+                                                reply_markup=reply_markup)
             else:
                 try:
-                    self.bot.send_photo(self.channel.config['admins'][1], msg.file, prefix=msg_template, caption=msg.text,
-                                               reply_to_message_id=target_msg_id,
-                                               reply_markup=reply_markup)
-                    return self.bot.send_photo(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
-                                               reply_to_message_id=target_msg_id,
-                                               reply_markup=reply_markup)
+                    tg_msg = self.bot.send_photo(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
+                                                 reply_to_message_id=target_msg_id,
+                                                 reply_markup=reply_markup)
                 except telegram.error.BadRequest as e:
                     self.logger.error('[%s] Failed to send it as image, sending as document. Reason: %s', msg.uid, e)
-                    self.bot.send_document(self.channel.config['admins'][1], msg.file, prefix=msg_template,
-                                                  caption=msg.text, filename=msg.filename,
-                                                  reply_to_message_id=target_msg_id,
-                                                  reply_markup=reply_markup)
-                    return self.bot.send_document(tg_dest, msg.file, prefix=msg_template,
-                                                  caption=msg.text, filename=msg.filename,
-                                                  reply_to_message_id=target_msg_id,
-                                                  reply_markup=reply_markup)
+                    tg_msg = self.bot.send_document(tg_dest, msg.file, prefix=msg_template,
+                                                    caption=msg.text, filename=msg.filename,
+                                                    reply_to_message_id=target_msg_id,
+                                                    reply_markup=reply_markup)
+            self.mirrors.send_media(msg, tg_msg, prefix=msg_template, caption=msg.text,
+                                    reply_markup=reply_markup)
+            return tg_msg
         finally:
             if msg.file:
                 msg.file.close()
@@ -428,7 +429,7 @@ class SlaveMessageProcessor(LocaleMixin):
                            old_msg_id: Optional[Tuple[str, str]] = None,
                            target_msg_id: Optional[str] = None,
                            reply_markup: Optional[telegram.ReplyMarkup] = None) -> telegram.Message:
-        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_DOCUMENT)
+        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_DOCUMENT, size=self._file_size(msg))
         if not msg.filename:
             file_name = os.path.basename(msg.path)
             msg.text = "sent a file."
@@ -447,16 +448,14 @@ class SlaveMessageProcessor(LocaleMixin):
                                                      prefix=msg_template, caption=msg.text)
             self.logger.debug("[%s] Uploading file %s (%s) as %s", msg.uid,
                               msg.file.name, msg.mime, file_name)
-            self.bot.send_document(self.channel.config['admins'][1], msg.file,
-                                          prefix=msg_template,
-                                          caption=msg.text, filename=file_name,
-                                          reply_to_message_id=target_msg_id,
-                                          reply_markup=reply_markup)
-            return self.bot.send_document(tg_dest, msg.file,
-                                          prefix=msg_template,
-                                          caption=msg.text, filename=file_name,
-                                          reply_to_message_id=target_msg_id,
-                                          reply_markup=reply_markup)
+            tg_msg = self.bot.send_document(tg_dest, msg.file,
+                                            prefix=msg_template,
+                                            caption=msg.text, filename=file_name,
+                                            reply_to_message_id=target_msg_id,
+                                            reply_markup=reply_markup)
+            self.mirrors.send_media(msg, tg_msg, prefix=msg_template, caption=msg.text,
+                                    reply_markup=reply_markup)
+            return tg_msg
         finally:
             msg.file.close()
 
@@ -464,7 +463,7 @@ class SlaveMessageProcessor(LocaleMixin):
                             old_msg_id: Optional[Tuple[str, str]] = None,
                             target_msg_id: Optional[str] = None,
                             reply_markup: Optional[telegram.ReplyMarkup] = None) -> telegram.Message:
-        self.bot.send_chat_action(tg_dest, telegram.ChatAction.RECORD_AUDIO)
+        self.bot.send_chat_action(tg_dest, telegram.ChatAction.RECORD_AUDIO, size=self._file_size(msg))
         msg.text = msg.text or ''
         self.logger.debug("[%s] Message is an audio file.", msg.uid)
         no_conversion = self.flag("no_conversion")
@@ -480,21 +479,17 @@ class SlaveMessageProcessor(LocaleMixin):
                 if msg.mime == "audio/mpeg":
                     tg_msg = self.bot.send_audio(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
                                                  reply_to_message_id=target_msg_id, reply_markup=reply_markup)
-                    self.bot.send_audio(self.channel.config['admins'][1], msg.file, prefix=msg_template, caption=msg.text,
-                                                 reply_to_message_id=target_msg_id, reply_markup=reply_markup)
                 else:
                     tg_msg = self.bot.send_document(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
                                                     reply_to_message_id=target_msg_id, reply_markup=reply_markup)
-                    self.bot.send_document(self.channel.config['admins'][1], msg.file, prefix=msg_template, caption=msg.text,
-                                                    reply_to_message_id=target_msg_id, reply_markup=reply_markup)
             else:
                 with tempfile.NamedTemporaryFile() as f:
                     pydub.AudioSegment.from_file(msg.file).export(f, format="ogg", codec="libopus",
                                                                   parameters=['-vbr', 'on'])
                     tg_msg = self.bot.send_voice(tg_dest, f, prefix=msg_template, caption=msg.text,
                                                  reply_to_message_id=target_msg_id, reply_markup=reply_markup)
-                    self.bot.send_voice(self.channel.config['admins'][1], f, prefix=msg_template, caption=msg.text,
-                                                 reply_to_message_id=target_msg_id, reply_markup=reply_markup)
+            self.mirrors.send_media(msg, tg_msg, prefix=msg_template, caption=msg.text,
+                                    reply_markup=reply_markup)
             return tg_msg
         finally:
             msg.file.close()
@@ -513,10 +508,9 @@ class SlaveMessageProcessor(LocaleMixin):
             # TRANSLATORS: Flag for edited message, but cannot be edited on Telegram.
             msg_template += self._('[edited]')
             target_msg_id = target_msg_id or old_msg_id[1]
-        self.bot.send_venue(self.channel.config['admins'][1], latitude=attributes.latitude,
-                                   longitude=attributes.longitude, title=msg.text or self._("Sent a location."),
-                                   address=msg_template, reply_to_message_id=target_msg_id,
-                                   reply_markup=reply_markup)
+        self.mirrors.send(msg, "send_venue", latitude=attributes.latitude,
+                          longitude=attributes.longitude, title=msg.text or self._("Sent a location."),
+                          address=msg_template, reply_markup=reply_markup)
         return self.bot.send_venue(tg_dest, latitude=attributes.latitude,
                                    longitude=attributes.longitude, title=msg.text or self._("Sent a location."),
                                    address=msg_template, reply_to_message_id=target_msg_id,
@@ -526,7 +520,7 @@ class SlaveMessageProcessor(LocaleMixin):
                             old_msg_id: Optional[Tuple[str, str]] = None,
                             target_msg_id: Optional[str] = None,
                             reply_markup: Optional[telegram.ReplyMarkup] = None) -> telegram.Message:
-        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_VIDEO)
+        self.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_VIDEO, size=self._file_size(msg))
         if not msg.text:
             msg.text = "sent a video."
         try:
@@ -535,12 +529,12 @@ class SlaveMessageProcessor(LocaleMixin):
                     self.bot.edit_message_media(chat_id=old_msg_id[0], message_id=old_msg_id[1], media=msg.file)
                 return self.bot.edit_message_caption(chat_id=old_msg_id[0], message_id=old_msg_id[1],
                                                      prefix=msg_template, caption=msg.text)
-            self.bot.send_video(self.channel.config['admins'][1], msg.file, prefix=msg_template, caption=msg.text,
-                                       reply_to_message_id=target_msg_id,
-                                       reply_markup=reply_markup)
-            return self.bot.send_video(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
-                                       reply_to_message_id=target_msg_id,
-                                       reply_markup=reply_markup)
+            tg_msg = self.bot.send_video(tg_dest, msg.file, prefix=msg_template, caption=msg.text,
+                                         reply_to_message_id=target_msg_id,
+                                         reply_markup=reply_markup)
+            self.mirrors.send_media(msg, tg_msg, prefix=msg_template, caption=msg.text,
+                                    reply_markup=reply_markup)
+            return tg_msg
         finally:
             msg.file.close()
 
@@ -552,9 +546,9 @@ class SlaveMessageProcessor(LocaleMixin):
         self.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
 
         if not old_msg_id:
-            self.bot.send_message(self.channel.config['admins'][1],
-                                           text=msg.text, prefix=msg_template + " " + self._("(unsupported)"),
-                                           reply_to_message_id=target_msg_id, reply_markup=reply_markup)
+            self.mirrors.send(msg, "send_message",
+                              text=msg.text, prefix=msg_template + " " + self._("(unsupported)"),
+                              reply_markup=reply_markup)
             tg_msg = self.bot.send_message(tg_dest,
                                            text=msg.text, prefix=msg_template + " " + self._("(unsupported)"),
                                            reply_to_message_id=target_msg_id, reply_markup=reply_markup)
@@ -573,15 +567,8 @@ class SlaveMessageProcessor(LocaleMixin):
             self.logger.debug("Received chat updates from channel %s", status.channel)
             for i in status.removed_chats:
                 self.db.delete_slave_chat_info(status.channel.channel_id, i)
-            for i in status.new_chats + status.modified_chats:
-                chat = status.channel.get_chat(i)
-                self.db.set_slave_chat_info(slave_channel_name=status.channel.channel_name,
-                                            slave_channel_emoji=status.channel.channel_emoji,
-                                            slave_channel_id=status.channel.channel_id,
-                                            slave_chat_name=chat.chat_name,
-                                            slave_chat_alias=chat.chat_alias,
-                                            slave_chat_type=chat.chat_type,
-                                            slave_chat_uid=chat.chat_uid)
+            self.db.set_slave_chats_info(status.channel.get_chat(i)
+                                         for i in status.new_chats + status.modified_chats)
         elif isinstance(status, EFBMemberUpdates):
             self.logger.debug("Received member updates from channel %s about group %s",
                               status.channel, status.chat_id)
@@ -604,9 +591,9 @@ class SlaveMessageProcessor(LocaleMixin):
                         return
                 except telegram.TelegramError:
                     pass
-                self.bot.send_message(chat_id=old_msg_id[0],
-                                      text=self._("Message removed in remote chat."),
-                                      reply_to_message_id=old_msg_id[1])
+                self.bot.send_message_async(chat_id=old_msg_id[0],
+                                            text=self._("Message removed in remote chat."),
+                                            reply_to_message_id=old_msg_id[1])
             else:
                 self.logger.info('Was supposed to delete a message, '
                                  'but it does not exist in database: %s', status)
@@ -0,0 +1,95 @@
+# coding=utf-8
+
+import gzip
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+from ehforwarderbot import utils as efb_utils
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+
+__all__ = ['SnapshotManager']
+
+
+class SnapshotManager:
+    """
+    Warm start snapshot of in-memory state: chat lists of slave
+    channels, recent slave chats of each Telegram chat, and keys of
+    cached message logs.
+
+    The snapshot is saved on graceful stop, and restored on the next
+    start, so that the first requests after a restart are as fast as
+    they are afterwards. A snapshot is only used once, and is removed
+    when it is loaded, so that state saved before a crash is never
+    restored.
+    """
+
+    # Format version of the snapshot file, increased on incompatible changes.
+    VERSION = 1
+
+    logger: logging.Logger = logging.getLogger(__name__)
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel: 'TelegramChannel' = channel
+        self.path = efb_utils.get_data_path(channel.channel_id) / 'snapshot.json.gz'
+
+    def save(self) -> bool:
+        """
+        Save the snapshot.
+
+        Returns:
+            bool: If the snapshot is saved.
+        """
+        data = {
+            "version": self.VERSION,
+            "time": time.time(),
+            "slave_chats": self.channel.chat_binding.export_slave_chats(),
+            "db": self.channel.db.export_cache_state(),
+        }
+        temp_path = str(self.path) + ".part"
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, str(self.path))
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.warning("Failed to save warm start snapshot: %s", e)
+            return False
+        self.logger.debug("Warm start snapshot is saved to %s.", self.path)
+        return True
+
+    def load(self) -> bool:
+        """
+        Restore state from the snapshot if there is one, and remove it.
+
+        Returns:
+            bool: If the snapshot is restored.
+        """
+        if not self.path.exists():
+            return False
+        try:
+            with gzip.open(str(self.path), 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Failed to read warm start snapshot: %s", e)
+            return False
+        finally:
+            self.path.unlink()
+
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            self.logger.info("Warm start snapshot of an incompatible version is ignored.")
+            return False
+
+        try:
+            self.channel.chat_binding.import_slave_chats(data.get("slave_chats", {}))
+            self.channel.db.import_cache_state(data.get("db", {}))
+        except Exception as e:
+            # Fields of a truncated or edited snapshot may be missing or of wrong types
+            self.logger.warning("Warm start snapshot is malformed, and is discarded: %r", e)
+            self.channel.chat_binding.discard_restored_slave_chats()
+            return False
+        self.logger.info("Warm start snapshot saved at %s is restored.", time.ctime(data.get("time", 0)))
+        return True
@@ -0,0 +1,129 @@
+# coding=utf-8
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from telegram import Update
+from telegram.ext import DispatcherHandlerStop
+from telegram.ext.handler import Handler
+
+if TYPE_CHECKING:
+    from . import TelegramChannel
+
+
+class UpdateTracker:
+    """
+    Track updates processed, to drop updates delivered again by Telegram,
+    and save the offset of the next update to the database in batches,
+    so that updates processed before a restart are still recognised
+    after it.
+
+    Updates with an ID just below the offset saved are dropped, as are
+    those among recently processed ones.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Number of recently processed update IDs kept for deduplication
+    RECENT_UPDATES_SIZE = 1000
+    # Maximum seconds between two checkpoints while updates are processed
+    CHECKPOINT_INTERVAL = 5
+
+    def __init__(self, channel: 'TelegramChannel'):
+        self.channel = channel
+        self.db = channel.db
+        self.checkpoint_batch: int = channel.flag('update_checkpoint_batch')
+        self.lock = threading.Lock()
+        self.recent: 'OrderedDict[int, None]' = OrderedDict()
+        # Offset of the next update, as saved in the database
+        self.offset: int = self.db.get_update_offset()
+        # Offset to be saved
+        self.next_offset: int = self.offset
+        self.pending = 0
+        self.last_checkpoint = time.time()
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Check if an update is processed before, and record it if not."""
+        with self.lock:
+            if update_id < self.offset - self.RECENT_UPDATES_SIZE:
+                # Telegram restarts update IDs from a random number after
+                # a week without updates.
+                self.logger.info("Update IDs are restarted from %s.", update_id)
+                self.offset = self.next_offset = update_id
+                self.recent.clear()
+            if update_id < self.offset or update_id in self.recent:
+                return True
+            self.recent[update_id] = None
+            while len(self.recent) > self.RECENT_UPDATES_SIZE:
+                self.recent.popitem(last=False)
+            return False
+
+    def processed(self, update_id: int):
+        """Record an update as processed, and save the offset when a batch is complete."""
+        with self.lock:
+            self.next_offset = max(self.next_offset, update_id + 1)
+            self.pending += 1
+            if self.pending < self.checkpoint_batch and \
+                    time.time() - self.last_checkpoint < self.CHECKPOINT_INTERVAL:
+                return
+        self.checkpoint()
+
+    def checkpoint(self):
+        """Save the offset of the next update to the database."""
+        with self.lock:
+            if self.next_offset <= self.offset:
+                return
+            offset = self.next_offset
+            self.pending = 0
+            self.last_checkpoint = time.time()
+        try:
+            self.db.set_update_offset(offset)
+        except Exception as e:
+            self.logger.warning("Failed to save offset of Telegram updates: %s", e)
+            return
+        with self.lock:
+            self.offset = max(self.offset, offset)
+
+
+class UpdateDedupHandler(Handler):
+    """
+    Handler class that stops processing of updates delivered again,
+    registered in a group before all other handlers.
+
+    Args:
+        tracker (UpdateTracker): Tracker of updates processed.
+    """
+
+    def __init__(self, tracker: UpdateTracker):
+        self.tracker = tracker
+
+    def check_update(self, update):
+        return isinstance(update, Update) and self.tracker.is_duplicate(update.update_id)
+
+    def handle_update(self, update, dispatcher):
+        self.tracker.logger.debug("Update %s is dropped as it is processed before.", update.update_id)
+        raise DispatcherHandlerStop()
+
+
+class UpdateCheckpointHandler(Handler):
+    """
+    Handler class that records updates as processed, registered in a
+    group after all other handlers. It never handles any update.
+
+    Args:
+        tracker (UpdateTracker): Tracker of updates processed.
+    """
+
+    def __init__(self, tracker: UpdateTracker):
+        self.tracker = tracker
+
+    def check_update(self, update):
+        if isinstance(update, Update):
+            self.tracker.processed(update.update_id)
+        return False
+
+    def handle_update(self, update, dispatcher):
+        pass
@@ -23,6 +23,24 @@ class ExperimentalFlagsManager(LocaleMixin):
         "auto_locale": True,
         "retry_on_error": False,
         "send_image_as_file": False,
+        "msg_log_batch_interval": 0,
+        "msg_log_batch_size": 100,
+        "sqlite_pragmas": {},
+        "msg_log_retention_days": 0,
+        "msg_log_retention_rows": 0,
+        "msg_log_archive_interval": 3600,
+        "msg_log_cache_size": 1000,
+        "msg_log_compress_threshold": 0,
+        "msg_log_search": False,
+        "db_backup_interval": 0,
+        "db_backup_keep": 7,
+        "db_maintenance_interval": 86400,
+        "db_maintenance_idle": 300,
+        "db_slow_query_threshold": 100,
+        "warm_start": True,
+        "update_checkpoint_batch": 20,
+        "clean_pending_updates": False,
+        "send_rate_limit": True,
     }
 
     def __init__(self, channel: 'TelegramChannel'):
@@ -88,9 +88,9 @@ class VoiceRecognitionManager(LocaleMixin):
             for j in results[i]:
                 msg += "%s\n" % html.escape(j)
         msg = self._("Results:\n{0}").format(msg)
-        self.bot.send_message(update.message.reply_to_message.chat.id, msg,
-                              reply_to_message_id=update.message.reply_to_message.message_id,
-                              parse_mode=telegram.ParseMode.HTML)
+        self.bot.send_message_async(update.message.reply_to_message.chat.id, msg,
+                                    reply_to_message_id=update.message.reply_to_message.message_id,
+                                    parse_mode=telegram.ParseMode.HTML)
 
         file.close()
 
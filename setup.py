@@ -49,7 +49,6 @@ setup(
         "PyYaml",
         "pillow",
         "language-tags",
-        "retrying",
         "pypinyin",
     ],
     entry_points={
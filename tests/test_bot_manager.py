@@ -1,9 +1,15 @@
 import string
 import random
+import io
+import threading
+import time
 from unittest.mock import patch, Mock
 
 import telegram
 
+from efb_telegram_master.chat_action import ChatActionManager
+from efb_telegram_master.rate_limiter import OutboundScheduler, Priority
+from efb_telegram_master.retry_policy import RetryEngine, RetryPolicy
 from .base_test import StandardChannelTest
 
 
@@ -28,3 +34,248 @@ class BotManagerTest(StandardChannelTest):
         self.assertTrue(len(mock_send_message.call_args[1]['text']) <=
                         telegram.constants.MAX_MESSAGE_LENGTH)
         mock_send_document.assert_called()
+
+    @patch.object(OutboundScheduler, 'CHAT_LIMIT', (100, 1))
+    @patch('telegram.Bot.send_message')
+    def test_send_message_async(self, mock_send_message: Mock):
+        bot_manager = self.master.bot_manager
+        with self.subTest("Return before the message is sent"):
+            release = threading.Event()
+            mock_send_message.side_effect = lambda *args, **kwargs: release.wait(5) and "sent"
+            future = bot_manager.send_message_async('0', 'Message')
+            self.assertFalse(future.done())
+            release.set()
+            self.assertEqual(future.result(5), "sent")
+
+        with self.subTest("Send again without parse mode"):
+            mock_send_message.reset_mock()
+            mock_send_message.side_effect = [telegram.error.BadRequest("can't parse entities: bad tag"), "sent"]
+            self.assertEqual(bot_manager.send_message('0', 'Message', parse_mode="HTML"), "sent")
+            self.assertEqual(mock_send_message.call_count, 2)
+            self.assertNotIn('parse_mode', mock_send_message.call_args[1])
+
+    @patch.object(OutboundScheduler, 'CHAT_LIMIT', (100, 1))
+    def test_outbound_scheduler(self):
+        scheduler = OutboundScheduler()
+        sent = []
+        try:
+            with self.subTest("Keep order of requests to a chat"):
+                futures = [scheduler.submit(sent.append, i, chat_id=1, priority=Priority.LOW) for i in range(5)]
+                for i in futures:
+                    i.result(5)
+                self.assertEqual(sent, list(range(5)))
+
+            with self.subTest("Retry on flood control"):
+                fn = Mock(side_effect=[telegram.error.RetryAfter(0.1), "sent"])
+                self.assertEqual(scheduler.submit(fn, chat_id=-1).result(5), "sent")
+                self.assertEqual(fn.call_count, 2)
+
+            with self.subTest("Raise errors to the caller"):
+                fn = Mock(side_effect=telegram.error.BadRequest("Chat not found"))
+                with self.assertRaises(telegram.error.BadRequest):
+                    scheduler.submit(fn, chat_id=2).result(5)
+
+            with self.subTest("Send bursts to groups up to the limit"):
+                fn = Mock()
+                futures = [scheduler.submit(fn, chat_id=-100 if i % 2 else "-100") for i in range(20)]
+                for i in futures:
+                    i.result(5)
+                self.assertEqual(fn.call_count, 20)
+                # Int and str IDs of the chat share the same buckets
+                self.assertEqual(list(scheduler.chat_buckets), ["1", "-1", "2", "-100"])
+                self.assertLess(scheduler.chat_buckets["-100"][1].tokens, 1)
+
+            with self.subTest("Fail retries after stop"):
+                started = threading.Event()
+                release = threading.Event()
+
+                def flood_controlled():
+                    started.set()
+                    release.wait(5)
+                    raise telegram.error.RetryAfter(0.01)
+
+                future = scheduler.submit(flood_controlled, chat_id=3)
+                started.wait(5)
+                with scheduler.condition:
+                    scheduler.stopped = True
+                release.set()
+                with self.assertRaises(telegram.error.RetryAfter):
+                    future.result(5)
+        finally:
+            scheduler.stop()
+
+    def test_outbound_scheduler_stop(self):
+        scheduler = OutboundScheduler()
+        scheduler.global_bucket.pause(time.monotonic() + 60)
+        future = scheduler.submit(Mock(), chat_id=1)
+        locked = []
+
+        def take_lock():
+            if scheduler.condition.acquire(timeout=1):
+                scheduler.condition.release()
+                locked.append(False)
+            else:
+                locked.append(True)
+
+        def callback(_):
+            # Lock of the scheduler can be taken by other threads in callbacks
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            thread.join()
+
+        future.add_done_callback(callback)
+        scheduler.stop()
+        with self.assertRaises(RuntimeError):
+            future.result(0)
+        self.assertEqual(locked, [False])
+
+    @patch.object(OutboundScheduler, 'CHAT_LIMIT', (100, 1))
+    @patch.object(RetryEngine, 'DEFAULT_POLICY', RetryPolicy(attempts=3, base_delay=0.01, budget=5))
+    def test_retry_engine(self):
+        retry = RetryEngine(retry_on_error=True)
+        scheduler = OutboundScheduler(retry)
+        try:
+            with self.subTest("Retry on network errors"):
+                fn = Mock(side_effect=[telegram.error.TimedOut(), telegram.error.NetworkError("Reset"), "sent"])
+                fn.__name__ = "send_message"
+                self.assertEqual(scheduler.submit(fn, chat_id=1).result(5), "sent")
+                self.assertEqual(retry.stats()["send_message"], {"retries": 2, "give_ups": 0})
+
+            with self.subTest("Give up after attempts"):
+                fn = Mock(side_effect=telegram.error.TimedOut())
+                fn.__name__ = "send_sticker"
+                with self.assertRaises(telegram.error.TimedOut):
+                    scheduler.submit(fn, chat_id=1).result(5)
+                self.assertEqual(fn.call_count, 3)
+                self.assertEqual(retry.stats()["send_sticker"], {"retries": 2, "give_ups": 1})
+
+            with self.subTest("Never retry bad requests"):
+                fn = Mock(side_effect=telegram.error.BadRequest("Message is too long"))
+                fn.__name__ = "send_location"
+                with self.assertRaises(telegram.error.BadRequest):
+                    scheduler.submit(fn, chat_id=1).result(5)
+                self.assertEqual(fn.call_count, 1)
+
+            with self.subTest("Upload files again from the start on retries"):
+                for error in (telegram.error.RetryAfter(0.01), telegram.error.TimedOut()):
+                    uploads = []
+
+                    def send_document(chat_id, document, **kwargs):
+                        uploads.append(telegram.InputFile(document).input_file_content)
+                        if len(uploads) == 1:
+                            raise error
+                        return "sent"
+
+                    document = io.BytesIO(b"content")
+                    document.name = "file.txt"
+                    self.assertEqual(scheduler.submit(send_document, 1, document, chat_id=1).result(5), "sent")
+                    self.assertEqual(uploads, [b"content", b"content"])
+                    uploads.clear()
+                    document.seek(0)
+                    self.assertEqual(retry.call("send_document", send_document, 1, document=document), "sent")
+                    self.assertEqual(uploads, [b"content", b"content"])
+
+            with self.subTest("Never retry files that can't be read again"):
+                document = Mock(spec=io.RawIOBase)
+                document.seekable.return_value = False
+                fn = Mock(side_effect=[telegram.error.RetryAfter(0.01), "sent"])
+                fn.__name__ = "send_document"
+                with self.assertRaises(telegram.error.RetryAfter):
+                    scheduler.submit(fn, 1, document, chat_id=1).result(5)
+                self.assertEqual(fn.call_count, 1)
+        finally:
+            scheduler.stop()
+
+        with self.subTest("Only retry flood control by default"):
+            fn = Mock(side_effect=[telegram.error.TimedOut(), "sent"])
+            with self.assertRaises(telegram.error.TimedOut):
+                RetryEngine().call("send_message", fn)
+            fn = Mock(side_effect=[telegram.error.RetryAfter(0.01), "sent"])
+            self.assertEqual(RetryEngine().call("send_message", fn), "sent")
+
+    @patch.object(ChatActionManager, 'DELAY', 0.2)
+    @patch.object(ChatActionManager, 'REFRESH_INTERVAL', 0.2)
+    @patch.object(OutboundScheduler, 'CHAT_LIMIT', (100, 1))
+    @patch('telegram.Bot.send_message')
+    @patch('telegram.Bot.send_chat_action')
+    def test_chat_action(self, mock_send_chat_action: Mock, mock_send_message: Mock):
+        bot_manager = self.master.bot_manager
+        with patch.object(bot_manager, 'chat_actions', ChatActionManager(bot_manager)):
+            try:
+                with self.subTest("Skip action of quick requests"):
+                    bot_manager.send_chat_action('0', telegram.ChatAction.TYPING)
+                    bot_manager.send_message('0', 'Message')
+                    time.sleep(0.3)
+                    mock_send_chat_action.assert_not_called()
+
+                with self.subTest("Skip action of small uploads"):
+                    bot_manager.send_chat_action('0', telegram.ChatAction.UPLOAD_PHOTO, size=1024)
+                    time.sleep(0.3)
+                    mock_send_chat_action.assert_not_called()
+
+                with self.subTest("Refresh action of slow uploads"):
+                    bot_manager.send_chat_action('0', telegram.ChatAction.UPLOAD_VIDEO)
+                    bot_manager.send_chat_action('0', telegram.ChatAction.UPLOAD_VIDEO)
+                    with patch('telegram.Bot.send_video', side_effect=lambda *args, **kwargs: time.sleep(0.7)):
+                        bot_manager.submit("send_video", '0', 'video').result(5)
+                    mock_send_chat_action.assert_called_with('0', telegram.ChatAction.UPLOAD_VIDEO)
+                    self.assertGreaterEqual(mock_send_chat_action.call_count, 2)
+                    self.assertNotIn('0', bot_manager.chat_actions.pending)
+
+                with self.subTest("Cancel action queued when cleared"):
+                    mock_send_chat_action.reset_mock()
+                    bot_manager.scheduler.global_bucket.pause(time.monotonic() + 0.5)
+                    bot_manager.send_chat_action('2', telegram.ChatAction.UPLOAD_VIDEO)
+                    time.sleep(0.3)
+                    future = bot_manager.chat_actions.pending['2'].future
+                    self.assertIsNotNone(future)
+                    bot_manager.chat_actions.clear('2')
+                    self.assertTrue(future.cancelled())
+                    time.sleep(0.4)
+                    mock_send_chat_action.assert_not_called()
+            finally:
+                bot_manager.chat_actions.stop()
+
+    def test_update_tracker(self):
+        tracker = self.master.bot_manager.update_tracker
+        with patch.object(tracker, 'checkpoint_batch', 2), patch.object(tracker, 'CHECKPOINT_INTERVAL', 60):
+            self.assertFalse(tracker.is_duplicate(100001))
+            tracker.processed(100001)
+            with self.subTest("Drop recently processed update"):
+                self.assertTrue(tracker.is_duplicate(100001))
+            self.assertEqual(self.master.db.get_update_offset(), 0)
+
+            with self.subTest("Save offset in batches"):
+                self.assertFalse(tracker.is_duplicate(100002))
+                tracker.processed(100002)
+                self.assertEqual(self.master.db.get_update_offset(), 100003)
+
+        with self.subTest("Drop updates processed before restart"):
+            tracker.recent.clear()
+            self.assertTrue(tracker.is_duplicate(100002))
+            self.assertFalse(tracker.is_duplicate(100003))
+
+        with self.subTest("Accept restarted update IDs"):
+            self.assertFalse(tracker.is_duplicate(5))
+            tracker.processed(5)
+            tracker.checkpoint()
+            self.assertEqual(self.master.db.get_update_offset(), 6)
+
+    def test_polling_resume(self):
+        bot_manager = self.master.bot_manager
+        offset = self.master.db.get_update_offset()
+        # As saved before a restart
+        self.master.db.set_update_offset(200001)
+        try:
+            with patch.object(bot_manager.updater, 'start_polling') as start_polling:
+                with self.subTest("Resume from the offset saved"):
+                    bot_manager.polling()
+                    self.assertEqual(bot_manager.updater.last_update_id, 200001)
+                    start_polling.assert_called_with(timeout=10, clean=False)
+
+                with self.subTest("Drop pending updates"), \
+                        patch.dict(self.master.flag.config, {"clean_pending_updates": True}):
+                    bot_manager.polling()
+                    start_polling.assert_called_with(timeout=10, clean=True)
+        finally:
+            self.master.db.set_update_offset(offset)
@@ -72,39 +72,63 @@ class ChatBindingTest(StandardChannelTest):
             self.master.chat_binding.link_chat_gen_list(0)
             mock_pagination.assert_called()
             self.master.bot_manager.send_message.assert_called()
-            self.master.bot_manager.edit_message_text.assert_called()
+            self.master.bot_manager.edit_message_text_async.assert_called()
             self.master.bot_manager.reset_mock()
 
         with self.subTest('Edit message'):
             self.master.chat_binding.link_chat_gen_list(0, message_id=1)
             mock_pagination.assert_called()
             self.master.bot_manager.send_message.assert_not_called()
-            self.master.bot_manager.edit_message_text.assert_called()
+            self.master.bot_manager.edit_message_text_async.assert_called()
 
     def test_chat_confirm(self):
         with self.subTest("Cancel"):
             self.master.chat_binding.link_chat_gen_list(1, 1)
             c = CallbackQuery(1, self.user, None, message=self.message, data=Flags.CANCEL_PROCESS)
             self.master.chat_binding.link_chat_confirm(self.bot, Update(0, callback_query=c))
-            self.master.bot_manager.edit_message_text.assert_called()
-            self.assertNotIn("reply_markup", self.master.bot_manager.edit_message_text.call_args[1])
+            self.master.bot_manager.edit_message_text_async.assert_called()
+            self.assertNotIn("reply_markup", self.master.bot_manager.edit_message_text_async.call_args[1])
             self.master.bot_manager.reset_mock()
 
         with self.subTest("Unknown command"):
             self.master.chat_binding.link_chat_gen_list(1, 1)
             c = CallbackQuery(1, self.user, None, message=self.message, data="__unknown_command__")
             self.master.chat_binding.link_chat_confirm(self.bot, Update(0, callback_query=c))
-            self.master.bot_manager.edit_message_text.assert_called()
-            self.assertNotIn("reply_markup", self.master.bot_manager.edit_message_text.call_args[1])
+            self.master.bot_manager.edit_message_text_async.assert_called()
+            self.assertNotIn("reply_markup", self.master.bot_manager.edit_message_text_async.call_args[1])
             self.master.bot_manager.reset_mock()
 
         with self.subTest("Chat choice: non-linked"):
             self.master.chat_binding.link_chat_gen_list(1, 1)
             c = CallbackQuery(1, self.user, None, message=self.message, data="chat 0")
             self.master.chat_binding.link_chat_confirm(self.bot, Update(0, callback_query=c))
-            self.master.bot_manager.edit_message_text.assert_called()
-            state_buttons = self.master.bot_manager.edit_message_text.call_args[1]['reply_markup'].inline_keyboard[0]
+            self.master.bot_manager.edit_message_text_async.assert_called()
+            reply_markup = self.master.bot_manager.edit_message_text_async.call_args[1]['reply_markup']
+            state_buttons = reply_markup.inline_keyboard[0]
             self.assertEqual(len(state_buttons), 2)
             self.master.bot_manager.reset_mock()
 
     # TODO: write test for the rest of the class
+
+    def test_apply_link_changes(self):
+        chat_binding = self.master.chat_binding
+        alice = utils.chat_id_to_str(chat=self.slave.get_chat('alice'))
+        bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+        changes = chat_binding.parse_link_mapping("# Mapping\n"
+                                                  "link -1001234567890 %s alice\n"
+                                                  "\n"
+                                                  "mute %s bob\n" % (self.slave.channel_id, self.slave.channel_id))
+        self.assertEqual(chat_binding.apply_link_changes(changes), 2)
+        self.assertEqual(self.master.db.get_chat_assoc(slave_uid=alice),
+                         [utils.chat_id_to_str(self.master.channel_id, -1001234567890)])
+        self.assertEqual(self.master.db.get_chat_assoc(slave_uid=bob), ["__muted__"])
+
+        with self.subTest("Nothing is applied with an invalid change"):
+            with self.assertRaises(ValueError):
+                chat_binding.apply_link_changes(chat_binding.parse_link_mapping(
+                    "unlink %s alice\nlink invalid %s bob" % (self.slave.channel_id, self.slave.channel_id)))
+            self.assertTrue(self.master.db.get_chat_assoc(slave_uid=alice))
+
+        chat_binding.apply_link_changes(chat_binding.parse_link_mapping(
+            "unlink %s alice\nunlink %s bob" % (self.slave.channel_id, self.slave.channel_id)))
+        self.assertEqual(self.master.db.get_chat_assoc(slave_uid=alice), [])
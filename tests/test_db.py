@@ -0,0 +1,704 @@
+import datetime
+import os
+import sqlite3
+from contextlib import closing
+import threading
+import time
+import xmlrpc.client
+from collections import OrderedDict
+from typing import List
+from unittest.mock import Mock, patch
+
+from ehforwarderbot import ChatType
+from peewee import DoesNotExist
+
+from .base_test import StandardChannelTest
+from efb_telegram_master import utils
+from efb_telegram_master.db import MsgLogWriter, MsgLogCache, CompressedTextField
+from efb_telegram_master.memory_db import MemoryDatabaseManager
+
+
+class DatabaseManagerTest(StandardChannelTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.db = cls.master.db
+
+        cls.tg_chat = utils.chat_id_to_str(cls.master.channel_id, 100)
+        cls.slave_chat = utils.chat_id_to_str(chat=cls.slave.get_chat('alice'))
+        cls.db.add_chat_assoc(master_uid=cls.tg_chat, slave_uid=cls.slave_chat)
+        for i in range(1, 11):
+            cls.db.add_msg_log(master_msg_id=utils.message_id_to_str(100, i),
+                               text="Message %s" % i,
+                               slave_origin_uid=cls.slave_chat,
+                               msg_type="Text",
+                               sent_to="master",
+                               slave_message_id="alice_%s" % i)
+        cls.db.set_slave_chat_info(slave_channel_id=cls.slave.channel_id,
+                                   slave_channel_name=cls.slave.channel_name,
+                                   slave_channel_emoji=cls.slave.channel_emoji,
+                                   slave_chat_uid="alice",
+                                   slave_chat_name="Alice",
+                                   slave_chat_type=ChatType.User)
+
+    def query_plans(self, fn, *args, **kwargs) -> List[str]:
+        """Run ``fn`` and return query plans of all SELECT statements it executes."""
+        with patch.object(self.db.db, 'execute_sql', wraps=self.db.db.execute_sql) as execute_sql:
+            fn(*args, **kwargs)
+            queries = [i[0] for i in execute_sql.call_args_list if i[0][0].startswith("SELECT")]
+        plans = []
+        for sql, params in queries:
+            cursor = self.db.db.execute_sql("EXPLAIN QUERY PLAN " + sql, params)
+            plans.append("\n".join(row[-1] for row in cursor.fetchall()))
+        return plans
+
+    def assertIndexUsed(self, index: str, plans: List[str]):
+        self.assertTrue(plans, "No query is executed.")
+        for plan in plans:
+            self.assertIn(index, plan)
+
+    def test_connection_profile(self):
+        result = {}
+
+        def worker():
+            with self.db.connection_context():
+                for pragma in ("journal_mode", "synchronous", "busy_timeout"):
+                    result[pragma] = self.db.db.execute_sql("PRAGMA %s" % pragma).fetchone()[0]
+                result['closed'] = self.db.db.is_closed()
+            result['closed_after'] = self.db.db.is_closed()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(result, {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000,
+                                  "closed": False, "closed_after": True})
+        # Connection of the current thread is not closed by a nested context
+        with self.db.connection_context():
+            pass
+        self.assertFalse(self.db.db.is_closed())
+
+    def test_get_chat_assoc(self):
+        with self.subTest("Look up by master UID"):
+            self.assertEqual(self.query_plans(self.db.get_chat_assoc, master_uid=self.tg_chat), [])
+            self.assertEqual(self.db.get_chat_assoc(master_uid=self.tg_chat), [self.slave_chat])
+        with self.subTest("Look up by slave UID"):
+            self.assertEqual(self.query_plans(self.db.get_chat_assoc, slave_uid=self.slave_chat), [])
+            self.assertEqual(self.db.get_chat_assoc(slave_uid=self.slave_chat), [self.tg_chat])
+
+    def test_chat_assoc_write_through(self):
+        tg_chat = utils.chat_id_to_str(self.master.channel_id, 200)
+        bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+        wonderland = utils.chat_id_to_str(chat=self.slave.get_chat('wonderland001'))
+        self.db.add_chat_assoc(master_uid=tg_chat, slave_uid=bob, multiple_slave=True)
+        self.db.add_chat_assoc(master_uid=tg_chat, slave_uid=wonderland, multiple_slave=True)
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [bob, wonderland])
+
+        self.db.remove_chat_assoc(slave_uid=bob)
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [wonderland])
+        self.assertEqual(self.db.get_chat_assoc(slave_uid=bob), [])
+
+        self.db.remove_chat_assoc(master_uid=tg_chat)
+        self.assertEqual(self.db.get_chat_assoc(slave_uid=wonderland), [])
+
+        # Routing table is consistent with the database after a reload
+        self.db.add_chat_assoc(master_uid=tg_chat, slave_uid=bob)
+        self.db._load_chat_assoc()
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [bob])
+        self.db.remove_chat_assoc(master_uid=tg_chat)
+
+    def test_update_chat_assoc(self):
+        tg_chat = utils.chat_id_to_str(self.master.channel_id, 300)
+        bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+        wonderland = utils.chat_id_to_str(chat=self.slave.get_chat('wonderland001'))
+        self.assertEqual(self.db.update_chat_assoc([
+            {"action": "link", "master_uid": tg_chat, "slave_uid": bob, "multiple_slave": True},
+            {"action": "link", "master_uid": tg_chat, "slave_uid": wonderland, "multiple_slave": True},
+        ]), 2)
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [bob, wonderland])
+
+        with self.subTest("Roll back all changes on failure"):
+            with patch.object(self.db, 'add_chat_assoc', side_effect=RuntimeError), \
+                    self.assertRaises(RuntimeError):
+                self.db.update_chat_assoc([{"action": "unlink", "slave_uid": bob},
+                                           {"action": "link", "master_uid": tg_chat, "slave_uid": bob}])
+            self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [bob, wonderland])
+            self.assertEqual(self.db.ChatAssoc.select().where(self.db.ChatAssoc.master_uid == tg_chat).count(), 2)
+
+        with self.subTest("Reject invalid changes"), self.assertRaises(ValueError):
+            self.db.update_chat_assoc([{"action": "unlink", "slave_uid": bob}, {"action": "link", "slave_uid": bob}])
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [bob, wonderland])
+
+        self.db.update_chat_assoc([{"action": "unlink", "slave_uid": bob},
+                                   {"action": "unlink", "slave_uid": wonderland}])
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [])
+
+    def test_get_msg_log(self):
+        with patch.object(self.db, 'msg_log_cache', None):
+            with self.subTest("Look up by master message ID"):
+                plans = self.query_plans(self.db.get_msg_log, master_msg_id=utils.message_id_to_str(100, 1))
+                self.assertIndexUsed("sqlite_autoindex_msglog_1", plans)
+            with self.subTest("Look up by slave message ID"):
+                plans = self.query_plans(self.db.get_msg_log,
+                                         slave_msg_id="alice_1", slave_origin_uid=self.slave_chat)
+                self.assertIndexUsed("msglog_slave_message_id_slave_origin_uid_time", plans)
+        self.assertEqual(self.db.get_msg_log(slave_msg_id="alice_1", slave_origin_uid=self.slave_chat).text,
+                         "Message 1")
+
+    def test_get_last_msg_from_chat(self):
+        plans = self.query_plans(self.db.get_last_msg_from_chat, 100)
+        self.assertIndexUsed("msglog_master_chat_id_time_slave_origin_uid", plans)
+        last_msg = self.db.get_last_msg_from_chat(100)
+        self.assertEqual(last_msg.master_msg_id, utils.message_id_to_str(100, 10))
+        self.assertEqual((last_msg.master_chat_id, last_msg.master_message_id), (100, 10))
+
+    def test_get_slave_chat_info(self):
+        plans = self.query_plans(self.db.get_slave_chat_info,
+                                 slave_channel_id=self.slave.channel_id, slave_chat_uid="alice")
+        self.assertIndexUsed("slavechatinfo_slave_channel_id_slave_chat_uid", plans)
+
+    def test_set_slave_chats_info(self):
+        chats = self.slave.get_chats()
+        with patch.object(self.db, 'BULK_INSERT_SIZE', 2):
+            self.assertEqual(self.db.set_slave_chats_info(chats), len(chats))
+        for chat in chats:
+            info = self.db.get_slave_chat_info(slave_channel_id=self.slave.channel_id, slave_chat_uid=chat.chat_uid)
+            self.assertEqual(info.slave_chat_name, chat.chat_name)
+            self.assertEqual(info.slave_chat_type, chat.chat_type.value)
+
+        with self.subTest("Update existing entries"):
+            chats[0].chat_alias = "Renamed"
+            self.db.set_slave_chats_info(chats[:1])
+            self.assertEqual(self.db.SlaveChatInfo.select()
+                             .where(self.db.SlaveChatInfo.slave_chat_uid == chats[0].chat_uid).count(), 1)
+            self.assertEqual(self.db.get_slave_chat_info(slave_channel_id=self.slave.channel_id,
+                                                         slave_chat_uid=chats[0].chat_uid).slave_chat_alias,
+                             "Renamed")
+
+    def test_get_recent_slave_chats(self):
+        self.db._recent_slave_chats.clear()
+        plans = self.query_plans(self.db.get_recent_slave_chats, 100)
+        self.assertIndexUsed("msglog_master_chat_id_time_slave_origin_uid", plans)
+        self.assertEqual(self.db.get_recent_slave_chats(100), [self.slave_chat])
+        self.assertEqual(self.db.get_recent_slave_chats(1000), [])
+
+        with self.subTest("Answer from memory once loaded"):
+            self.assertEqual(self.query_plans(self.db.get_recent_slave_chats, 100), [])
+
+        with self.subTest("Update on new message logs"):
+            bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+            self.db.add_msg_log(master_msg_id=utils.message_id_to_str(1000, 1), text="Message",
+                                slave_origin_uid=bob, msg_type="Text",
+                                sent_to="slave", slave_message_id="bob_1")
+            self.assertEqual(self.db.get_recent_slave_chats(100), [self.slave_chat])
+            self.assertEqual(self.db.get_recent_slave_chats(1000), [bob])
+            self.db.add_msg_log(master_msg_id=utils.message_id_to_str(1000, 2), text="Message",
+                                slave_origin_uid=self.slave_chat, msg_type="Text",
+                                sent_to="slave", slave_message_id="alice_11")
+            self.assertEqual(self.db.get_recent_slave_chats(1000), [self.slave_chat, bob])
+            self.assertEqual(self.db.get_recent_slave_chats(1000, limit=1), [self.slave_chat])
+
+    def test_msg_log_writer(self):
+        self.db.msg_log_writer = MsgLogWriter(self.db, interval=3600, batch_size=1000)
+        try:
+            master_msg_id = utils.message_id_to_str(300, 1)
+            self.db.add_msg_log(master_msg_id=master_msg_id, text="Pending",
+                                slave_origin_uid=self.slave_chat, msg_type="Text",
+                                sent_to="master", slave_message_id="alice_pending")
+            self.assertFalse(self.db.MsgLog.select().where(self.db.MsgLog.master_msg_id == master_msg_id).exists())
+
+            with self.subTest("Read pending entry"):
+                self.assertEqual(self.query_plans(self.db.get_msg_log, master_msg_id=master_msg_id), [])
+                self.assertEqual(self.db.get_msg_log(slave_msg_id="alice_pending",
+                                                     slave_origin_uid=self.slave_chat).text, "Pending")
+
+            with self.subTest("Update pending entry"):
+                self.db.add_msg_log(master_msg_id=master_msg_id, text="Edited", update=True)
+                self.assertEqual(self.db.get_msg_log(master_msg_id=master_msg_id).text, "Edited")
+
+            with self.subTest("Flush pending entries"):
+                self.db.msg_log_writer.flush()
+                self.assertEqual(self.db.MsgLog.get(self.db.MsgLog.master_msg_id == master_msg_id).text, "Edited")
+
+            with self.subTest("Delete pending entry"):
+                self.db.add_msg_log(master_msg_id=utils.message_id_to_str(300, 2), text="Discarded",
+                                    slave_origin_uid=self.slave_chat, msg_type="Text",
+                                    sent_to="master", slave_message_id="alice_discarded")
+                self.db.delete_msg_log(slave_msg_id="alice_discarded", slave_origin_uid=self.slave_chat)
+                self.db.graceful_stop()
+                self.assertIsNone(self.db.get_msg_log(master_msg_id=utils.message_id_to_str(300, 2)))
+        finally:
+            self.db.msg_log_writer.stop()
+            self.db.msg_log_writer = None
+
+    def test_msg_log_cache(self):
+        cache = MsgLogCache(3)
+        with patch.object(self.db, 'msg_log_cache', cache):
+            master_msg_ids = [utils.message_id_to_str(500, i) for i in range(1, 5)]
+            for i, master_msg_id in enumerate(master_msg_ids):
+                self.db.add_msg_log(master_msg_id=master_msg_id, text="Cached %s" % i,
+                                    slave_origin_uid=self.slave_chat, msg_type="Text",
+                                    sent_to="master", slave_message_id="alice_cached_%s" % i)
+
+            with self.subTest("Recent entries are read from memory"):
+                self.assertEqual(self.query_plans(self.db.get_msg_log, master_msg_id=master_msg_ids[-1]), [])
+                self.assertEqual(self.query_plans(self.db.get_msg_log, slave_msg_id="alice_cached_3",
+                                                  slave_origin_uid=self.slave_chat), [])
+                self.assertEqual(cache.stats()["hits"], 2)
+
+            with self.subTest("Least recently used entries are evicted"):
+                self.assertEqual(cache.stats()["size"], 3)
+                self.assertIsNone(cache.get(master_msg_id=master_msg_ids[0]))
+                self.assertEqual(self.db.get_msg_log(master_msg_id=master_msg_ids[0]).text, "Cached 0")
+                self.assertIsNotNone(cache.get(master_msg_id=master_msg_ids[0]))
+
+            with self.subTest("Updated entries are re-indexed"):
+                self.db.add_msg_log(master_msg_id=master_msg_ids[3], slave_message_id="alice_cached_edited",
+                                    update=True)
+                self.assertIsNone(cache.get(slave_msg_id="alice_cached_3", slave_origin_uid=self.slave_chat))
+                self.assertEqual(cache.get(slave_msg_id="alice_cached_edited",
+                                           slave_origin_uid=self.slave_chat).text, "Cached 3")
+
+            with self.subTest("Deleted entries are invalidated"):
+                self.db.delete_msg_log(slave_msg_id="alice_cached_edited", slave_origin_uid=self.slave_chat)
+                self.assertIsNone(self.db.get_msg_log(master_msg_id=master_msg_ids[3]))
+            self.assertEqual(self.db.get_msg_log_cache_stats(), cache.stats())
+
+    def test_compress_msg_log_text(self):
+        long_text = "Long message " * 100
+        master_msg_ids = [utils.message_id_to_str(600, i) for i in range(1, 3)]
+
+        def raw_text(master_msg_id):
+            return self.db.db.execute_sql('SELECT "text" FROM "msglog" WHERE "master_msg_id" = ?',
+                                          (master_msg_id,)).fetchone()[0]
+
+        self.db.add_msg_log(master_msg_id=master_msg_ids[0], text=long_text,
+                            slave_origin_uid=self.slave_chat, msg_type="Text",
+                            sent_to="master", slave_message_id="alice_long_0")
+        self.assertEqual(raw_text(master_msg_ids[0]), long_text)
+
+        with patch.object(self.db.MsgLog.text, 'threshold', 64), patch.object(self.db, 'msg_log_cache', None):
+            with self.subTest("Compress long text"):
+                self.db.add_msg_log(master_msg_id=master_msg_ids[1], text=long_text,
+                                    slave_origin_uid=self.slave_chat, msg_type="Text",
+                                    sent_to="master", slave_message_id="alice_long_1")
+                self.assertTrue(raw_text(master_msg_ids[1]).startswith(CompressedTextField.MARKER))
+                self.assertEqual(self.db.get_msg_log(master_msg_id=master_msg_ids[1]).text, long_text)
+
+            with self.subTest("Recompress existing text"):
+                result = self.db.recompress_msg_log()
+                self.assertEqual(result["rows"], 1)
+                self.assertGreater(result["kb_saved"], 0)
+                self.assertIsInstance(raw_text(master_msg_ids[0]), bytes)
+                self.assertEqual(self.db.get_msg_log(master_msg_id=master_msg_ids[0]).text, long_text)
+                self.assertEqual(self.db.get_msg_log(master_msg_id=utils.message_id_to_str(100, 1)).text,
+                                 "Message 1")
+
+        with self.subTest("Decompress when compression is disabled"):
+            self.assertEqual(self.db.recompress_msg_log()["rows"], 2)
+            self.assertEqual(raw_text(master_msg_ids[1]), long_text)
+
+    def test_search_msg_log(self):
+        with patch.object(self.db, 'has_search', True):
+            self.db._schedule_search_index()
+            stopped = threading.Event()
+            with self.subTest("Build index in resumable chunks"), \
+                    patch.object(self.db, 'SEARCH_INDEX_CHUNK_SIZE', 2), \
+                    patch.object(self.db, 'BACKFILL_CHUNK_INTERVAL', 0):
+                self.db.add_msg_log(master_msg_id=utils.message_id_to_str(100, 1), text="Message 1", update=True)
+                search_rows = self.db._search_rows
+                chunks = []
+
+                def interrupted_search_rows(rows):
+                    chunks.append(rows)
+                    if len(chunks) > 1:
+                        raise RuntimeError("Interrupted")
+                    return search_rows(rows)
+
+                with patch.object(self.db, '_search_rows', side_effect=interrupted_search_rows):
+                    with self.assertRaises(RuntimeError):
+                        self.db.run_backfills(stopped)
+                progress = self.db.get_migration_progress()["backfills"][0]
+                self.assertEqual(progress["name"], "msglog_search")
+                self.assertGreater(progress["cursor"], 0)
+                self.assertFalse(self.db.BotState.select().where(
+                    self.db.BotState.key == self.db.SEARCH_INDEX_KEY).exists())
+                self.db.run_backfills(stopped)
+                self.assertEqual(self.db.get_migration_progress()["backfills"], [])
+                self.assertTrue(self.db.BotState.select().where(
+                    self.db.BotState.key == self.db.SEARCH_INDEX_KEY).exists())
+                # Every entry is indexed once
+                count = self.db.MsgLog.select().where(self.db.MsgLog.text != "").count()
+                if self.db.has_archive:
+                    count += self.db.ArchivedMsgLog.select().where(self.db.ArchivedMsgLog.text != "").count()
+                self.assertEqual(self.db.MsgLogSearch.select().count(), count)
+
+            with self.subTest("Existing entries are indexed"):
+                results = self.db.search_msg_log("message 1")
+                self.assertEqual(results[0]["master_msg_id"], utils.message_id_to_str(100, 1))
+                self.assertEqual(results[0]["slave_origin_uid"], self.slave_chat)
+                self.assertEqual(len(self.db.search_msg_log("message", limit=3, offset=0)), 3)
+                self.assertEqual(self.db.search_msg_log("nonexistent"), [])
+
+            master_msg_id = utils.message_id_to_str(-700, 1)
+            self.db.add_msg_log(master_msg_id=master_msg_id, text="Quick brown fox",
+                                slave_origin_uid=self.slave_chat, msg_type="Text",
+                                sent_to="master", slave_message_id="alice_fox")
+            with self.subTest("New entries are indexed"):
+                self.assertEqual([i["master_msg_id"] for i in self.db.search_msg_log("brown fox")], [master_msg_id])
+                self.assertEqual(self.db.search_msg_log('fox" OR "message'), [])
+
+            with self.subTest("Updated entries are re-indexed"):
+                self.db.add_msg_log(master_msg_id=master_msg_id, text="Lazy dog", update=True)
+                self.assertEqual(self.db.search_msg_log("fox"), [])
+                self.assertEqual(len(self.db.search_msg_log("dog")), 1)
+
+            with self.subTest("Deleted entries are removed"):
+                self.db.delete_msg_log(slave_msg_id="alice_fox", slave_origin_uid=self.slave_chat)
+                self.assertEqual(self.db.search_msg_log("dog"), [])
+
+    def test_backup(self):
+        progress = []
+        path = os.path.join(self.master.db.backup_path.parent, "test_backup.db")
+        with patch.object(self.db, 'BACKUP_STEP_PAGES', 1), patch.object(self.db, 'BACKUP_STEP_INTERVAL', 0):
+            result = self.db.backup(path, progress=lambda copied, total: progress.append((copied, total)))
+        self.assertEqual(result["path"], path)
+        self.assertGreater(result["pages"], 1)
+        self.assertEqual(progress[-1], (result["pages"], result["pages"]))
+        self.assertGreater(len(progress), 1)
+        with closing(sqlite3.connect(path)) as backup:
+            self.assertEqual(backup.execute('SELECT COUNT(*) FROM "msglog"').fetchone()[0],
+                             self.db.MsgLog.select().count())
+
+        with self.subTest("Remove incomplete backup on failure"):
+            path = os.path.join(self.master.db.backup_path.parent, "test_backup_failed.db")
+            with patch.object(self.db, 'BACKUP_STEP_PAGES', 1), patch.object(self.db, 'BACKUP_STEP_INTERVAL', 0), \
+                    self.assertRaises(RuntimeError):
+                self.db.backup(path, progress=Mock(side_effect=RuntimeError()))
+            self.assertFalse(os.path.exists(path))
+            self.assertFalse(os.path.exists(path + ".part"))
+
+        with self.subTest("Marshal result without archive for RPC"):
+            path = os.path.join(self.master.db.backup_path.parent, "test_backup_rpc.db")
+            with patch.object(self.db, 'has_archive', False):
+                result = self.db.backup(path)
+            self.assertEqual(result["archive_path"], "")
+            # RPC server does not allow None
+            xmlrpc.client.dumps((result,), methodresponse=True)
+
+        with self.subTest("Back up archived message logs"):
+            old_ids = [utils.message_id_to_str(450, i) for i in range(1, 4)]
+            for master_msg_id in old_ids:
+                self.db.add_msg_log(master_msg_id=master_msg_id, text="Old message",
+                                    slave_origin_uid=self.slave_chat, msg_type="Text",
+                                    sent_to="master", slave_message_id=master_msg_id)
+            self.db.MsgLog.update(time=datetime.datetime.now() - datetime.timedelta(days=60)) \
+                .where(self.db.MsgLog.master_msg_id.in_(old_ids)).execute()
+            with patch.object(self.db, 'ARCHIVE_CHUNK_INTERVAL', 0):
+                self.assertEqual(self.db.archive_msg_log(max_age=datetime.timedelta(days=30)), len(old_ids))
+            path = os.path.join(self.master.db.backup_path.parent, "test_backup_archive.db")
+            result = self.db.backup(path)
+            self.assertEqual(result["archive_path"], self.db.archive_backup_path(path))
+            with closing(sqlite3.connect(result["archive_path"])) as backup:
+                self.assertEqual(backup.execute('SELECT COUNT(*) FROM "msglog"').fetchone()[0],
+                                 self.db.ArchivedMsgLog.select().count())
+
+    def test_maintain(self):
+        master_msg_ids = [utils.message_id_to_str(800, i) for i in range(1, 201)]
+        for master_msg_id in master_msg_ids:
+            self.db.add_msg_log(master_msg_id=master_msg_id, text="Message " * 100,
+                                slave_origin_uid=self.slave_chat, msg_type="Text",
+                                sent_to="master", slave_message_id=master_msg_id)
+        for master_msg_id in master_msg_ids:
+            self.db.delete_msg_log(master_msg_id=master_msg_id)
+        self.assertEqual(self.db.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.assertGreater(self.db.db.execute_sql("PRAGMA freelist_count").fetchone()[0], 0)
+
+        with self.subTest("Yield to new activity"):
+            with patch.object(self.db, 'last_activity', time.time() + 60):
+                self.assertFalse(self.db.maintain()["completed"])
+
+        with self.subTest("Complete maintenance"):
+            result = self.db.maintain()
+            self.assertTrue(result["completed"])
+            self.assertEqual(self.db.db.execute_sql("PRAGMA freelist_count").fetchone()[0], 0)
+            self.assertTrue(self.db.db.execute_sql(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0])
+
+        with self.subTest("Marshal sizes over 2 GiB for RPC"):
+            with patch.object(self.db, '_db_size', side_effect=[5 << 30, 1 << 30]):
+                result = self.db.maintain()
+            self.assertEqual(result["kb_reclaimed"], 4 << 20)
+            xmlrpc.client.dumps((result,), methodresponse=True)
+
+        with self.subTest("Skip incremental vacuum without auto vacuum"):
+            self.db.db.execute_sql("PRAGMA auto_vacuum = NONE")
+            self.db.db.execute_sql("VACUUM")
+            self.assertTrue(self.db.maintain()["completed"])
+            self.assertEqual(self.db.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0], 0)
+
+        with self.subTest("Enable incremental vacuum on request"):
+            count = self.db.MsgLog.select().count()
+            self.assertTrue(self.db.enable_incremental_vacuum())
+            self.assertEqual(self.db.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0], 2)
+            self.assertEqual(self.db.MsgLog.select().count(), count)
+            self.assertFalse(self.db.enable_incremental_vacuum())
+
+    def test_query_stats(self):
+        self.db.reset_query_stats()
+        self.db.get_chat_assoc(master_uid=self.tg_chat)
+        self.db.add_msg_log(master_msg_id=utils.message_id_to_str(100, 1), text="Message 1", update=True)
+        stats = self.db.get_query_stats()
+        self.assertEqual(stats["methods"]["get_chat_assoc"]["count"], 1)
+        self.assertEqual(sum(stats["methods"]["get_chat_assoc"]["histogram"].values()), 1)
+        # Nested calls are counted separately
+        self.assertEqual(stats["methods"]["add_msg_log"]["count"], 1)
+        self.assertIn("get_msg_log", stats["methods"])
+
+        with self.subTest("Time update offset checkpoints"):
+            self.db.set_update_offset(self.db.get_update_offset())
+            stats = self.db.get_query_stats()
+            self.assertEqual(stats["methods"]["get_update_offset"]["count"], 1)
+            self.assertEqual(stats["methods"]["set_update_offset"]["count"], 1)
+
+        with self.subTest("Log slow queries"), patch.object(self.db.query_stats, 'slow_threshold', 1e-6):
+            self.db.msg_log_cache.discard(master_msg_id=utils.message_id_to_str(100, 2))
+            self.db.get_msg_log(master_msg_id=utils.message_id_to_str(100, 2))
+            slow_query = self.db.get_query_stats()["slow_queries"][-1]
+            self.assertEqual(slow_query["method"], "get_msg_log")
+            self.assertIn('FROM "msglog"', slow_query["sql"])
+            self.assertIn("sqlite_autoindex_msglog_1", slow_query["plan"])
+
+    def test_cache_state(self):
+        master_msg_ids = [utils.message_id_to_str(100, i) for i in (3, 1, 2)]
+        for master_msg_id in master_msg_ids:
+            self.db.get_msg_log(master_msg_id=master_msg_id)
+        self.db.get_recent_slave_chats(100)
+        state = self.db.export_cache_state()
+        self.assertEqual(state["msg_log_cache"][-3:], master_msg_ids)
+        self.assertEqual(state["recent_slave_chats"]["100"], [self.slave_chat])
+
+        with patch.object(self.db, 'msg_log_cache', MsgLogCache(10)), \
+                patch.object(self.db, '_recent_slave_chats', {}):
+            with self.subTest("Ignore state of another schema version"):
+                self.assertFalse(self.db.import_cache_state(dict(state, schema_version=0)))
+                self.assertEqual(self.db.msg_log_cache.stats()["size"], 0)
+
+            with self.subTest("Restore state"):
+                self.assertTrue(self.db.import_cache_state(state))
+                self.assertEqual(list(self.db.msg_log_cache.entries)[-3:], master_msg_ids)
+                self.assertEqual(self.query_plans(self.db.get_recent_slave_chats, 100), [])
+                self.assertEqual(self.db.get_recent_slave_chats(100), [self.slave_chat])
+
+    def test_schema_backfill(self):
+        self.assertEqual(self.db.schema_version, self.db.SCHEMA_VERSION)
+        master_msg_ids = [utils.message_id_to_str(900, i) for i in range(1, 6)]
+        for master_msg_id in master_msg_ids:
+            self.db.add_msg_log(master_msg_id=master_msg_id, text="Message", slave_origin_uid=self.slave_chat,
+                                msg_type="Text", sent_to="master", slave_message_id=master_msg_id)
+            self.db.msg_log_cache.discard(master_msg_id=master_msg_id)
+        # Entries in the schema before migration 2
+        self.db.db.execute_sql("UPDATE msglog SET master_chat_id = NULL, master_message_id = NULL, "
+                               "time = '2019-01-08 12:34:56.789' WHERE master_msg_id LIKE '900.%'")
+        self.db.SchemaBackfill.create(name="msglog_compact")
+        self.assertEqual(self.db.get_migration_progress()["backfills"][0]["cursor"], 0)
+
+        # As on start with the backfill pending
+        self.db._compact_pending = True
+        with self.subTest("Look up entries by chat before the backfill"):
+            self.assertTrue(self.db.get_last_msg_from_chat(900).master_msg_id.startswith("900."))
+            self.assertEqual(self.db.get_recent_slave_chats(900), [self.slave_chat])
+
+        with self.subTest("Order text times with newer integer times"):
+            bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+            mixed_ids = [utils.message_id_to_str(901, i) for i in (1, 2)]
+            for master_msg_id, slave_origin_uid in zip(mixed_ids, (bob, self.slave_chat)):
+                self.db.add_msg_log(master_msg_id=master_msg_id, text="Message", slave_origin_uid=slave_origin_uid,
+                                    msg_type="Text", sent_to="master", slave_message_id=master_msg_id)
+            # A legacy entry, and a newer one updated with integer time before the backfill
+            self.db.db.execute_sql("UPDATE msglog SET master_chat_id = NULL, master_message_id = NULL "
+                                   "WHERE master_msg_id LIKE '901.%'")
+            self.db.db.execute_sql("UPDATE msglog SET time = '2019-01-08 12:34:56.789' WHERE master_msg_id = ?",
+                                   (mixed_ids[0],))
+            self.assertEqual(self.db.get_last_msg_from_chat(901).master_msg_id, mixed_ids[1])
+            self.assertEqual(self.db.get_recent_slave_chats(901), [self.slave_chat, bob])
+
+        with self.subTest("Read text times before the backfill"):
+            msg_log = self.db.get_msg_log(master_msg_id=master_msg_ids[0])
+            self.assertEqual(msg_log.time, datetime.datetime(2019, 1, 8, 12, 34, 56, 789000))
+            self.assertEqual(self.db._search_rows([msg_log])[0]["time"], self.db.MsgLog.time.db_value(msg_log.time))
+            self.db.msg_log_cache.discard(master_msg_id=master_msg_ids[0])
+
+        stopped = threading.Event()
+        chunks = []
+
+        def backfill(cursor):
+            chunks.append(cursor)
+            if len(chunks) == 2:
+                stopped.set()
+            return self.db._backfill_msglog_compact(cursor)
+
+        with patch.object(self.db, 'BACKFILL_CHUNK_SIZE', 2), patch.object(self.db, 'BACKFILL_CHUNK_INTERVAL', 0), \
+                patch.dict(self.db.backfills, {"msglog_compact": backfill}):
+            with self.subTest("Pause and save progress"):
+                self.db.run_backfills(stopped)
+                self.assertEqual(len(chunks), 2)
+                self.assertGreater(self.db.get_migration_progress()["backfills"][0]["cursor"], 0)
+
+            with self.subTest("Resume and finish"):
+                self.db.run_backfills()
+                # Resumed after the last chunk saved
+                self.assertGreater(chunks[2], chunks[1])
+                self.assertEqual(self.db.get_migration_progress()["backfills"], [])
+                msg_log = self.db.get_msg_log(master_msg_id=master_msg_ids[0])
+                self.assertEqual((msg_log.master_chat_id, msg_log.master_message_id), (900, 1))
+                self.assertIsInstance(msg_log.time, datetime.datetime)
+                self.assertEqual(self.db.get_last_msg_from_chat(900).master_msg_id, master_msg_ids[-1])
+                self.assertFalse(self.db._compact_pending)
+                self.assertNotIn(900, self.db._recent_slave_chats)
+
+        with self.subTest("Run backfills in the order they are listed"):
+            runs = []
+
+            def task(name):
+                return lambda cursor: runs.append(name)
+
+            self.db.SchemaBackfill.insert_many([{"name": "a_second"}, {"name": "z_first"}]).execute()
+            with patch.object(self.db, 'backfills', OrderedDict([("z_first", task("z_first")),
+                                                                  ("a_second", task("a_second"))])):
+                self.assertEqual([i["name"] for i in self.db.get_migration_progress()["backfills"]],
+                                 ["z_first", "a_second"])
+                self.db.run_backfills()
+            self.assertEqual(runs, ["z_first", "a_second"])
+
+    def test_archive_msg_log(self):
+        old_ids = [utils.message_id_to_str(400, i) for i in range(1, 6)]
+        for i, master_msg_id in enumerate(old_ids):
+            self.db.add_msg_log(master_msg_id=master_msg_id, text="Old message %s" % i,
+                                slave_origin_uid=self.slave_chat, msg_type="Text",
+                                sent_to="master", slave_message_id="alice_old_%s" % i)
+        self.db.MsgLog.update(time=datetime.datetime.now() - datetime.timedelta(days=60)) \
+            .where(self.db.MsgLog.master_msg_id.in_(old_ids)).execute()
+
+        for master_msg_id in old_ids:
+            self.db.get_msg_log(master_msg_id=master_msg_id)
+        with patch.object(self.db, 'ARCHIVE_CHUNK_SIZE', 2), patch.object(self.db, 'ARCHIVE_CHUNK_INTERVAL', 0):
+            self.assertEqual(self.db.archive_msg_log(max_age=datetime.timedelta(days=30)), len(old_ids))
+
+        with self.subTest("Archived entries are evicted from the cache"):
+            for master_msg_id in old_ids:
+                self.assertNotIn(master_msg_id, self.db.msg_log_cache.entries)
+
+        with self.subTest("Archived entries are moved out of the main table"):
+            self.assertFalse(self.db.MsgLog.select().where(self.db.MsgLog.master_msg_id.in_(old_ids)).exists())
+            self.assertEqual(self.db.ArchivedMsgLog.select()
+                             .where(self.db.ArchivedMsgLog.master_msg_id.in_(old_ids)).count(), len(old_ids))
+            self.assertIsNotNone(self.db.get_msg_log(master_msg_id=utils.message_id_to_str(100, 1)))
+
+        with self.subTest("Look up archived entries"):
+            self.assertEqual(self.db.get_msg_log(master_msg_id=old_ids[0]).text, "Old message 0")
+            self.assertEqual(self.db.get_msg_log(slave_msg_id="alice_old_1",
+                                                 slave_origin_uid=self.slave_chat).text, "Old message 1")
+
+        with self.subTest("Update archived entry"):
+            self.db.add_msg_log(master_msg_id=old_ids[2], text="Edited", update=True)
+            self.assertEqual(self.db.get_msg_log(master_msg_id=old_ids[2]).text, "Edited")
+
+        with self.subTest("Delete archived entry"):
+            self.db.delete_msg_log(master_msg_id=old_ids[3])
+            self.assertIsNone(self.db.get_msg_log(master_msg_id=old_ids[3]))
+
+    def test_archive_msg_log_across_threads(self):
+        master_msg_id = utils.message_id_to_str(401, 1)
+        self.db.add_msg_log(master_msg_id=master_msg_id, text="Old message", slave_origin_uid=self.slave_chat,
+                            msg_type="Text", sent_to="master", slave_message_id="alice_old_thread")
+        self.db.MsgLog.update(time=datetime.datetime.now() - datetime.timedelta(days=60)) \
+            .where(self.db.MsgLog.master_msg_id == master_msg_id).execute()
+
+        connected = threading.Event()
+        archived = threading.Event()
+        results = []
+
+        def lookup():
+            try:
+                # Open the connection of this thread before archiving
+                self.db.get_msg_log(master_msg_id=utils.message_id_to_str(100, 1))
+                connected.set()
+                archived.wait(5)
+                results.append(self.db.get_msg_log(master_msg_id=master_msg_id))
+            except Exception as e:
+                results.append(e)
+            finally:
+                self.db.db.close()
+
+        with patch.object(self.db, 'msg_log_cache', None), patch.object(self.db, 'ARCHIVE_CHUNK_INTERVAL', 0):
+            thread = threading.Thread(target=lookup)
+            thread.start()
+            self.assertTrue(connected.wait(5))
+            self.assertEqual(self.db.archive_msg_log(max_age=datetime.timedelta(days=30)), 1)
+            archived.set()
+            thread.join(5)
+
+        self.assertEqual(len(results), 1)
+        self.assertNotIsInstance(results[0], Exception)
+        self.assertEqual(results[0].text, "Old message")
+
+
+class MemoryDatabaseManagerTest(StandardChannelTest):
+    def setUp(self):
+        self.db = MemoryDatabaseManager(self.master)
+        self.slave_chat = utils.chat_id_to_str(chat=self.slave.get_chat('alice'))
+
+    def add_msg_log(self, master_msg_id, slave_message_id, **kwargs):
+        return self.db.add_msg_log(master_msg_id=master_msg_id, text="Message", slave_origin_uid=self.slave_chat,
+                                   msg_type="Text", sent_to="master", slave_message_id=slave_message_id,
+                                   **kwargs)
+
+    def test_chat_assoc(self):
+        tg_chat = utils.chat_id_to_str(self.master.channel_id, 100)
+        tg_chat_2 = utils.chat_id_to_str(self.master.channel_id, 200)
+        bob = utils.chat_id_to_str(chat=self.slave.get_chat('bob'))
+        self.db.add_chat_assoc(master_uid=tg_chat, slave_uid=self.slave_chat)
+        self.db.add_chat_assoc(master_uid=tg_chat, slave_uid=bob, multiple_slave=True)
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [self.slave_chat, bob])
+        self.db.add_chat_assoc(master_uid=tg_chat_2, slave_uid=bob)
+        self.assertEqual(self.db.get_chat_assoc(master_uid=tg_chat), [self.slave_chat])
+        self.assertEqual(self.db.get_chat_assoc(slave_uid=bob), [tg_chat_2])
+        self.assertEqual(self.db.remove_chat_assoc(master_uid=tg_chat), 1)
+        self.assertEqual(self.db.get_chat_assoc(slave_uid=self.slave_chat), [])
+
+    def test_msg_log(self):
+        self.add_msg_log("100.1", "alice_1")
+        self.add_msg_log("100.2", "alice_2")
+        with self.subTest("Look up"):
+            self.assertEqual(self.db.get_msg_log(master_msg_id="100.1").slave_message_id, "alice_1")
+            self.assertEqual(self.db.get_msg_log(slave_msg_id="alice_2", slave_origin_uid=self.slave_chat)
+                             .master_msg_id, "100.2")
+            self.assertEqual(self.db.get_last_msg_from_chat(100).master_msg_id, "100.2")
+            self.assertEqual(self.db.get_recent_slave_chats(100), [self.slave_chat])
+        with self.subTest("Update"):
+            self.db.add_msg_log(master_msg_id="100.2", slave_message_id="alice_3", update=True)
+            self.assertIsNone(self.db.get_msg_log(slave_msg_id="alice_2", slave_origin_uid=self.slave_chat))
+            self.assertEqual(self.db.get_msg_log(slave_msg_id="alice_3", slave_origin_uid=self.slave_chat)
+                             .text, "Message")
+        with self.subTest("Update missing entry"):
+            with self.assertRaises(self.db.MsgLog.DoesNotExist):
+                self.db.add_msg_log(master_msg_id="100.404", text="Edited", update=True)
+            with self.assertRaises(DoesNotExist):
+                self.db.add_msg_log(master_msg_id="100.404", text="Edited", update=True)
+        with self.subTest("Update keeps the last message of the chat"):
+            self.db.add_msg_log(master_msg_id="100.1", text="Edited", update=True)
+            self.assertEqual(self.db.get_last_msg_from_chat(100).master_msg_id, "100.2")
+        with self.subTest("Delete"):
+            self.db.delete_msg_log(slave_msg_id="alice_3", slave_origin_uid=self.slave_chat)
+            self.assertIsNone(self.db.get_msg_log(master_msg_id="100.2"))
+            self.assertEqual(self.db.get_last_msg_from_chat(100).master_msg_id, "100.1")
+
+    def test_slave_chat_info(self):
+        chats = self.slave.get_chats()
+        self.assertEqual(self.db.set_slave_chats_info(chats), len(chats))
+        info = self.db.get_slave_chat_info(slave_channel_id=self.slave.channel_id, slave_chat_uid=chats[0].chat_uid)
+        self.assertEqual(info.slave_chat_name, chats[0].chat_name)
+        self.assertEqual(info.slave_chat_type, chats[0].chat_type.value)
+        self.db.delete_slave_chat_info(self.slave.channel_id, chats[0].chat_uid)
+        self.assertIsNone(self.db.get_slave_chat_info(slave_channel_id=self.slave.channel_id,
+                                                      slave_chat_uid=chats[0].chat_uid))
@@ -0,0 +1,49 @@
+from ehforwarderbot import EFBChat
+from ehforwarderbot.constants import MsgType
+
+from .base_test import StandardChannelTest
+from efb_telegram_master import utils
+
+
+class MessageLookupTest(StandardChannelTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.wonderland = utils.chat_id_to_str(chat=cls.slave.get_chat('wonderland001'))
+        cls.master.db.add_msg_log(master_msg_id="500.1", text="Hello", msg_type=MsgType.Image,
+                                  slave_origin_uid=cls.wonderland, slave_origin_display_name="Wonderland",
+                                  slave_member_uid="alice", slave_member_display_name="Alice",
+                                  sent_to="slave", slave_message_id="wonderland_1",
+                                  media_type="photo", file_id="file_1", mime="image/jpeg")
+        cls.master.db.add_msg_log(master_msg_id="500.2", text="Hi", msg_type="Text",
+                                  slave_origin_uid=cls.wonderland, slave_origin_display_name="__chat__",
+                                  sent_to="slave", slave_message_id="wonderland_2")
+        cls.master.db.add_msg_log(master_msg_id="500.3", text="Hi", msg_type="Text",
+                                  slave_origin_uid=cls.wonderland, slave_origin_display_name="__chat__",
+                                  sent_to="slave", slave_message_id="wonderland_3")
+
+    def test_get_message_by_id(self):
+        msg = self.master.get_message_by_id("500.1")
+        self.assertEqual((msg.uid, msg.text, msg.type, msg.mime), ("500.1", "Hello", MsgType.Image, "image/jpeg"))
+        self.assertEqual((msg.chat.module_id, msg.chat.chat_uid), (self.slave.channel_id, "wonderland001"))
+        self.assertEqual((msg.author.chat_uid, msg.author.chat_name), ("alice", "Alice"))
+        self.assertEqual(msg.vendor_specific["telegram_file_id"], "file_1")
+
+        msg = self.master.get_message_by_id("500.3")
+        self.assertEqual(msg.author.chat_uid, EFBChat.SELF_ID)
+        self.assertIsNone(self.master.get_message_by_id("500.4"))
+
+    def test_cache(self):
+        msg = self.master.get_message_by_id("500.2")
+        msg.vendor_specific["changed"] = True
+        cached = self.master.get_message_by_id("500.2")
+        self.assertIs(cached.chat, msg.chat)
+        self.assertNotIn("changed", cached.vendor_specific)
+
+        with self.subTest("Rebuild edited message"):
+            self.master.db.add_msg_log(master_msg_id="500.2", text="Edited", update=True)
+            self.assertEqual(self.master.get_message_by_id("500.2").text, "Edited")
+
+        with self.subTest("Removed message"):
+            self.master.db.delete_msg_log(master_msg_id="500.2")
+            self.assertIsNone(self.master.get_message_by_id("500.2"))
@@ -0,0 +1,60 @@
+import io
+from unittest.mock import patch, Mock
+
+from ehforwarderbot import EFBMsg
+from ehforwarderbot.constants import MsgType
+
+from efb_telegram_master import utils
+from efb_telegram_master.mirror import MirrorManager
+from .base_test import StandardChannelTest
+
+
+class SlaveMessageTest(StandardChannelTest):
+    def make_video_message(self) -> EFBMsg:
+        msg = EFBMsg()
+        msg.uid = "video_message"
+        msg.type = MsgType.Video
+        msg.chat = self.slave.get_chats()[0]
+        msg.text = "Video"
+        msg.file = io.BytesIO(b"video content")
+        return msg
+
+    def test_mirror_targets(self):
+        with self.subTest("No mirror with a single admin"):
+            self.assertEqual(MirrorManager.load_targets({'admins': [1]}), [])
+        with self.subTest("Mirror to the second admin by default"):
+            self.assertEqual([i.chat_id for i in MirrorManager.load_targets({'admins': [1, 2]})], [2])
+
+        msg = self.make_video_message()
+        chat = utils.chat_id_to_str(chat=msg.chat)
+        targets = MirrorManager.load_targets({'admins': [1], 'mirrors': [
+            {'chat_id': 2},
+            {'chat_id': 3, 'types': ['Text']},
+            {'chat_id': 4, 'chats': [chat]},
+            {'chat_id': 5, 'exclude_chats': [chat]},
+        ]})
+        self.assertEqual([i.chat_id for i in targets if i.match(msg)], [2, 4])
+
+    @patch('telegram.Bot.send_video')
+    def test_mirror_media_by_file_id(self, mock_send_video: Mock):
+        mock_send_video.return_value = Mock(video=Mock(file_id='video_file_id'))
+        msg = self.make_video_message()
+
+        with patch.dict(self.master.config, mirrors=[{'chat_id': 2}, {'chat_id': 3, 'types': ['Text']}]):
+            mirrors = MirrorManager(self.master)
+        with patch.object(self.master.slave_messages, 'mirrors', mirrors):
+            tg_msg = self.master.slave_messages.slave_message_video(msg, '0', 'Header', target_msg_id='10')
+        for executor in mirrors.executors.values():
+            executor.shutdown(wait=True)
+
+        self.assertIs(tg_msg, mock_send_video.return_value)
+        self.assertEqual(mock_send_video.call_count, 2)
+        self.assertEqual(mock_send_video.call_args_list[0][0], ('0', msg.file))
+        self.assertEqual(mock_send_video.call_args_list[1][0], (2, 'video_file_id'))
+        self.assertEqual(mock_send_video.call_args_list[1][1]['caption'], 'Header\nVideo')
+        self.assertNotIn('reply_to_message_id', mock_send_video.call_args_list[1][1])
+
+        with self.subTest("Drop messages after stop"):
+            mirrors.stop()
+            self.assertEqual(mirrors.send(msg, "send_video", 'video_file_id'), [])
+            self.assertEqual(mock_send_video.call_count, 2)
@@ -0,0 +1,41 @@
+import gzip
+import json
+
+from .base_test import StandardChannelTest
+
+
+class SnapshotManagerTest(StandardChannelTest):
+    def write_snapshot(self, data):
+        with gzip.open(str(self.master.snapshot.path), 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    def test_save_and_load(self):
+        self.master.chat_binding.slave_chats_directory[self.slave.channel_id] = self.slave.get_chats()
+        self.assertTrue(self.master.snapshot.save())
+        self.master.chat_binding.slave_chats_directory.clear()
+        self.assertTrue(self.master.snapshot.load())
+        self.assertFalse(self.master.snapshot.path.exists())
+        self.assertEqual([i.chat_uid for i in self.master.chat_binding.slave_chats_directory[self.slave.channel_id]],
+                         [i.chat_uid for i in self.slave.get_chats()])
+        self.master.chat_binding.discard_restored_slave_chats()
+
+    def test_load_malformed(self):
+        chat = self.slave.get_chats()[0]
+        valid_chats = {self.slave.channel_id: [[chat.chat_uid, chat.chat_name, chat.chat_alias, chat.chat_type.value]]}
+        db_state = self.master.db.export_cache_state()
+        snapshots = {
+            "Malformed chat": {"version": 1, "slave_chats": {self.slave.channel_id: [[chat.chat_uid]]}},
+            "Unknown chat type": {"version": 1, "slave_chats": {
+                self.slave.channel_id: [[chat.chat_uid, chat.chat_name, chat.chat_alias, "Nonsense"]]}},
+            "Malformed database state": {"version": 1, "slave_chats": valid_chats,
+                                         "db": dict(db_state, recent_slave_chats={"not a chat": []})},
+            "Wrong field type": {"version": 1, "slave_chats": valid_chats, "db": dict(db_state, msg_log_cache=1)},
+        }
+        for name, data in snapshots.items():
+            with self.subTest(name):
+                self.master.chat_binding.slave_chats_directory.clear()
+                self.write_snapshot(data)
+                self.assertFalse(self.master.snapshot.load())
+                self.assertFalse(self.master.snapshot.path.exists())
+                self.assertEqual(self.master.chat_binding.slave_chats_directory, {})
+                self.assertEqual(self.master.chat_binding.restored_slave_chats, set())